@@ -46,6 +46,7 @@ Write-Output $SETTINGS > .\quizer\quizer\settings.py
 
 python .\quizer\manage.py makemigrations
 python .\quizer\manage.py migrate
+python .\quizer\manage.py ensure_indexes
 
 Write-Host "===========================================Start creating groups==============================================="
 
@@ -1,9 +1,11 @@
 from rest_framework import permissions
 
+from main.decorators import get_user_roles
+
 
 class IsLecturer(permissions.BasePermission):
     message = "Allow access only for users belong to 'lecturer' group"
     allowed_group = 'lecturer'
 
     def has_permission(self, request, view):
-        return request.user.groups.filter(name=self.allowed_group)
+        return self.allowed_group in get_user_roles(request)
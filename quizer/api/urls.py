@@ -12,5 +12,7 @@ urlpatterns = [
     path('test/<test_id>/questions', views.QuestionView.as_view(), name='get_questions'),
     path('test/<test_id>/questions/<str:question_id>', views.QuestionView.as_view(), name='questions_api'),
     path('tests_results/<str:state>', views.TestsResultView.as_view(), name='get_tests_results'),
+    path('items_analysis/', views.ItemsAnalysisView.as_view(), name='get_items_analysis'),
+    path('jobs/<str:job_id>', views.JobView.as_view(), name='get_job'),
     path('running_tests/', views.RunningTestView.as_view(), name='get_running_tests'),
 ]
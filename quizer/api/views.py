@@ -1,5 +1,8 @@
 import json
 
+from bson import ObjectId
+
+from django.conf import settings
 from django.contrib.auth.models import User
 
 from rest_framework.generics import get_object_or_404
@@ -8,7 +11,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from main.models import Subject, Test
-from main import mongo, utils
+from main import jobs, mongo, utils
 from .serializers import SubjectSerializer, TestSerializer
 from .permissions import IsLecturer
 
@@ -38,11 +41,13 @@ class SubjectView(APIView):
             for test in tests:
                 deleted_questions_count += storage.delete_many(test_id=test.id)
             subject.delete()
+            jobs.ensure_workers()
 
             message = "Учебный предмет '%s', %d тестов к нему, а также все " + \
                       "вопросы к тестам в количестве %d были успешно удалены."
             return Response({
-                'success': message % (subject_name, tests_count, deleted_questions_count)
+                'success': message % (subject_name, tests_count, deleted_questions_count),
+                'jobs': storage.media_jobs
             })
         elif pk == 'new':  # POST
             serializer = SubjectSerializer(data=request.data)
@@ -88,8 +93,9 @@ class TestView(APIView):
             running_tests_ids = [test['test_id'] for test in running_tests]
             tests = [t.to_dict() for t in Test.objects.exclude(id__in=running_tests_ids)]
             storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
+            questions_counts = storage.count_by_tests(test_ids=[test['id'] for test in tests])
             for test in tests:
-                test['questions_num'] = len(storage.get_many(test_id=test['id']))
+                test['questions_num'] = questions_counts.get(test['id'], 0)
         elif state == 'all':
             tests = [t.to_dict() for t in Test.objects.all()]
         else:
@@ -109,11 +115,13 @@ class TestView(APIView):
             storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
             deleted_questions_count = storage.delete_many(test_id=test.id)
             test.delete()
+            jobs.ensure_workers()
 
             message = "Тест '%s' по предмету '%s', а также все " + \
                       "вопросы к нему в количестве %d были успешно удалены."
             return Response({
-                'success': message % (test_name, subject_name, deleted_questions_count)
+                'success': message % (test_name, subject_name, deleted_questions_count),
+                'jobs': storage.media_jobs
             })
         elif state == 'new':  # POST
             serializer = TestSerializer(data=request.data)
@@ -148,11 +156,27 @@ class LaunchTestView(APIView):
                            % (test.name, test.tasks_num)
             })
         else:
+            launch_id = ObjectId()
+            storage = mongo.TestsSnapshotsStorage.connect(db=mongo.get_conn())
+            storage.freeze(
+                launch_id=launch_id,
+                questions=questions,
+                answer_keys=[utils.get_answer_key(question) for question in questions])
             storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
             storage.add_running_test(
                 test_id=test.id,
                 lecturer_id=request.user.id,
-                subject_id=test.subject.id)
+                subject_id=test.subject.id,
+                launch_id=launch_id)
+            storage = mongo.JobsStorage.connect(db=mongo.get_conn())
+            pool_size = settings.TEST_VARIANTS_POOL_SIZE
+            for start in range(0, pool_size, settings.TEST_VARIANTS_BATCH_SIZE):
+                storage.add(kind=mongo.JOB_GENERATE_VARIANTS, payload={
+                    'launch_id': launch_id,
+                    'test_id': test.id,
+                    'count': min(settings.TEST_VARIANTS_BATCH_SIZE, pool_size - start)
+                })
+            jobs.ensure_workers()
             message = "Тест '%s' запущен. Состояние его прохождения можно отследить во вкладке 'Запущенные тесты'."
             return Response({
                 'ok': True,
@@ -169,6 +193,12 @@ class QuestionView(APIView):
         test_questions = storage.get_many(test_id=test.id)
         for question in test_questions:
             question['id'] = str(question.pop('_id'))
+        storage = mongo.QuestionsStatsStorage.connect(db=mongo.get_conn())
+        questions_stats = storage.get_many(question_ids=[question['id'] for question in test_questions])
+        for question in test_questions:
+            stats = questions_stats.get(question['id'], {})
+            question['attempts'] = stats.get('attempts', 0)
+            question['right_answers_share'] = stats['right_answers_count'] / stats['attempts'] if stats else None
         return Response({
             'questions': test_questions
         })
@@ -185,9 +215,11 @@ class QuestionView(APIView):
             storage.delete_by_id(
                 question_id=question_id,
                 test_id=int(test_id))
+            jobs.ensure_workers()
             message = "Вопрос '%s' по тесту '%s' был успешно удален."
             return Response({
-                'success': message % (question['formulation'], test.name)
+                'success': message % (question['formulation'], test.name),
+                'jobs': storage.media_jobs
             })
         elif question_id == 'new':  # POST
             try:
@@ -214,14 +246,15 @@ class QuestionView(APIView):
         elif question_id == 'load':  # POST
             try:
                 questions_list = utils.get_questions_list(request)
-                storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
-                for question in questions_list:
-                    storage.add_one(
-                        question=question,
-                        test_id=test.id)
-                message = "Вопросы к тесту '%s' в количестве %d успешно добавлены."
+                result = storage.add_many(
+                    questions=questions_list,
+                    test_id=test.id)
+                message = "Вопросы к тесту '%s' в количестве %d успешно добавлены." % \
+                          (test.name, result['inserted_count'])
+                if result['errors']:
+                    message += " Не удалось добавить вопросов: %d." % len(result['errors'])
                 response = Response({
-                    'success': message % (test.name, len(questions_list))
+                    'success': message
                 })
             except utils.InvalidFileFormatError:
                 message = 'Вопросы не были загружены, так как формат файла неподходящий ' \
@@ -267,10 +300,22 @@ class QuestionView(APIView):
 class TestsResultView(APIView):
     permission_classes = [IsAuthenticated, IsLecturer]
 
-    def get(self, _, state):
+    def get(self, request, state):
         storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
         if state == 'all':
-            results = storage.get_all_tests_results()
+            try:
+                page_size = min(
+                    int(request.query_params.get('page_size', settings.RESULTS_PAGE_SIZE)),
+                    settings.RESULTS_MAX_PAGE_SIZE)
+                page = storage.get_tests_results_page(
+                    filters=utils.get_results_filters(request.query_params),
+                    cursor=request.query_params.get('cursor', ''),
+                    page_size=max(page_size, 1))
+            except ValueError as e:
+                return Response({
+                    'error': f'Некорректные параметры запроса: {e}.'
+                })
+            return Response(page)
         else:
             test_result = storage.get_test_result(_id=state)
             results = [test_result] if test_result else []
@@ -279,6 +324,51 @@ class TestsResultView(APIView):
         })
 
 
+class ItemsAnalysisView(APIView):
+    permission_classes = [IsAuthenticated, IsLecturer]
+
+    def get(self, request):
+        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
+        try:
+            if not request.query_params.get('launch_id') and not request.query_params.get('test_id'):
+                raise ValueError('не указан launch_id или test_id')
+            analysis = storage.get_items_analysis(
+                launch_id=request.query_params.get('launch_id', ''),
+                test_id=int(request.query_params.get('test_id', 0)))
+        except ValueError as e:
+            return Response({
+                'error': f'Некорректные параметры запроса: {e}.'
+            })
+        if analysis:
+            storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
+            formulations = {
+                str(question['_id']): question['formulation']
+                for question in storage.get_many(test_id=analysis['test_id'])
+            }
+            for question in analysis['questions']:
+                question['formulation'] = formulations.get(question['id'], '')
+        return Response(analysis)
+
+
+class JobView(APIView):
+    permission_classes = [IsAuthenticated, IsLecturer]
+
+    def get(self, _, job_id):
+        storage = mongo.JobsStorage.connect(db=mongo.get_conn())
+        job = storage.get(job_id=job_id)
+        if job is None:
+            return Response({
+                'error': 'Фоновая задача не найдена.'
+            })
+        return Response({
+            'id': str(job['_id']),
+            'kind': job['kind'],
+            'status': job['status'],
+            'attempts': job['attempts'],
+            'error': job['error']
+        })
+
+
 class RunningTestView(APIView):
     permission_classes = [IsAuthenticated, IsLecturer]
 
@@ -5,3 +5,9 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     name = 'main'
     verbose_name = 'Quizer'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import m2m_changed
+        from .decorators import invalidate_user_roles
+        m2m_changed.connect(invalidate_user_roles, sender=User.groups.through)
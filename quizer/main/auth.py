@@ -0,0 +1,194 @@
+# pylint: disable=import-error, global-statement, invalid-name, relative-beyond-top-level
+"""
+Verification of users JWT issued by authorization service (see utils.get_auth_data).
+Public keys are fetched from settings.AUTH_URL by key id from token header using pooled
+HTTP session and cached in process for AUTH_KEYS_TTL seconds, keys close to expiry are
+refreshed in background, so rotated keys are picked up without blocking logins.
+Unknown key ids are cached for AUTH_MISSING_KEY_TTL seconds. Claims of verified tokens
+are cached in LRU until tokens expire, so repeated logins skip RS256 verification
+"""
+import time
+import threading
+from collections import OrderedDict
+
+import jwt
+import requests
+import requests.adapters
+
+from django.conf import settings
+
+
+__session = None
+__session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Get process-wide HTTP session of authorization service with keep-alive connections pool
+
+    :return: <requests.Session>
+    """
+    global __session
+    with __session_lock:
+        if __session is None:
+            __session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.AUTH_HTTP_POOL_SIZE)
+            __session.mount('http://', adapter)
+            __session.mount('https://', adapter)
+        return __session
+
+
+class PublicKeysCache:
+    """
+    Process-wide cache of public keys of authorization service keyed by key id
+
+    _entries:    <dict>, {key_id: (public_key or None if key is unknown, expires_at)}
+    _locks:      <dict>, {key_id: <Lock>}, only one request of missing key is made at a time
+    _refreshing: <set: str>, key ids refreshed in background
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._locks = {}
+        self._refreshing = set()
+
+    def get(self, key_id: str) -> str:
+        """
+        Get public key, fetch it if it is not cached or expired
+
+        :param key_id: <str>, 'kid' header of token
+        :return: <str>, PEM of public key
+        :raise: jwt.exceptions.InvalidKeyError if key is unknown, requests.RequestException
+        """
+        entry = self._entries.get(key_id)
+        if entry is None or entry[1] <= time.monotonic():
+            with self._lock:
+                key_lock = self._locks.setdefault(key_id, threading.Lock())
+            with key_lock:
+                entry = self._entries.get(key_id)
+                if entry is None or entry[1] <= time.monotonic():
+                    entry = self._fetch(key_id)
+        elif entry[0] is not None and entry[1] - time.monotonic() < settings.AUTH_KEYS_REFRESH_AHEAD:
+            self._refresh(key_id)
+        if entry[0] is None:
+            raise jwt.exceptions.InvalidKeyError('Unknown key id %s' % key_id)
+        return entry[0]
+
+    def _fetch(self, key_id: str) -> tuple:
+        """
+        Request public key and cache it
+
+        :param key_id: <str>
+        :return: <tuple>, (public_key or None, expires_at)
+        """
+        response = get_session().get(settings.AUTH_URL + key_id, timeout=settings.AUTH_TIMEOUT)
+        if response.status_code == 404:
+            entry = (None, time.monotonic() + settings.AUTH_MISSING_KEY_TTL)
+        else:
+            response.raise_for_status()
+            entry = (response.text, time.monotonic() + settings.AUTH_KEYS_TTL)
+        self._entries[key_id] = entry
+        return entry
+
+    def _refresh(self, key_id: str) -> None:
+        """
+        Fetch key in background thread, cached key is used until it is fetched
+        """
+        with self._lock:
+            if key_id in self._refreshing:
+                return
+            self._refreshing.add(key_id)
+
+        def refresh():
+            try:
+                self._fetch(key_id)
+            except requests.RequestException as e:
+                print('%s - ошибка при обновлении открытого ключа %s' % (e, key_id))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key_id)
+
+        threading.Thread(target=refresh, name='auth-key-refresh', daemon=True).start()
+
+    def clear(self) -> None:
+        """
+        Drop all cached keys
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class VerifiedTokensCache:
+    """
+    Process-wide LRU cache of claims of verified tokens
+
+    _entries: <OrderedDict>, {token: (claims, expires_at)}, expires_at is UNIX time
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, token: str):
+        """
+        Get claims of token verified before if it is not expired
+
+        :param token: <str>
+        :return: <dict> or None
+        """
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token: str, claims: dict) -> None:
+        """
+        Cache claims of verified token until its 'exp' claim, for AUTH_KEYS_TTL seconds
+        if it has no 'exp' claim
+
+        :param token: <str>
+        :param claims: <dict>
+        """
+        expires_at = claims.get('exp', time.time() + settings.AUTH_KEYS_TTL)
+        with self._lock:
+            self._entries[token] = (claims, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > settings.AUTH_TOKENS_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Drop all cached claims
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+keys_cache = PublicKeysCache()
+tokens_cache = VerifiedTokensCache()
+
+
+def decode(token: str) -> dict:
+    """
+    Verify RS256 token with public key of authorization service
+
+    :param token: <str>, JWT
+    :return: <dict>, claims
+    :raise: jwt.InvalidTokenError, jwt.exceptions.InvalidKeyError, requests.RequestException
+    """
+    claims = tokens_cache.get(token)
+    if claims is None:
+        key_id = jwt.get_unverified_header(token).get('kid')
+        if not key_id:
+            raise jwt.DecodeError('Token has no key id')
+        claims = jwt.decode(token, keys_cache.get(key_id), algorithms=['RS256'])
+        tokens_cache.put(token, claims)
+    return claims
@@ -1,38 +1,247 @@
+import io
+import abc
 import json
-from asgiref.sync import async_to_sync
+import asyncio
+import inspect
+from asgiref.sync import sync_to_async
 
-from channels.generic.websocket import WebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.core.handlers.asgi import ASGIRequest
+from django.middleware.csrf import CsrfViewMiddleware
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+from django.shortcuts import render, redirect, reverse
 
+from . import journal
+from . import mongo
+from . import mongo_async
+from . import publisher
+from . import utils
+from .decorators import get_user_roles
+from .models import Test
 
-class RunningTestsConsumer(WebsocketConsumer):
 
-    group_name: str = 'running_tests'
+class RunningTestsConsumer(AsyncWebsocketConsumer):
+    """
+    Websocket sending running tests updates found by main.publisher
+    """
 
-    def connect(self):
-        async_to_sync(self.channel_layer.group_add)(
+    group_name: str = publisher.GROUP_NAME
+
+    async def connect(self):
+        await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
-        self.accept()
+        await self.accept()
+        publisher.ensure_publisher(self.channel_layer)
 
-    def disconnect(self, code):
-        async_to_sync(self.channel_layer.group_discard)(
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(
             self.group_name,
             self.channel_name
         )
 
-    def receive(self, text_data=None, bytes_data=None):
-        received_dict = json.loads(text_data)
-        async_to_sync(self.channel_layer.group_send)(
+    async def action(self, event):
+        action = event['action']
+        await self.send(text_data=json.dumps({
+            'action': action
+        }))
+
+
+class AttemptTimerConsumer(AsyncWebsocketConsumer):
+    """
+    Websocket timer of student attempt, replaces polling of main.views.get_left_time.
+    Sends time left once on connect and every settings.TEST_TIMER_SYNC_INTERVAL
+    seconds to correct clock drift, sends stop when test is stopped by lecturer
+    """
+
+    deadline: float = 0
+    group_name: str = ''
+    sync_task = None
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.close()
+            return
+        loop = asyncio.get_event_loop()
+        token = utils.get_attempt_token(cookies=self.scope.get('cookies', {}), user_id=user.id)
+        if token is not None:
+            self.deadline = loop.time() + utils.get_token_left_time(token)
+            test_id = token['test_id']
+        else:  # attempt was started before tokens were issued
+            storage = mongo_async.AsyncRunningTestsAnswersStorage.connect(db=mongo_async.get_async_conn())
+            attempt = await storage.get(user_id=user.id)
+            if attempt is None:
+                await self.close()
+                return
+            self.deadline = loop.time() + mongo.RunningTestsAnswersStorage.get_attempt_left_time(attempt)
+            test_id = attempt['test_id']
+        self.group_name = publisher.ATTEMPTS_GROUP_NAME % test_id
+        await self.channel_layer.group_add(
             self.group_name,
-            {
-                'type': 'action',
-                'action': received_dict['action']
-            }
+            self.channel_name
         )
+        await self.accept()
+        publisher.ensure_publisher(self.channel_layer)
+        await self.send_time_left()
+        self.sync_task = loop.create_task(self.sync())
 
-    def action(self, event):
-        action = event['action']
-        self.send(text_data=json.dumps({
-            'action': action
+    async def disconnect(self, code):
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+        if self.group_name:
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+
+    async def sync(self):
+        """
+        Send time left periodically
+        """
+        while True:
+            await asyncio.sleep(settings.TEST_TIMER_SYNC_INTERVAL)
+            await self.send_time_left()
+
+    async def send_time_left(self):
+        await self.send(text_data=json.dumps({
+            'action': 'time left',
+            'time_left': self.deadline - asyncio.get_event_loop().time()
         }))
+
+    async def stop(self, event):
+        await self.send(text_data=json.dumps({
+            'action': 'stop'
+        }))
+
+
+class AsyncViewConsumer(AsyncHttpConsumer, metaclass=abc.ABCMeta):
+    """
+    Base class for views served on the event loop using main.mongo_async storages.
+    HTTP request is converted to Django HttpRequest, so forms, CSRF protection
+    and templates work the same way as in synchronous views from main.views
+
+    allowed_roles: groups allowed to use view, any authenticated user if empty
+    post_only:     redirect to available tests page if method is not 'POST'
+    """
+
+    allowed_roles: list = []
+    post_only: bool = False
+
+    @classmethod
+    def as_asgi(cls, **initkwargs):
+        """
+        Get ASGI application of consumer, routes to consumers without 'view' can not be registered
+        """
+        if inspect.isabstract(cls):
+            raise ImproperlyConfigured("%s must implement 'view' method" % cls.__name__)
+        return super().as_asgi(**initkwargs)
+
+    async def handle(self, body):
+        request = ASGIRequest(self.scope, io.BytesIO(body))
+        request.user = self.scope['user']
+        request.session = self.scope['session']
+        response = await self.get_response(request)
+        headers = [(name.encode('ascii'), value.encode('latin1')) for name, value in response.items()]
+        for cookie in response.cookies.values():
+            headers.append((b'Set-Cookie', cookie.output(header='').strip().encode('ascii')))
+        await self.send_response(response.status_code, response.content, headers=headers)
+
+    async def get_response(self, request):
+        """
+        Check access rights and CSRF token and get response of 'view'
+        """
+        if self.post_only and request.method != 'POST':
+            return redirect(reverse('main:available_tests'))
+        if not request.user.is_authenticated:
+            return redirect(reverse('main:login_page'))
+        if self.allowed_roles:
+            roles = await database_sync_to_async(get_user_roles)(request)
+            if request.session.modified:  # roles were cached in session
+                await database_sync_to_async(request.session.save)()
+            if not roles & set(self.allowed_roles):
+                return redirect(reverse('main:available_tests'))
+        csrf_middleware = CsrfViewMiddleware()
+        csrf_middleware.process_request(request)
+        response = csrf_middleware.process_view(request, None, (), {})
+        if response is None:
+            response = await self.view(request)
+        return csrf_middleware.process_response(request, response)
+
+    @abc.abstractmethod
+    async def view(self, request):
+        """
+        Get response for authorized request
+        """
+
+
+class LeftTimeConsumer(AsyncViewConsumer):
+    """Asyncio version of main.views.get_left_time"""
+
+    async def view(self, request):
+        token = utils.get_attempt_token(cookies=request.COOKIES, user_id=request.user.id)
+        if token is not None:
+            return JsonResponse({'time_left': utils.get_token_left_time(token)})
+        storage = mongo_async.AsyncRunningTestsAnswersStorage.connect(db=mongo_async.get_async_conn())
+        time_left = await storage.get_left_time(user_id=request.user.id)
+        if time_left is not None:
+            return JsonResponse({'time_left': time_left})
+        return JsonResponse({})
+
+
+class StudentRunTestConsumer(AsyncViewConsumer):
+    """Asyncio version of main.views.student_run_test"""
+
+    allowed_roles = ['student']
+
+    async def view(self, request):
+        test = await database_sync_to_async(Test.objects.get)(id=int(request.POST['test_id']))
+        storage = mongo_async.AsyncTestsResultsStorage.connect(db=mongo_async.get_async_conn())
+        launch_id = await storage.get_running_launch_id(test_id=test.id)
+        storage = mongo_async.AsyncTestsVariantsStorage.connect(db=mongo_async.get_async_conn())
+        variant = await storage.claim(launch_id=launch_id) if launch_id else None
+        if variant is None:  # pool of variants is empty
+            storage = mongo_async.AsyncTestsSnapshotsStorage.connect(db=mongo_async.get_async_conn())
+            snapshot = await storage.sample(launch_id=launch_id, k=test.tasks_num) if launch_id else []
+            storage = mongo_async.AsyncQuestionsStorage.connect(db=mongo_async.get_async_conn())
+            test_questions = await storage.sample(test_id=test.id, k=test.tasks_num) if not snapshot else []
+            variant = await sync_to_async(utils.make_variant)(
+                test=test, snapshot=snapshot, test_questions=test_questions)
+            if variant is None:
+                return redirect(reverse('main:available_tests'))
+
+        storage = mongo_async.AsyncRunningTestsAnswersStorage.connect(db=mongo_async.get_async_conn())
+        attempt_id = await storage.start(
+            right_answers=variant['right_answers'],
+            test_id=test.id,
+            user_id=request.user.id,
+            test_duration=test.duration)
+        return utils.get_attempt_response(request=request, test=test, variant=variant, attempt_id=attempt_id)
+
+
+class PassedTestConsumer(AsyncViewConsumer):
+    """Asyncio version of main.views.PassedTestView"""
+
+    allowed_roles = ['student']
+    post_only = True
+
+    async def view(self, request):
+        if 'test-passed' not in request.POST:
+            return redirect(reverse('main:available_tests'))
+        storage = mongo_async.AsyncRunningTestsAnswersStorage.connect(db=mongo_async.get_async_conn())
+        attempt = await storage.pop(user_id=request.user.id)
+        result, context = utils.grade_submission(request=request, attempt=attempt)
+        if result is not None:
+            await journal.submit_result_async(
+                test_id=attempt['test_id'],
+                test_result=result)
+        if context is None:
+            return redirect(reverse('main:available_tests'))
+        response = await database_sync_to_async(render)(request, 'main/student/testingResult.html', context)
+        response.delete_cookie(utils.ATTEMPT_TOKEN_COOKIE)
+        return response
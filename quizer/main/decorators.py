@@ -2,9 +2,64 @@
 """
 Decorators for differentiate user rights
 """
+import time
+
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import redirect, reverse
 
 
+ROLES_SESSION_KEY = 'roles'
+ROLES_CHANGED_CACHE_KEY = 'roles_changed_%d'
+
+
+def get_user_roles(request) -> frozenset:
+    """
+    Get names of groups of user. Groups are read once and cached in session
+    for settings.ROLES_CACHE_TTL seconds or until groups of user are changed,
+    see 'invalidate_user_roles'
+
+    :param request: <HttpRequest> or <rest_framework.request.Request>
+    :return: <frozenset: str>
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return frozenset()
+    session = getattr(request, 'session', None)
+    entry = session.get(ROLES_SESSION_KEY) if session is not None else None
+    now = time.time()
+    if entry is not None and entry['user_id'] == user.id \
+            and now - entry['resolved_at'] < settings.ROLES_CACHE_TTL \
+            and entry['resolved_at'] > cache.get(ROLES_CHANGED_CACHE_KEY % user.id, 0):
+        return frozenset(entry['roles'])
+    roles = list(user.groups.values_list('name', flat=True))
+    if session is not None and session.session_key is not None:  # requests without session are not cached
+        session[ROLES_SESSION_KEY] = {
+            'user_id': user.id,
+            'roles': roles,
+            'resolved_at': now
+        }
+    return frozenset(roles)
+
+
+def invalidate_user_roles(instance, action: str, pk_set: set, **kwargs) -> None:
+    """
+    Receiver of 'm2m_changed' signal of User.groups (see MainConfig.ready), marks roles
+    cached in sessions of users with changed groups as outdated. Marks are stored
+    in Django cache, so sessions of other processes are updated if cache is shared,
+    or in settings.ROLES_CACHE_TTL seconds otherwise.
+    'instance' is Group and 'pk_set' are ids of users if kwargs['reverse'] is True
+    """
+    if action in ('post_add', 'post_remove'):
+        users_ids = pk_set if kwargs['reverse'] else {instance.pk}
+    elif action == 'pre_clear':
+        users_ids = set(instance.user_set.values_list('id', flat=True)) if kwargs['reverse'] else {instance.pk}
+    else:
+        return
+    now = time.time()
+    cache.set_many({ROLES_CHANGED_CACHE_KEY % user_id: now for user_id in users_ids}, settings.ROLES_CACHE_TTL)
+
+
 def unauthenticated_user(view_func):
     """
     Checked if user is authorized
@@ -30,10 +85,8 @@ def allowed_users(allowed_roles: list):
             if request.path == '/ws_running_tests/':
                 return view_func(request, *args, **kwargs)
 
-            is_allowed = False
-            for group in allowed_roles:
-                if request.user.groups.filter(name=group):
-                    is_allowed = True
+            roles = get_user_roles(request)
+            is_allowed = any(group in roles for group in allowed_roles)
 
             if 'admin' in allowed_roles:
                 if request.user.is_authenticated:
@@ -0,0 +1,112 @@
+# pylint: disable=import-error, global-statement, invalid-name, relative-beyond-top-level
+"""
+In-process workers of background jobs queued in 'jobs' collection (see mongo.JobsStorage).
+Slow work, like deleting images of deleted questions or generating variants of
+launched tests, is queued by request handlers after database changes are made,
+and is done by workers started by 'ensure_workers'.
+Failed jobs are retried, jobs of crashed process are taken by workers of other processes
+"""
+import shutil
+import threading
+
+import pymongo.errors
+
+from django.conf import settings
+
+from . import mongo
+from . import utils
+from .models import Test
+
+
+def remove_media_files(payload: dict) -> None:
+    """
+    Delete images released by mongo.QuestionsStorage.remove_media, repeated deletion is harmless
+
+    :param payload: <dict>, {'blobs': <list: str>, 'directories': <list: str>}
+    """
+    mongo.MediaStorage.connect(db=mongo.get_conn()).collect(payload['blobs'])
+    for directory in payload['directories']:
+        try:
+            shutil.rmtree(directory)
+        except FileNotFoundError:
+            pass
+
+
+def generate_variants(payload: dict) -> None:
+    """
+    Add variants of running test to its pool, see mongo.TestsVariantsStorage
+
+    :param payload: <dict>, {'launch_id': <ObjectId>, 'test_id': <int>, 'count': <int>}
+    """
+    test = Test.objects.filter(id=payload['test_id']).first()
+    if test is None:
+        return
+    storage = mongo.TestsSnapshotsStorage.connect(db=mongo.get_conn())
+    variants = []
+    for _ in range(payload['count']):
+        variant = utils.make_variant(
+            test=test,
+            snapshot=storage.sample(launch_id=payload['launch_id'], k=test.tasks_num))
+        if variant is None:  # test was stopped
+            return
+        variants.append(variant)
+    mongo.TestsVariantsStorage.connect(db=mongo.get_conn()).add(launch_id=payload['launch_id'], variants=variants)
+
+
+HANDLERS = {
+    mongo.JOB_REMOVE_MEDIA: remove_media_files,
+    mongo.JOB_GENERATE_VARIANTS: generate_variants,
+}
+
+
+def run_pending() -> int:
+    """
+    Run jobs ready to run until queue is empty
+
+    :return: <int>, number of finished and failed jobs
+    """
+    storage = mongo.JobsStorage.connect(db=mongo.get_conn())
+    jobs_count = 0
+    while True:
+        job = storage.claim()
+        if job is None:
+            return jobs_count
+        try:
+            HANDLERS[job['kind']](job['payload'])
+        except Exception as e:  # pylint: disable=broad-except
+            print('%s - ошибка при выполнении фоновой задачи %s' % (e, job['_id']))
+            storage.fail(job=job, error='%s: %s' % (type(e).__name__, e))
+        else:
+            storage.finish(job=job)
+        jobs_count += 1
+
+
+__wakeup = threading.Event()
+__workers: list = []
+__workers_lock = threading.Lock()
+
+
+def _work() -> None:
+    """
+    Run jobs forever, waiting settings.JOBS_POLL_INTERVAL seconds or wakeup when queue is empty
+    """
+    while True:
+        __wakeup.clear()
+        try:
+            run_pending()
+        except pymongo.errors.PyMongoError as e:
+            print('%s - ошибка при получении фоновых задач' % e)
+        __wakeup.wait(settings.JOBS_POLL_INTERVAL)
+
+
+def ensure_workers() -> None:
+    """
+    Start settings.JOBS_WORKERS workers in current process if they are not started yet
+    and wake them up to run just queued jobs
+    """
+    with __workers_lock:
+        while len(__workers) < settings.JOBS_WORKERS:
+            worker = threading.Thread(target=_work, name='jobs-worker-%d' % len(__workers), daemon=True)
+            worker.start()
+            __workers.append(worker)
+    __wakeup.set()
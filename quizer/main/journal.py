@@ -0,0 +1,216 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Write-behind journal of students results. Submissions are appended to local
+journal file and acknowledged, journal is flushed to MongoDB in background by
+'flush_submissions' management command in submission order using bulk writes.
+Flushed position is stored in '<journal>.offset' file, so journal is replayed
+from it after crash, results already added to MongoDB are not duplicated.
+Lines which can not be decoded, like line merged with partial line of append
+interrupted by crash, are moved to '<journal>.rejected' file and skipped
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from bson import ObjectId, json_util
+
+from django.conf import settings
+
+from . import mongo
+from . import mongo_async
+
+try:
+    import fcntl
+except ImportError:  # Windows, results are written directly to MongoDB
+    fcntl = None
+
+
+class SubmissionsJournal:
+    """
+    Append-only journal of students results, one JSON document per line.
+    Appends are serialized by lock of journal file, flushes - by lock of '<journal>.lock' file
+
+    _path:          path of journal file
+    _offset_path:   path of file with position of first not flushed line
+    _lock_path:     path of flushers lock file
+    _rejected_path: path of file with lines which can not be decoded
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._offset_path = path + '.offset'
+        self._lock_path = path + '.lock'
+        self._rejected_path = path + '.rejected'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def append(self, test_id: int, test_result: dict) -> None:
+        """
+        Durably append passed test result to journal
+
+        :param test_id: <int>
+        :param test_result: <dict>, see mongo.TestsResultsStorage.add_results_to_running_test,
+                            result is dated by current time and gets '_id' used by MongoDB
+        """
+        test_result['date'] = datetime.now() + timedelta(hours=3)
+        test_result['_id'] = ObjectId()
+        line = json_util.dumps({'test_id': test_id, 'result': test_result}) + '\n'
+        with open(self._path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self._offset_path, 'r') as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, offset: int) -> None:
+        tmp_path = self._offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._offset_path)
+
+    def _read_batch(self, offset: int, batch_size: int) -> tuple:
+        """
+        Read up to 'batch_size' complete lines starting from 'offset'
+
+        :return: <tuple>, (entries: <list: tuple>, (test_id, test_result) of decoded lines,
+                                     offset after last read line: <int>)
+        """
+        entries = []
+        try:
+            with open(self._path, 'rb') as f:
+                f.seek(offset)
+                while len(entries) < batch_size:
+                    line = f.readline()
+                    if not line.endswith(b'\n'):  # end of journal or append in progress
+                        break
+                    offset += len(line)
+                    try:
+                        entry = json_util.loads(line.decode('utf-8'))
+                        entries.append((entry['test_id'], entry['result']))
+                    except (ValueError, TypeError, KeyError) as e:
+                        self._reject(line, e)
+        except FileNotFoundError:
+            pass
+        return entries, offset
+
+    def _reject(self, line: bytes, error: Exception) -> None:
+        """
+        Move line which can not be decoded to rejected lines file
+        """
+        print('%s - ошибка при чтении журнала результатов тестирования, строка перенесена в %s' % (
+            error, self._rejected_path))
+        with open(self._rejected_path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate_if_flushed(self, offset: int) -> None:
+        """
+        Empty journal if all its lines are flushed
+        """
+        with open(self._path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_size == offset:
+                # offset is reset first, so crash before truncation only replays flushed results
+                self._write_offset(0)
+                f.truncate(0)
+
+    def flush(self, batch_size: int = 0) -> int:
+        """
+        Add all journaled results to running tests in submission order
+
+        :param batch_size: <int>, number of results added by one bulk write,
+                           settings.SUBMISSIONS_FLUSH_BATCH_SIZE by default
+        :return: <int>, number of flushed journal entries
+        """
+        batch_size = batch_size or settings.SUBMISSIONS_FLUSH_BATCH_SIZE
+        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
+        flushed_count = 0
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            offset = self._read_offset()
+            while True:
+                entries, next_offset = self._read_batch(offset=offset, batch_size=batch_size)
+                if next_offset == offset:
+                    break
+                if entries:
+                    storage.add_results_to_running_tests(tests_results=entries)
+                self._write_offset(next_offset)
+                offset = next_offset
+                flushed_count += len(entries)
+            if offset:
+                self._truncate_if_flushed(offset)
+        return flushed_count
+
+
+def get_journal():
+    """
+    Get journal of students results of current settings
+
+    :return: <SubmissionsJournal> or None if journal is disabled
+    """
+    if not settings.SUBMISSIONS_JOURNAL_PATH or fcntl is None:
+        return None
+    return SubmissionsJournal(settings.SUBMISSIONS_JOURNAL_PATH)
+
+
+def submit_result(test_id: int, test_result: dict) -> None:
+    """
+    Add passed test result to running test through journal, or directly if journal is disabled
+
+    :param test_id: <int>
+    :param test_result: <dict>, see mongo.TestsResultsStorage.add_results_to_running_test
+    """
+    journal = get_journal()
+    if journal is None:
+        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
+        storage.add_results_to_running_test(test_result=test_result, test_id=test_id)
+    else:
+        journal.append(test_id=test_id, test_result=test_result)
+
+
+async def submit_result_async(test_id: int, test_result: dict) -> None:
+    """
+    Asyncio version of 'submit_result', journal is appended in thread
+
+    :param test_id: <int>
+    :param test_result: <dict>, see mongo.TestsResultsStorage.add_results_to_running_test
+    """
+    journal = get_journal()
+    if journal is None:
+        storage = mongo_async.AsyncTestsResultsStorage.connect(db=mongo_async.get_async_conn())
+        await storage.add_results_to_running_test(test_result=test_result, test_id=test_id)
+    else:
+        await sync_to_async(journal.append)(test_id=test_id, test_result=test_result)
+
+
+def flush_submissions() -> int:
+    """
+    Flush journal of students results, if it is enabled
+
+    :return: <int>, number of flushed results
+    """
+    journal = get_journal()
+    return journal.flush() if journal is not None else 0
+
+
+def run_flusher(interval: float = 0) -> None:
+    """
+    Flush journal forever, sleeping 'interval' seconds between flushes
+
+    :param interval: <float>, settings.SUBMISSIONS_FLUSH_INTERVAL by default
+    """
+    while True:
+        try:
+            flush_submissions()
+        except Exception as e:  # pylint: disable=broad-except
+            print('%s - ошибка при сохранении результатов тестирования' % e)
+        time.sleep(interval or settings.SUBMISSIONS_FLUSH_INTERVAL)
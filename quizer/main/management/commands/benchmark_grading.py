@@ -0,0 +1,149 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command measuring grading of random submissions with compiled
+answer keys against grading of attempts started before answer keys were compiled
+and against answer keys encoded as options indexes: bitsets of right options
+and permutations of sequences. Selected options are sent as texts, so indexes
+grading has to map them to indexes first, map of option text to index can not
+be stored in MongoDB, because options may contain '.' and '$'
+"""
+import random
+import timeit
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import utils
+from ...models import QuestionType
+
+
+def compile_indexes_keys(test_questions: list, right_answers: dict) -> dict:
+    """
+    Encode answer keys as indexes of options in order they are shown
+
+    :param test_questions: <list> of questions with shuffled options
+    :param right_answers: <dict>, see utils.get_right_answers
+    :return: <dict>, {question_num: {
+        'options': <list: str>,
+        'is_sequence': <bool>,
+        'right_order': <list: int>, indexes of options of sequence in right order,
+        'right_mask': <int>, bitset of indexes of right options,
+        'right_count': <int>
+    }}
+    """
+    indexes_keys = {}
+    for question, (question_num, answer_key) in zip(test_questions, right_answers.items()):
+        options = [option['option'] for option in question['options']]
+        right_indexes = [options.index(option) for option in answer_key['right_options']]
+        indexes_keys[question_num] = {
+            'options': options,
+            'is_sequence': answer_key['is_sequence'],
+            'right_order': right_indexes,
+            'right_mask': sum(1 << i for i in right_indexes),
+            'right_count': len(right_indexes)
+        }
+    return indexes_keys
+
+
+def grade_indexes(answers: dict, indexes_keys: dict) -> int:
+    """
+    Count right answers with answer keys encoded by 'compile_indexes_keys'
+
+    :param answers: <dict>, {question_num: <list: str>, selected options}
+    :param indexes_keys: <dict>
+    :return: <int>, number of right answers
+    """
+    right_answers_count = 0
+    for question_num, answer_key in indexes_keys.items():
+        selected = answers.get(question_num)
+        if selected is None:
+            continue
+        option_indexes = {option: i for i, option in enumerate(answer_key['options'])}
+        if answer_key['is_sequence']:
+            right_answers_count += [option_indexes.get(option) for option in selected] == answer_key['right_order']
+            continue
+        mask = 0
+        for option in selected:
+            if option not in option_indexes:
+                break
+            mask |= 1 << option_indexes[option]
+        else:
+            right_answers_count += mask == answer_key['right_mask'] and len(selected) == answer_key['right_count']
+    return right_answers_count
+
+
+class Command(BaseCommand):
+    help = 'Measure grading of random submissions with compiled, uncompiled and indexes answer keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=50, help='questions in test')
+        parser.add_argument('--options', type=int, default=6, help='options of every question')
+        parser.add_argument('--submissions', type=int, default=2000, help='graded submissions')
+
+    def handle(self, *args, **options):
+        test_questions = []
+        for i in range(options['questions']):
+            question_options = [{
+                'option': 'Вариант ответа %d на вопрос %d' % (j + 1, i + 1),
+                'is_true': random.random() < 0.5,
+                'num': str(j + 1)
+            } for j in range(options['options'])]
+            random.shuffle(question_options)
+            test_questions.append({
+                '_id': ObjectId(),
+                'type': random.choice([QuestionType.REGULAR, QuestionType.SEQUENCE]),
+                'options': question_options
+            })
+        right_answers = utils.get_right_answers(test_questions)
+        uncompiled_right_answers = {
+            question_num: {'right_answers': answer_key['right_answers'], 'id': answer_key['id']}
+            for question_num, answer_key in right_answers.items()
+        }
+
+        submissions = []
+        for _ in range(options['submissions']):
+            answers = {}
+            for question, (question_num, answer_key) in zip(test_questions, right_answers.items()):
+                selected = [option['option'] for option in question['options']]
+                if answer_key['is_sequence']:
+                    random.shuffle(selected)
+                else:
+                    selected = random.sample(selected, random.randint(1, len(selected)))
+                answers[question_num] = selected
+            submissions.append(answers)
+
+        def grade(batch: list, keys: dict) -> None:
+            for answers in batch:
+                utils.grade_answers(
+                    answers=answers,
+                    right_answers=keys,
+                    test_duration=0,
+                    time_left=0,
+                    user_id=0,
+                    username='')
+
+        indexes_keys = compile_indexes_keys(test_questions, right_answers)
+        for answers in submissions:
+            result = utils.grade_answers(
+                answers=answers,
+                right_answers=right_answers,
+                test_duration=0,
+                time_left=0,
+                user_id=0,
+                username='')
+            if grade_indexes(answers, indexes_keys) != result['right_answers_count']:
+                raise CommandError('Indexes answer keys grade submissions differently')
+
+        uncompiled_time = min(timeit.repeat(lambda: grade(submissions, uncompiled_right_answers), number=1, repeat=5))
+        compiled_time = min(timeit.repeat(lambda: grade(submissions, right_answers), number=1, repeat=5))
+        indexes_time = min(timeit.repeat(
+            lambda: [grade_indexes(answers, indexes_keys) for answers in submissions], number=1, repeat=5))
+        self.stdout.write('Graded %d submissions of %d questions.' % (options['submissions'], options['questions']))
+        self.stdout.write('Uncompiled answer keys: %.1f us per submission' % (
+            uncompiled_time / options['submissions'] * 1e6))
+        self.stdout.write('Compiled answer keys: %.1f us per submission' % (
+            compiled_time / options['submissions'] * 1e6))
+        self.stdout.write('Indexes answer keys: %.1f us per submission' % (
+            indexes_time / options['submissions'] * 1e6))
+        self.stdout.write('Speedup: %.2fx' % (uncompiled_time / compiled_time))
+        self.stdout.write('Compiled against indexes: %.2fx' % (indexes_time / compiled_time))
@@ -0,0 +1,17 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command creating missing renditions of images stored before renditions were configured
+"""
+from django.core.management.base import BaseCommand
+
+from ... import media
+from ... import mongo
+
+
+class Command(BaseCommand):
+    help = 'Create missing renditions of questions images in media store'
+
+    def handle(self, *args, **options):
+        paths = mongo.MediaStorage.connect(db=mongo.get_conn()).get_paths()
+        media.render_all(paths)
+        self.stdout.write('Processed %d images.' % len(paths))
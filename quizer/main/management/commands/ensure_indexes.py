@@ -0,0 +1,29 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command creating declared MongoDB indexes
+"""
+from django.core.management.base import BaseCommand
+
+from ... import mongo
+
+
+class Command(BaseCommand):
+    help = 'Create declared MongoDB indexes and report query shapes without index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report query shapes without index, do not create indexes')
+
+    def handle(self, *args, **options):
+        db = mongo.get_conn()
+        if not options['check']:
+            for collection_name, indexes in mongo.ensure_indexes(db).items():
+                self.stdout.write("Collection '%s' indexes: %s" % (collection_name, ', '.join(indexes)))
+        unindexed = mongo.get_unindexed_query_shapes(db)
+        for collection_name, shapes in unindexed.items():
+            for shape in shapes:
+                self.stderr.write("Collection '%s': no index for query on (%s)" % (collection_name, ', '.join(shape)))
+        if not unindexed:
+            self.stdout.write(self.style.SUCCESS('All query shapes are indexed.'))
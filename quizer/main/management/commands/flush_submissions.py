@@ -0,0 +1,28 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command flushing journal of students results to MongoDB
+"""
+from django.core.management.base import BaseCommand
+
+from ... import journal
+
+
+class Command(BaseCommand):
+    help = 'Add journaled students results to running tests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Run forever, flushing journal every --interval seconds')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Interval between flushes in seconds, SUBMISSIONS_FLUSH_INTERVAL setting by default')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            journal.run_flusher(interval=options['interval'])
+        flushed_count = journal.flush_submissions()
+        self.stdout.write('Flushed %d students results.' % flushed_count)
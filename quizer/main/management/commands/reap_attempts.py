@@ -0,0 +1,33 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command grading expired tests attempts
+"""
+from django.core.management.base import BaseCommand
+
+from ... import reaper
+
+
+class Command(BaseCommand):
+    help = 'Grade expired and abandoned tests attempts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Run forever, checking expired attempts every --interval seconds')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Interval between checks in seconds, REAPER_INTERVAL setting by default')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            reaper.run_reaper(interval=options['interval'])
+        graded_count = 0
+        while True:
+            batch_count = reaper.reap_expired_attempts()
+            graded_count += batch_count
+            if not batch_count:
+                break
+        self.stdout.write('Graded %d expired attempts.' % graded_count)
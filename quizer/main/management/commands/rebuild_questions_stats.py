@@ -0,0 +1,16 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command recounting questions statistics counters
+"""
+from django.core.management.base import BaseCommand
+
+from ... import mongo
+
+
+class Command(BaseCommand):
+    help = "Recount 'questions_stats' counters over all students results"
+
+    def handle(self, *args, **options):
+        storage = mongo.QuestionsStatsStorage.connect(db=mongo.get_conn())
+        results_count = storage.rebuild()
+        self.stdout.write('Counted %d students results.' % results_count)
@@ -0,0 +1,16 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Management command moving students results out of tests launches documents
+"""
+from django.core.management.base import BaseCommand
+
+from ... import mongo
+
+
+class Command(BaseCommand):
+    help = "Move students results embedded into 'tests_results' documents to 'tests_submissions' collection"
+
+    def handle(self, *args, **options):
+        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
+        moved_count = storage.split_embedded_results()
+        self.stdout.write('Moved results of %d tests launches.' % moved_count)
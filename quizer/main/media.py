@@ -0,0 +1,110 @@
+# pylint: disable=import-error, global-statement, invalid-name, relative-beyond-top-level
+"""
+Derivatives pipeline of questions images. Renditions of images from media store
+(see mongo.MediaStorage) with sizes capped by settings.MEDIA_RENDITIONS are generated
+on upload in a pool of workers and cached on disk next to originals, originals are
+kept for question editor. Pages with images choose rendition by 'image_url' template tag
+"""
+import os
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from django.conf import settings
+
+from .mongo import MediaStorage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is not installed, originals are shown
+    Image = None
+
+
+__executor = None
+__executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Get process-wide pool of renditions workers, Pillow releases GIL while
+    decoding and resizing images, so images are processed in parallel
+
+    :return: <ThreadPoolExecutor>
+    """
+    global __executor
+    with __executor_lock:
+        if __executor is None:
+            __executor = ThreadPoolExecutor(
+                max_workers=settings.MEDIA_RENDITION_WORKERS,
+                thread_name_prefix='renditions')
+        return __executor
+
+
+def render(path: str, rendition: str) -> bool:
+    """
+    Create rendition of image if it does not exist yet. Image not exceeding
+    rendition size is linked to rendition path as is
+
+    :param path: <str>, path of image in media store
+    :param rendition: <str>, name of rendition from settings.MEDIA_RENDITIONS
+    :return: <bool>, True if rendition exists
+    """
+    rendition_path = MediaStorage.get_rendition_path(path, rendition)
+    if Image is None or rendition_path is None:
+        return False
+    full_path = Path(settings.MEDIA_ROOT) / path
+    full_rendition_path = Path(settings.MEDIA_ROOT) / rendition_path
+    if full_rendition_path.exists():
+        return True
+    max_size = settings.MEDIA_RENDITIONS[rendition]
+    tmp_path = full_rendition_path.with_name(f'{full_rendition_path.name}.{ObjectId()}.tmp')
+    try:
+        with Image.open(full_path) as image:
+            if max(image.size) <= max_size or getattr(image, 'is_animated', False):
+                try:
+                    os.link(full_path, tmp_path)
+                except OSError:
+                    shutil.copyfile(full_path, tmp_path)
+            else:
+                image_format = image.format
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((max_size, max_size), Image.LANCZOS)
+                image.save(tmp_path, format=image_format, quality=settings.MEDIA_RENDITION_QUALITY)
+        os.replace(tmp_path, full_rendition_path)
+    except OSError as e:  # missing file or not an image
+        print('%s - ошибка при создании уменьшенной копии изображения %s' % (e, path))
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return False
+    return True
+
+
+def render_all(paths: list) -> None:
+    """
+    Create all renditions of images in workers pool and wait for them
+
+    :param paths: <list: str>, paths of images in media store
+    """
+    futures = [
+        get_executor().submit(render, path, rendition)
+        for path in set(paths)
+        for rendition in settings.MEDIA_RENDITIONS
+    ]
+    for future in futures:
+        future.result()
+
+
+def get_image_url(path: str, rendition: str) -> str:
+    """
+    Get URL of rendition of image, or URL of original if rendition was not created
+
+    :param path: <str>, path of image relative to MEDIA_ROOT
+    :param rendition: <str>, name of rendition from settings.MEDIA_RENDITIONS
+    :return: <str>
+    """
+    rendition_path = MediaStorage.get_rendition_path(path, rendition)
+    if rendition_path is not None and os.path.exists(os.path.join(settings.MEDIA_ROOT, rendition_path)):
+        return settings.MEDIA_URL + rendition_path
+    return settings.MEDIA_URL + path
@@ -2,27 +2,170 @@
 """
 Classes for working with MongoDB and objects stored in it
 """
-import shutil
+import os
+import copy
+import base64
+import hashlib
+import itertools
+import random
+import threading
 from pathlib import Path
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import pymongo
+import pymongo.errors
+import pymongo.monitoring
 from bson import ObjectId, errors
 from django.conf import settings
 from .models import Test, QuestionType
 
-__db_conn: pymongo.database.Database = None
+
+class PoolStatsListener(pymongo.monitoring.ConnectionPoolListener):
+    """
+    Connection pool events listener, collects counters for 'get_pool_stats'
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {
+            'pools_created': 0,
+            'pools_cleared': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'connections_checked_out': 0,
+            'connections_checked_in': 0,
+            'checkout_failures': 0,
+        }
+
+    def _inc(self, counter: str) -> None:
+        with self._lock:
+            self.stats[counter] += 1
+
+    def pool_created(self, event):
+        self._inc('pools_created')
+
+    def pool_cleared(self, event):
+        self._inc('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc('checkout_failures')
+
+    def connection_checked_out(self, event):
+        self._inc('connections_checked_out')
+
+    def connection_checked_in(self, event):
+        self._inc('connections_checked_in')
+
+
+class ConnectionManager:
+    """
+    Process-wide manager of MongoClient objects - one pooled client per
+    (host, port) and worker process. Clients created before fork are
+    dropped in the child process, so pools are never shared between processes.
+
+    _pid:       id of process which owns clients
+    _clients:   <dict>, {(host, port): MongoClient}
+    _listeners: <dict>, {(host, port): PoolStatsListener}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients = {}
+        self._listeners = {}
+
+    def _check_pid(self) -> None:
+        """
+        Forget clients inherited from parent process after fork
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._clients = {}
+                    self._listeners = {}
+
+    def get_client(self, host: str, port: int) -> pymongo.MongoClient:
+        """
+        Get pooled MongoClient for 'host' and 'port', create it on first call
+
+        :param host: MongoDB host
+        :param port: MongoDB port
+        :return: MongoClient
+        """
+        self._check_pid()
+        client = self._clients.get((host, port))
+        if client is None:
+            with self._lock:
+                client = self._clients.get((host, port))
+                if client is None:
+                    listener = PoolStatsListener()
+                    client = pymongo.MongoClient(
+                        host, port,
+                        event_listeners=[listener],
+                        **settings.MONGO_CLIENT_OPTIONS)
+                    self._listeners[(host, port)] = listener
+                    self._clients[(host, port)] = client
+        return client
+
+    def get_pool_stats(self) -> dict:
+        """
+        Get connection pools statistics for clients of current process
+
+        :return: <dict>, {'host:port': {'pools_created': int, ...}}
+        """
+        self._check_pid()
+        return {
+            '%s:%s' % address: {
+                **listener.stats,
+                'connections_in_use': listener.stats['connections_checked_out'] -
+                                      listener.stats['connections_checked_in'],
+                'connections_open': listener.stats['connections_created'] -
+                                    listener.stats['connections_closed'],
+            }
+            for address, listener in self._listeners.items()
+        }
+
+    def close(self) -> None:
+        """
+        Close all clients of current process
+        """
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients = {}
+            self._listeners = {}
+
+
+connection_manager = ConnectionManager()
+__db_conns: dict = {}
 
 
 def set_conn(host: str, port: int, db_name: str) -> None:
     """
-    Establish user connection to MongoDB database 'db_name'
+    Establish user connection to MongoDB database 'db_name' using process-wide pooled client
 
     :param host: MongoDB host
     :param port: MongoDB port
     :param db_name: MongoDB database name
     """
-    global __db_conn
-    __db_conn = pymongo.MongoClient(host, port)[db_name]
+    client = connection_manager.get_client(host, port)
+    __db_conns[os.getpid()] = client[db_name]
 
 
 def get_conn() -> pymongo.database.Database:
@@ -31,13 +174,267 @@ def get_conn() -> pymongo.database.Database:
 
     :return: Database - connection to database
     """
-    global __db_conn
-    if not __db_conn:
+    db = __db_conns.get(os.getpid())
+    if db is None:
         set_conn(
             host=settings.DATABASES['default']['HOST'],
             port=settings.DATABASES['default']['PORT'],
             db_name=settings.DATABASES['default']['NAME'])
-    return __db_conn
+        db = __db_conns[os.getpid()]
+    return db
+
+
+def get_pool_stats() -> dict:
+    """
+    Get MongoDB connection pools statistics of current process
+
+    :return: <dict>
+    """
+    return connection_manager.get_pool_stats()
+
+
+# Declared indexes of collections, created by 'ensure_indexes' management command
+INDEXES = {
+    'questions': [
+        pymongo.IndexModel(
+            [('test_id', pymongo.ASCENDING), ('formulation', pymongo.ASCENDING)],
+            name='test_id_formulation'),
+    ],
+    'jobs': [
+        pymongo.IndexModel(
+            [('status', pymongo.ASCENDING), ('run_at', pymongo.ASCENDING)],
+            name='status_run_at'),
+        pymongo.IndexModel(
+            [('purge_at', pymongo.ASCENDING)],
+            name='purge_at_ttl',
+            expireAfterSeconds=0),
+    ],
+    'tests_snapshots': [
+        pymongo.IndexModel(
+            [('launch_id', pymongo.ASCENDING)],
+            name='launch_id'),
+    ],
+    'tests_variants': [
+        pymongo.IndexModel(
+            [('launch_id', pymongo.ASCENDING)],
+            name='launch_id'),
+        pymongo.IndexModel(
+            [('purge_at', pymongo.ASCENDING)],
+            name='purge_at_ttl',
+            expireAfterSeconds=0),
+    ],
+    'tests_submissions': [
+        pymongo.IndexModel(
+            [('launch_id', pymongo.ASCENDING), ('date', pymongo.ASCENDING)],
+            name='launch_id_date'),
+    ],
+    'running_tests_answers': [
+        pymongo.IndexModel(
+            [('user_id', pymongo.ASCENDING)],
+            name='user_id'),
+        pymongo.IndexModel(
+            [('deadline', pymongo.ASCENDING)],
+            name='deadline'),
+        pymongo.IndexModel(
+            [('claimed_by', pymongo.ASCENDING)],
+            name='claimed_by',
+            sparse=True),
+        pymongo.IndexModel(
+            [('purge_at', pymongo.ASCENDING)],
+            name='purge_at_ttl',
+            expireAfterSeconds=0),
+    ],
+    'tests_results': [
+        pymongo.IndexModel(
+            [('test_id', pymongo.ASCENDING), ('is_running', pymongo.ASCENDING),
+             ('launched_lecturer_id', pymongo.ASCENDING), ('date', pymongo.DESCENDING)],
+            name='test_id_is_running_lecturer_id_date'),
+        pymongo.IndexModel(
+            [('test_id', pymongo.ASCENDING), ('is_running', pymongo.ASCENDING), ('date', pymongo.DESCENDING)],
+            name='test_id_is_running_date'),
+        pymongo.IndexModel(
+            [('test_id', pymongo.ASCENDING), ('launched_lecturer_id', pymongo.ASCENDING),
+             ('date', pymongo.DESCENDING)],
+            name='test_id_lecturer_id_date'),
+        pymongo.IndexModel(
+            [('is_running', pymongo.ASCENDING)],
+            name='is_running'),
+        pymongo.IndexModel(
+            [('is_running', pymongo.ASCENDING), ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+            name='is_running_date_id'),
+        pymongo.IndexModel(
+            [('is_running', pymongo.ASCENDING), ('subject_id', pymongo.ASCENDING),
+             ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+            name='is_running_subject_id_date_id'),
+        pymongo.IndexModel(
+            [('is_running', pymongo.ASCENDING), ('launched_lecturer_id', pymongo.ASCENDING),
+             ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+            name='is_running_lecturer_id_date_id'),
+        pymongo.IndexModel(
+            [('is_running', pymongo.ASCENDING), ('test_id', pymongo.ASCENDING),
+             ('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)],
+            name='is_running_test_id_date_id'),
+    ],
+}
+
+# Fields of equality filters used by storages queries, every shape must be served by some index
+QUERY_SHAPES = {
+    'questions': [
+        ('test_id',),
+        ('test_id', 'formulation'),
+        ('_id', 'test_id'),
+        ('_id',),
+    ],
+    'questions_versions': [
+        ('_id',),
+    ],
+    'questions_stats': [
+        ('_id',),
+    ],
+    'media_blobs': [
+        ('_id',),
+    ],
+    'jobs': [
+        ('_id',),
+        ('status',),
+    ],
+    'tests_snapshots': [
+        ('launch_id',),
+    ],
+    'tests_variants': [
+        ('launch_id',),
+    ],
+    'tests_submissions': [
+        ('launch_id',),
+    ],
+    'running_tests_answers': [
+        ('user_id',),
+        ('deadline',),
+        ('claimed_by',),
+    ],
+    'tests_results': [
+        ('is_running',),
+        ('test_id', 'is_running'),
+        ('test_id', 'is_running', 'launched_lecturer_id'),
+        ('test_id', 'launched_lecturer_id'),
+        ('is_running', 'subject_id'),
+        ('is_running', 'launched_lecturer_id'),
+        ('is_running', 'test_id'),
+        ('_id',),
+    ],
+}
+
+
+def ensure_indexes(db: pymongo.database.Database) -> dict:
+    """
+    Create all declared indexes, already existing indexes are left untouched
+
+    :param db: Database - connection to MongoDB database
+    :return: <dict>, {collection_name: [created or existing index names]}
+    """
+    created = {}
+    for collection_name, indexes in INDEXES.items():
+        created[collection_name] = db[collection_name].create_indexes(indexes)
+    return created
+
+
+def get_unindexed_query_shapes(db: pymongo.database.Database) -> dict:
+    """
+    Get query shapes which can not be served by any existing index.
+    Shape is served if it contains '_id' or if it is a prefix of index key
+
+    :param db: Database - connection to MongoDB database
+    :return: <dict>, {collection_name: [<tuple: str>, ...]}
+    """
+    unindexed = {}
+    for collection_name, shapes in QUERY_SHAPES.items():
+        indexes_keys = [
+            [field for field, _ in index['key']]
+            for index in db[collection_name].index_information().values()
+        ]
+        for shape in shapes:
+            if '_id' in shape:
+                continue
+            if not any(set(keys[:len(shape)]) == set(shape) for keys in indexes_keys):
+                unindexed.setdefault(collection_name, []).append(shape)
+    return unindexed
+
+
+RESULTS_CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_results_cursor(date: datetime, _id: ObjectId) -> str:
+    """
+    Encode position of tests launch in results pages to opaque cursor
+
+    :param date: <datetime>, launch date
+    :param _id: <ObjectId>, launch id
+    :return: <str>
+    """
+    position = '%s|%s' % (date.strftime(RESULTS_CURSOR_DATE_FORMAT), _id)
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_results_cursor(cursor: str) -> tuple:
+    """
+    Decode cursor created by 'encode_results_cursor'
+
+    :param cursor: <str>
+    :return: <tuple>, (date: datetime, _id: ObjectId)
+    :raises ValueError: if cursor is invalid
+    """
+    try:
+        date, _id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.strptime(date, RESULTS_CURSOR_DATE_FORMAT), ObjectId(_id)
+    except (TypeError, ValueError, errors.InvalidId) as e:
+        raise ValueError('invalid cursor') from e
+
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def skip_duplicates(documents: list, error: pymongo.errors.BulkWriteError) -> list:
+    """
+    Get documents inserted by unordered 'insert_many' which failed only because
+    of documents with already existing '_id'
+
+    :param documents: <list: dict>, documents passed to 'insert_many'
+    :param error: <BulkWriteError>, raised by 'insert_many'
+    :return: <list: dict>, inserted documents
+    :raises BulkWriteError: if some documents are not inserted for other reason
+    """
+    failed_indexes = {
+        write_error['index'] for write_error in error.details['writeErrors']
+        if write_error['code'] == DUPLICATE_KEY_ERROR
+    }
+    if len(failed_indexes) < len(error.details['writeErrors']):
+        raise error
+    return [document for i, document in enumerate(documents) if i not in failed_indexes]
+
+
+def get_sample_pipeline(query: dict, k: int) -> list:
+    """
+    Build aggregation pipeline sampling 'k' random documents matching 'query' inside MongoDB
+
+    :param query: <dict>, MongoDB query
+    :param k: <int>, number of documents
+    :return: <list>, aggregation pipeline
+    """
+    return [
+        {'$match': query},
+        {'$sample': {'size': k}}
+    ]
+
+
+def sample_cached(entries: list, k: int) -> list:
+    """
+    Get copies of 'k' random entries of list shared with cache
+
+    :param entries: <list: dict>, cached entries, they are not modified
+    :param k: <int>, number of entries
+    :return: <list: dict>, shorter than 'k' if there are not enough entries
+    """
+    return copy.deepcopy(random.sample(entries, k=min(k, len(entries))))
 
 
 class MongoDB:
@@ -62,11 +459,371 @@ class MongoDB:
         self._col = db[collection_name]
 
 
+IMAGE_QUESTION_TYPES = (QuestionType.WITH_IMAGES, QuestionType.SEQUENCE_WITH_IMAGES)
+MEDIA_BLOBS_DIR = 'blobs'
+
+
+class MediaStorage(MongoDB):
+    """
+    Content-addressed store of questions images with reference counting.
+    Image is stored once in MEDIA_ROOT as 'blobs/<sha256[:2]>/<sha256>.<ext>',
+    so its path never changes and identical uploads share one file.
+    Collection 'media_blobs' stores number of options referencing each file,
+    file is deleted when its references count drops to zero
+    """
+
+    @staticmethod
+    def connect(db: pymongo.database.Database):
+        """
+        Establish connection to database collection 'media_blobs'
+
+        :param db: Database - connection to MongoDB database
+        :return: MediaStorage object
+        """
+        storage = MediaStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='media_blobs')
+        return storage
+
+    @staticmethod
+    def get_path(content: bytes, extension: str) -> str:
+        """
+        Get path of image with 'content' relative to MEDIA_ROOT
+
+        :param content: <bytes>
+        :param extension: <str>, file extension without dot
+        :return: <str>
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        extension = ''.join(char for char in extension.lower() if char.isalnum())
+        return f'{MEDIA_BLOBS_DIR}/{digest[:2]}/{digest}' + (f'.{extension}' if extension else '')
+
+    @staticmethod
+    def get_rendition_path(path: str, rendition: str):
+        """
+        Get path of rendition of stored image (see main.media), rendition is
+        stored next to original as 'blobs/<sha256[:2]>/<sha256>.<rendition>.<ext>'
+
+        :param path: <str>, path returned by 'save'
+        :param rendition: <str>, name of rendition from settings.MEDIA_RENDITIONS
+        :return: <str> or None if image is not stored in media store
+        """
+        if not path.startswith(MEDIA_BLOBS_DIR + '/'):
+            return None
+        directory, name = path.rsplit('/', 1)
+        digest, _, extension = name.partition('.')
+        return f'{directory}/{digest}.{rendition}' + (f'.{extension}' if extension else '')
+
+    def save(self, content: bytes, extension: str) -> str:
+        """
+        Store image and take reference to it. File is written before reference is taken,
+        so failed write leaves no reference, and rewritten if it was collected meanwhile
+
+        :param content: <bytes>
+        :param extension: <str>, file extension without dot
+        :return: <str>, path of image relative to MEDIA_ROOT
+        """
+        path = self.get_path(content=content, extension=extension)
+        full_path = Path(settings.MEDIA_ROOT) / path
+        self._write(full_path, content)
+        self._col.update_one({'_id': path}, {'$inc': {'refs': 1}}, upsert=True)
+        self._write(full_path, content)
+        return path
+
+    @staticmethod
+    def _write(full_path: Path, content: bytes) -> None:
+        """
+        Atomically write image if it does not exist
+
+        :param full_path: <Path>
+        :param content: <bytes>
+        """
+        if full_path.exists():
+            return
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = full_path.with_name(f'{full_path.name}.{ObjectId()}.tmp')
+        try:
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, full_path)
+        except OSError:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+    def release(self, paths: list) -> list:
+        """
+        Drop references to images, images without references must be deleted by 'collect'
+
+        :param paths: <list: str>, paths returned by 'save', one reference is dropped per item
+        :return: <list: str>, paths of images without references
+        """
+        if not paths:
+            return []
+        counts = {}
+        for path in paths:
+            counts[path] = counts.get(path, 0) + 1
+        self._col.bulk_write([
+            pymongo.UpdateOne({'_id': path}, {'$inc': {'refs': -count}})
+            for path, count in counts.items()
+        ], ordered=False)
+        return [blob['_id'] for blob in self._col.find(
+            {'_id': {'$in': list(counts)}, 'refs': {'$lte': 0}},
+            projection={'_id': True})]
+
+    def collect(self, paths: list) -> None:
+        """
+        Delete images released by 'release' which are still not referenced
+
+        :param paths: <list: str>
+        """
+        for blob in self._col.find({'_id': {'$in': list(paths)}, 'refs': {'$lte': 0}}, projection={'_id': True}):
+            self._collect(blob['_id'])
+
+    def _collect(self, path: str) -> None:
+        """
+        Delete image without references. File is moved aside before its
+        document is deleted, so image referenced again meanwhile is restored
+
+        :param path: <str>
+        """
+        full_path = Path(settings.MEDIA_ROOT) / path
+        deleted_path = full_path.with_name(f'{full_path.name}.{ObjectId()}.deleted')
+        try:
+            os.replace(full_path, deleted_path)
+        except FileNotFoundError:
+            deleted_path = None
+        if self._col.delete_one({'_id': path, 'refs': {'$lte': 0}}).deleted_count:
+            if deleted_path:
+                deleted_path.unlink()
+            for rendition in settings.MEDIA_RENDITIONS:
+                try:
+                    (Path(settings.MEDIA_ROOT) / self.get_rendition_path(path, rendition)).unlink()
+                except FileNotFoundError:
+                    pass
+        elif deleted_path:
+            os.replace(deleted_path, full_path)
+
+    def get_paths(self) -> list:
+        """
+        Get paths of all stored images
+
+        :return: <list: str>
+        """
+        return [blob['_id'] for blob in self._col.find({'refs': {'$gt': 0}}, projection={'_id': True})]
+
+    def get_refs(self, path: str) -> int:
+        """
+        Get number of references to image
+
+        :param path: <str>
+        :return: <int>
+        """
+        blob = self._col.find_one({'_id': path})
+        return blob['refs'] if blob else 0
+
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_REMOVE_MEDIA = 'remove_media'
+JOB_GENERATE_VARIANTS = 'generate_variants'
+
+
+class JobsStorage(MongoDB):
+    """
+    Queue of background jobs executed by main.jobs workers. Failed jobs are
+    retried with exponential backoff up to settings.JOBS_MAX_ATTEMPTS times,
+    jobs claimed more than settings.JOBS_CLAIM_TIMEOUT seconds ago are claimed again.
+    Finished jobs are removed by TTL index after settings.JOBS_TTL_SECONDS
+    """
+
+    @staticmethod
+    def connect(db: pymongo.database.Database):
+        """
+        Establish connection to database collection 'jobs'
+
+        :param db: Database - connection to MongoDB database
+        :return: JobsStorage object
+        """
+        storage = JobsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='jobs')
+        return storage
+
+    def add(self, kind: str, payload: dict) -> str:
+        """
+        Queue job
+
+        :param kind: <str>, type of job, see main.jobs.HANDLERS
+        :param payload: <dict>, arguments of job handler
+        :return: <str>, id of job
+        """
+        now = datetime.now() + timedelta(hours=3)
+        return str(self._col.insert_one({
+            'kind': kind,
+            'payload': payload,
+            'status': JOB_QUEUED,
+            'attempts': 0,
+            'error': None,
+            'created_at': now,
+            'run_at': now,
+        }).inserted_id)
+
+    def claim(self):
+        """
+        Claim next job ready to run
+
+        :return: <dict> with job or None if there are no ready jobs
+        """
+        now = datetime.now() + timedelta(hours=3)
+        return self._col.find_one_and_update(
+            {'$or': [
+                {'status': JOB_QUEUED, 'run_at': {'$lte': now}},
+                {'status': JOB_RUNNING, 'claimed_at': {'$lte': now - timedelta(seconds=settings.JOBS_CLAIM_TIMEOUT)}}
+            ]},
+            {'$set': {'status': JOB_RUNNING, 'claimed_at': now}, '$inc': {'attempts': 1}},
+            sort=[('run_at', pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER)
+
+    def finish(self, job: dict) -> None:
+        """
+        Mark claimed job as done
+
+        :param job: <dict>, job returned by 'claim'
+        """
+        now = datetime.now() + timedelta(hours=3)
+        self._col.update_one({'_id': job['_id']}, {'$set': {
+            'status': JOB_DONE,
+            'error': None,
+            'finished_at': now,
+            'purge_at': datetime.utcnow() + timedelta(seconds=settings.JOBS_TTL_SECONDS)
+        }})
+
+    def fail(self, job: dict, error: str) -> None:
+        """
+        Queue failed job for retry, or mark it as failed if it has no attempts left
+
+        :param job: <dict>, job returned by 'claim'
+        :param error: <str>, error description
+        """
+        now = datetime.now() + timedelta(hours=3)
+        if job['attempts'] >= settings.JOBS_MAX_ATTEMPTS:
+            update = {
+                'status': JOB_FAILED,
+                'finished_at': now,
+                'purge_at': datetime.utcnow() + timedelta(seconds=settings.JOBS_TTL_SECONDS)
+            }
+        else:
+            update = {
+                'status': JOB_QUEUED,
+                'run_at': now + timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (job['attempts'] - 1))
+            }
+        self._col.update_one({'_id': job['_id']}, {'$set': {**update, 'error': error}})
+
+    def get(self, job_id: str):
+        """
+        Get job by id
+
+        :param job_id: ObjectId as <str>
+        :return: <dict> or None if job does not exist
+        """
+        try:
+            return self._col.find_one({'_id': ObjectId(job_id)})
+        except errors.InvalidId:
+            return None
+
+
+class QuestionsCache:
+    """
+    Process-wide LRU cache of question banks keyed by test id.
+    Each bank is stored together with its version, read from 'questions_versions'
+    collection, so bank changed by any process is reloaded on the next access
+
+    _entries:         <OrderedDict>, {test_id: (version, questions)}
+    _questions_count: <int>, total number of cached questions
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._questions_count = 0
+
+    def get(self, test_id: int, version: int):
+        """
+        Get cached bank if its version is 'version'
+
+        :param test_id: <int>
+        :param version: <int>, actual version of bank
+        :return: <list> of questions or None, cached questions must not be modified
+        """
+        with self._lock:
+            entry = self._entries.get(test_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(test_id)
+            return entry[1]
+
+    def put(self, test_id: int, version: int, questions: list) -> None:
+        """
+        Cache bank, least recently used banks are evicted if cache limits exceeded
+
+        :param test_id: <int>
+        :param version: <int>, version of bank
+        :param questions: <list> of questions
+        """
+        if len(questions) > settings.QUESTIONS_CACHE_MAX_QUESTIONS:
+            return
+        with self._lock:
+            self._pop(test_id)
+            self._entries[test_id] = (version, questions)
+            self._questions_count += len(questions)
+            while len(self._entries) > settings.QUESTIONS_CACHE_MAX_TESTS or \
+                    self._questions_count > settings.QUESTIONS_CACHE_MAX_QUESTIONS:
+                self._pop(next(iter(self._entries)))
+
+    def invalidate(self, test_id: int) -> None:
+        """
+        Drop cached bank
+
+        :param test_id: <int>
+        """
+        with self._lock:
+            self._pop(test_id)
+
+    def clear(self) -> None:
+        """
+        Drop all cached banks
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+            self._questions_count = 0
+
+    def _pop(self, test_id: int) -> None:
+        entry = self._entries.pop(test_id, None)
+        if entry is not None:
+            self._questions_count -= len(entry[1])
+
+
+questions_cache = QuestionsCache()
+
+
 class QuestionsStorage(MongoDB):
     """
-    Class for working with Questions, stored in MongoDB
+    Class for working with Questions, stored in MongoDB.
+    Reads go through process-wide 'questions_cache', every modification
+    of test questions bank increments its version
+
+    _versions_col: MongoDB collection with questions banks versions
+    media_jobs:    <list: str>, ids of jobs removing images of questions deleted by this object
     """
 
+    _versions_col: pymongo.collection.Collection
+    media_jobs: list
+
     @staticmethod
     def connect(db: pymongo.database.Database):
         """
@@ -81,6 +838,95 @@ class QuestionsStorage(MongoDB):
             collection_name='questions')
         return storage
 
+    def set_collection(self, db: pymongo.database.Database, collection_name: str) -> None:
+        """
+        Connect to collection 'collection_name' and to 'questions_versions' collection
+
+        :param db: MongoDB Database
+        :param collection_name: name of database collection
+        """
+        super().set_collection(db=db, collection_name=collection_name)
+        self._versions_col = db['questions_versions']
+        self.media_jobs = []
+
+    def get_version(self, test_id: int) -> int:
+        """
+        Get version of Test(id='test_id') questions bank, it is changed on every bank modification
+
+        :param test_id: <int>
+        :return: <int>
+        """
+        version = self._versions_col.find_one({'_id': test_id})
+        return version['version'] if version else 0
+
+    def _bump_version(self, test_id: int) -> None:
+        """
+        Mark questions bank of Test(id='test_id') as changed
+
+        :param test_id: <int>
+        """
+        self._versions_col.update_one(
+            {'_id': test_id},
+            {'$inc': {'version': 1}},
+            upsert=True)
+        questions_cache.invalidate(test_id)
+
+    def _get_cached_bank(self, test_id: int) -> list:
+        """
+        Get all questions for Test(id='test_id') through questions cache.
+        Returned questions are shared with cache and must not be modified
+
+        :param test_id: <int>
+        :return: <list>, list of questions
+        """
+        version = self.get_version(test_id=test_id)
+        questions = questions_cache.get(test_id=test_id, version=version)
+        if questions is None:
+            questions = list(self._col.find({
+                'test_id': test_id
+            }))
+            questions_cache.put(test_id=test_id, version=version, questions=questions)
+        return questions
+
+    def remove_media(self, test_id: int, questions: list):
+        """
+        Release images of Test(id='test_id') questions with images. Images from
+        media store are deleted when they are not used by other questions,
+        images stored by previous versions are deleted with question directory.
+        References are released immediately, files are deleted by background
+        job (see main.jobs), its id is added to 'media_jobs'
+
+        :param test_id: <int>
+        :param questions: <list> of questions
+        :return: <str>, id of job or None if there are no files to delete
+        """
+        questions = [question for question in questions if question['type'] in IMAGE_QUESTION_TYPES]
+        if not questions:
+            return None
+        blobs = MediaStorage.connect(db=self._db).release([
+            option['option'] for question in questions for option in question['options']
+            if option['option'].startswith(MEDIA_BLOBS_DIR + '/')
+        ])
+        legacy_questions = [
+            question for question in questions
+            if question['type'] == QuestionType.WITH_IMAGES and
+            any(not option['option'].startswith(MEDIA_BLOBS_DIR + '/') for option in question['options'])
+        ]
+        directories = []
+        if legacy_questions:
+            test = Test.objects.get(id=test_id)
+            directories = [
+                f'{settings.MEDIA_ROOT}/{test.subject.name}/{test.name}/{question["_id"]}'
+                for question in legacy_questions
+            ]
+        if not blobs and not directories:
+            return None
+        job_id = JobsStorage.connect(db=self._db).add(
+            kind=JOB_REMOVE_MEDIA,
+            payload={'blobs': blobs, 'directories': directories})
+        self.media_jobs.append(job_id)
+        return job_id
+
     def add_one(self, question, test_id: int) -> None:
         """
         Add question to MongoDB
@@ -105,6 +951,71 @@ class QuestionsStorage(MongoDB):
         """
         question['test_id'] = test_id
         self._col.insert_one(question)
+        self._bump_version(test_id=test_id)
+
+    def add_many(self, questions: list, test_id: int, batch_size: int = 0) -> dict:
+        """
+        Add questions to MongoDB using unordered bulk inserts
+
+        :param questions: <list> of questions, see 'add_one'
+        :param test_id: <int>
+        :param batch_size: <int>, number of questions inserted by one request,
+                           settings.QUESTIONS_INSERT_BATCH_SIZE by default
+        :return: <dict>
+            {
+                'inserted_count': <int>,
+                'errors': [
+                    {
+                        'index': <int>, index of question in 'questions',
+                        'message': <str>
+                    },
+                    ...
+                ]
+            }
+        """
+        inserted_count = 0
+        write_errors = []
+        for start, batch in self.get_insert_batches(questions=questions, test_id=test_id, batch_size=batch_size):
+            try:
+                inserted_count += len(self._col.insert_many(batch, ordered=False).inserted_ids)
+            except pymongo.errors.BulkWriteError as e:
+                inserted_count += e.details['nInserted']
+                write_errors += self.get_write_errors(start=start, error=e)
+        if inserted_count:
+            self._bump_version(test_id=test_id)
+        return {
+            'inserted_count': inserted_count,
+            'errors': write_errors
+        }
+
+    @staticmethod
+    def get_insert_batches(questions: list, test_id: int, batch_size: int = 0) -> list:
+        """
+        Split questions added by 'add_many' to batches and bind them to Test(id='test_id')
+
+        :param questions: <list> of questions, see 'add_one'
+        :param test_id: <int>
+        :param batch_size: <int>, see 'add_many'
+        :return: <list: tuple>, [(index of first question of batch, <list> of questions), ...]
+        """
+        batch_size = batch_size or settings.QUESTIONS_INSERT_BATCH_SIZE
+        for question in questions:
+            question['test_id'] = test_id
+        return [(start, questions[start:start + batch_size]) for start in range(0, len(questions), batch_size)]
+
+    @staticmethod
+    def get_write_errors(start: int, error: pymongo.errors.BulkWriteError) -> list:
+        """
+        Get errors of batch insert for 'add_many' result
+
+        :param start: <int>, index of first question of batch
+        :param error: <BulkWriteError>, raised by 'insert_many'
+        :return: <list: dict>, see 'add_many'
+        """
+        return [
+            {'index': start + write_error['index'], 'message': write_error['errmsg']}
+            for write_error in error.details['writeErrors']
+        ]
 
     def get_one(self, test_id: int, question_formulation: str = '', question_id: str = '') -> dict:
         """
@@ -115,17 +1026,38 @@ class QuestionsStorage(MongoDB):
         :param question_id: ObjectID as <str>
         :return: <dict>, question
         """
+        query = self.get_question_query(question_formulation=question_formulation, question_id=question_id)
+        questions = questions_cache.get(test_id=test_id, version=self.get_version(test_id=test_id))
+        if questions is None:
+            return self._col.find_one({**query, 'test_id': test_id})
+        return self.find_cached(questions=questions, query=query)
+
+    @staticmethod
+    def get_question_query(question_formulation: str = '', question_id: str = '') -> dict:
+        """
+        Build query selecting question by formulation or id, see 'get_one'
+
+        :param question_formulation: <str>
+        :param question_id: ObjectID as <str>
+        :return: <dict>, MongoDB query
+        """
         if question_formulation:
-            question = self._col.find_one({
-                'formulation': question_formulation,
-                'test_id': test_id
-            })
-        else:
-            question = self._col.find_one({
-                '_id': ObjectId(question_id),
-                'test_id': test_id
-            })
-        return question
+            return {'formulation': question_formulation}
+        return {'_id': ObjectId(question_id)}
+
+    @staticmethod
+    def find_cached(questions: list, query: dict):
+        """
+        Find question matching 'query' built by 'get_question_query' in cached questions bank
+
+        :param questions: <list>, questions shared with cache
+        :param query: <dict>
+        :return: <dict>, copy of question or None if there is no such question
+        """
+        for question in questions:
+            if all(question[key] == value for key, value in query.items()):
+                return copy.deepcopy(question)
+        return None
 
     def get_many(self, test_id: int) -> list:
         """
@@ -134,10 +1066,35 @@ class QuestionsStorage(MongoDB):
         :param test_id: <int>
         :return: <list>, list of questions
         """
-        questions = self._col.find({
-            'test_id': test_id
-        })
-        return list(questions) if questions else []
+        return copy.deepcopy(self._get_cached_bank(test_id=test_id))
+
+    def sample(self, test_id: int, k: int) -> list:
+        """
+        Get 'k' random questions for Test(id='test_id'). Banks not bigger than
+        settings.QUESTIONS_SAMPLE_THRESHOLD are sampled in-process, bigger ones -
+        inside MongoDB using '$sample', so only 'k' questions are transferred
+
+        :param test_id: <int>
+        :param k: <int>, number of questions
+        :return: <list>, list of questions, shorter than 'k' if there are not enough questions
+        """
+        bank_size = self._col.count_documents({'test_id': test_id})
+        if bank_size <= settings.QUESTIONS_SAMPLE_THRESHOLD:
+            return sample_cached(self._get_cached_bank(test_id=test_id), k=k)
+        return list(self._col.aggregate(get_sample_pipeline({'test_id': test_id}, k=k)))
+
+    def count_by_tests(self, test_ids: list) -> dict:
+        """
+        Get number of questions for each of tests with 'test_ids' using single aggregation
+
+        :param test_ids: <list: int>
+        :return: <dict>, {test_id: questions_count}, tests without questions are omitted
+        """
+        counts = self._col.aggregate([
+            {'$match': {'test_id': {'$in': list(test_ids)}}},
+            {'$group': {'_id': '$test_id', 'count': {'$sum': 1}}}
+        ])
+        return {item['_id']: item['count'] for item in counts}
 
     def delete_by_formulation(self, question_formulation: str, test_id: int) -> None:
         """
@@ -151,78 +1108,212 @@ class QuestionsStorage(MongoDB):
             question_formulation=question_formulation,
             test_id=test_id
         )
-        test = Test.objects.get(id=test_id)
-        if question['type'] == QuestionType.WITH_IMAGES:
-            path = Path(f'{settings.MEDIA_ROOT}/{test.subject.name}/{test.name}/{question["_id"]}')
-            shutil.rmtree(path)
+        self.remove_media(test_id=test_id, questions=[question])
         self._col.delete_one({
             'test_id': test_id,
             'formulation': question_formulation
         })
+        self._bump_version(test_id=test_id)
+
+    def delete_by_id(self, question_id: str, test_id: int) -> None:
+        """
+        Delete question with id 'question_formulation' and 'test_id' test_id
+
+        :param question_id: ObjectID as <str>
+        :param test_id: <int>
+        :return: None
+        """
+        question = self._col.find_one({
+            '_id': ObjectId(question_id),
+        })
+        self.remove_media(test_id=test_id, questions=[question])
+        self._col.delete_one({
+            '_id': ObjectId(question_id)
+        })
+        self._bump_version(test_id=test_id)
+
+    def update_formulation(self, question_id: str, formulation: str) -> None:
+        """
+        Update question formulation
+
+        :param question_id: ObjectID as <str>
+        :param formulation: <str>
+        :return: None
+        """
+        question = self._col.find_one_and_update(
+            {'_id': ObjectId(question_id)},
+            {'$set': {'formulation': formulation}}
+        )
+        if question:
+            self._bump_version(test_id=question['test_id'])
+
+    def update(self, question_id: str, formulation: str, options: list) -> None:
+        """
+        Update question formulation and options
+
+        :param question_id: ObjectID as <str>
+        :param formulation: <str>
+        :param options: <list> of dicts
+        :return: None
+        """
+        question = self._col.find_one_and_update(
+            {'_id': ObjectId(question_id)},
+            {'$set': {'formulation': formulation, 'options': options}}
+        )
+        if question:
+            self._bump_version(test_id=question['test_id'])
+
+    def delete_many(self, test_id: int) -> int:
+        """
+        Delete all question for Test(id='test_id')
+
+        :param test_id: <int>
+        :return: count od deleted questions
+        """
+        questions = self.get_many(test_id=test_id)
+        self.remove_media(test_id=test_id, questions=questions)
+        deleted_questions_count = self._col.delete_many({
+            'test_id': test_id,
+        }).deleted_count
+        self._bump_version(test_id=test_id)
+        return deleted_questions_count
+
+
+# Snapshots never change, so all of them are cached with version 0
+snapshots_cache = QuestionsCache()
+
+
+class TestsSnapshotsStorage(MongoDB):
+    """
+    Snapshots of questions banks frozen on tests launches. Snapshot stores
+    questions together with their answer keys (see utils.get_answer_key),
+    students of running test get questions sampled from its snapshot, so they
+    are not affected by later bank edits. Snapshots are immutable, snapshots not
+    bigger than settings.QUESTIONS_SAMPLE_THRESHOLD are cached by 'snapshots_cache'
+    """
+
+    @staticmethod
+    def connect(db: pymongo.database.Database):
+        """
+        Establish connection to database collection 'tests_snapshots'
+
+        :param db: Database - connection to MongoDB database
+        :return: TestsSnapshotsStorage object
+        """
+        storage = TestsSnapshotsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='tests_snapshots')
+        return storage
+
+    def freeze(self, launch_id: ObjectId, questions: list, answer_keys: list) -> None:
+        """
+        Save snapshot of test launch
+
+        :param launch_id: <ObjectId>, id of launch in 'tests_results'
+        :param questions: <list> of questions of test
+        :param answer_keys: <list>, answer key of every question
+        """
+        for batch in self.get_entries_batches(launch_id=launch_id, questions=questions, answer_keys=answer_keys):
+            self._col.insert_many(batch)
+
+    @staticmethod
+    def get_entries_batches(launch_id: ObjectId, questions: list, answer_keys: list) -> list:
+        """
+        Build snapshot entries saved by 'freeze' split to batches of settings.QUESTIONS_INSERT_BATCH_SIZE
+
+        :param launch_id: <ObjectId>
+        :param questions: <list> of questions of test
+        :param answer_keys: <list>, answer key of every question
+        :return: <list: list>, batches of entries
+        """
+        entries = [
+            {'launch_id': launch_id, 'question': question, 'answer_key': answer_key}
+            for question, answer_key in zip(questions, answer_keys)
+        ]
+        batch_size = settings.QUESTIONS_INSERT_BATCH_SIZE
+        return [entries[start:start + batch_size] for start in range(0, len(entries), batch_size)]
+
+    def sample(self, launch_id: ObjectId, k: int) -> list:
+        """
+        Get 'k' random questions of snapshot
+
+        :param launch_id: <ObjectId>
+        :param k: <int>, number of questions
+        :return: <list: dict>, [{'question': <dict>, 'answer_key': <list>}, ...], empty if there is no snapshot
+        """
+        entries = snapshots_cache.get(test_id=launch_id, version=0)
+        if entries is None:
+            snapshot_size = self._col.count_documents({'launch_id': launch_id})
+            if snapshot_size > settings.QUESTIONS_SAMPLE_THRESHOLD:
+                return list(self._col.aggregate(get_sample_pipeline({'launch_id': launch_id}, k=k)))
+            entries = list(self._col.find({'launch_id': launch_id}))
+            if entries:
+                snapshots_cache.put(test_id=launch_id, version=0, questions=entries)
+        return sample_cached(entries, k=k)
+
+    def delete(self, launch_id: ObjectId) -> None:
+        """
+        Delete snapshot of stopped launch, started attempts already have their answer keys
+
+        :param launch_id: <ObjectId>
+        """
+        self._col.delete_many({'launch_id': launch_id})
+        snapshots_cache.invalidate(launch_id)
+
 
-    def delete_by_id(self, question_id: str, test_id: int) -> None:
+class TestsVariantsStorage(MongoDB):
+    """
+    Pools of test variants generated in background after tests launches (see main.jobs).
+    Variant is a sample of launch snapshot with answer key of every question and
+    rendered page of running test, every variant is given to exactly one student.
+    Variants not taken are deleted when test is stopped or by TTL index
+    """
+
+    @staticmethod
+    def connect(db: pymongo.database.Database):
         """
-        Delete question with id 'question_formulation' and 'test_id' test_id
+        Establish connection to database collection 'tests_variants'
 
-        :param question_id: ObjectID as <str>
-        :param test_id: <int>
-        :return: None
+        :param db: Database - connection to MongoDB database
+        :return: TestsVariantsStorage object
         """
-        question = self._col.find_one({
-            '_id': ObjectId(question_id),
-        })
-        test = Test.objects.get(id=test_id)
-        if question['type'] == QuestionType.WITH_IMAGES:
-            path = Path(f'{settings.MEDIA_ROOT}/{test.subject.name}/{test.name}/{question["_id"]}')
-            shutil.rmtree(path, ignore_errors=True)
-        self._col.delete_one({
-            '_id': ObjectId(question_id)
-        })
+        storage = TestsVariantsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='tests_variants')
+        return storage
 
-    def update_formulation(self, question_id: str, formulation: str) -> None:
+    def add(self, launch_id: ObjectId, variants: list) -> None:
         """
-        Update question formulation
+        Add variants to pool of launch
 
-        :param question_id: ObjectID as <str>
-        :param formulation: <str>
-        :return: None
+        :param launch_id: <ObjectId>, id of launch in 'tests_results'
+        :param variants: <list: dict>, [{'right_answers': <dict>, 'page': <str>}, ...],
+                         see utils.get_right_answers and utils.render_variant_page
         """
-        self._col.find_one_and_update(
-            {'_id': ObjectId(question_id)},
-            {'$set': {'formulation': formulation}}
-        )
+        purge_at = datetime.utcnow() + timedelta(seconds=settings.ATTEMPT_TTL_SECONDS)
+        self._col.insert_many([
+            {**variant, 'launch_id': launch_id, 'purge_at': purge_at}
+            for variant in variants
+        ])
 
-    def update(self, question_id: str, formulation: str, options: list) -> None:
+    def claim(self, launch_id: ObjectId):
         """
-        Update question formulation and options
+        Take variant from pool of launch
 
-        :param question_id: ObjectID as <str>
-        :param formulation: <str>
-        :param options: <list> of dicts
-        :return: None
+        :param launch_id: <ObjectId>
+        :return: <dict> with variant or None if pool is empty
         """
-        self._col.find_one_and_update(
-            {'_id': ObjectId(question_id)},
-            {'$set': {'formulation': formulation, 'options': options}}
-        )
+        return self._col.find_one_and_delete({'launch_id': launch_id})
 
-    def delete_many(self, test_id: int) -> int:
+    def delete(self, launch_id: ObjectId) -> None:
         """
-        Delete all question for Test(id='test_id')
+        Delete variants of stopped launch
 
-        :param test_id: <int>
-        :return: count od deleted questions
+        :param launch_id: <ObjectId>
         """
-        questions = self.get_many(test_id=test_id)
-        test = Test.objects.get(id=test_id)
-        for question in questions:
-            if question['type'] == QuestionType.WITH_IMAGES:
-                p = Path(f'{settings.MEDIA_ROOT}/{test.subject.name}/{test.name}/{question["_id"]}')
-                shutil.rmtree(p)
-        deleted_questions_count = self._col.delete_many({
-            'test_id': test_id,
-        }).deleted_count
-        return deleted_questions_count
+        self._col.delete_many({'launch_id': launch_id})
 
 
 class RunningTestsAnswersStorage(MongoDB):
@@ -244,9 +1335,11 @@ class RunningTestsAnswersStorage(MongoDB):
             collection_name='running_tests_answers')
         return storage
 
-    def add(self, right_answers, test_id: str, user_id: str, test_duration: int) -> None:
+    def add(self, right_answers, test_id: str, user_id: str, test_duration: int):
         """
-        Add right answers for running tests and current user
+        Add right answers for running tests and current user.
+        Attempt expires after test duration and settings.ATTEMPT_GRACE_SECONDS,
+        after that it is graded by attempts reaper (see main.reaper)
 
         :param right_answers: <dict>
             {
@@ -261,14 +1354,91 @@ class RunningTestsAnswersStorage(MongoDB):
         :param test_id: <int>
         :param user_id: <int>, user who passes test
         :param test_duration: <int>, test duration in seconds
+        :return: <ObjectId>, id of attempt
+        """
+        return self._col.insert_one(self.new_attempt(
+            right_answers=right_answers,
+            test_id=test_id,
+            user_id=user_id,
+            test_duration=test_duration)).inserted_id
+
+    def start(self, right_answers, test_id: int, user_id: int, test_duration: int):
+        """
+        Start new attempt of user, previous attempts are abandoned and graded by attempts reaper
+
+        :param right_answers: <dict>, see 'add'
+        :param test_id: <int>
+        :param user_id: <int>, user who passes test
+        :param test_duration: <int>, test duration in seconds
+        :return: <ObjectId>, id of attempt
+        """
+        self.abandon(user_id=user_id)
+        return self.add(
+            right_answers=right_answers,
+            test_id=test_id,
+            user_id=user_id,
+            test_duration=test_duration)
+
+    @staticmethod
+    def new_attempt(right_answers, test_id: int, user_id: int, test_duration: int) -> dict:
+        """
+        Create attempt document stored by 'add'
+
+        :param right_answers: <dict>, see 'add'
+        :param test_id: <int>
+        :param user_id: <int>, user who passes test
+        :param test_duration: <int>, test duration in seconds
+        :return: <dict>
         """
-        self._col.insert_one({
+        start_date = datetime.now() + timedelta(hours=3)
+        lifetime = timedelta(seconds=test_duration + settings.ATTEMPT_GRACE_SECONDS)
+        return {
             'right_answers': right_answers,
             'test_duration': test_duration,
-            'start_date': datetime.now() + timedelta(hours=3),
+            'start_date': start_date,
+            'deadline': start_date + lifetime,
+            'purge_at': datetime.utcnow() + lifetime + timedelta(seconds=settings.ATTEMPT_TTL_SECONDS),
             'test_id': test_id,
             'user_id': user_id
-        })
+        }
+
+    @staticmethod
+    def get_attempt_left_time(attempt: dict) -> float:
+        """
+        Get left time for passing test in attempt
+
+        :param attempt: <dict>, attempt document, see 'new_attempt'
+        :return: <float>, seconds
+        """
+        delta = datetime.now() + timedelta(hours=3) - attempt['start_date']
+        return attempt['test_duration'] - delta.total_seconds()
+
+    @staticmethod
+    def get_active_query(user_id: int) -> dict:
+        """
+        Build query selecting attempt of user which is neither abandoned nor claimed by attempts reaper
+
+        :param user_id: <int>, user who passes test
+        :return: <dict>, MongoDB query
+        """
+        return {
+            'user_id': user_id,
+            'abandoned': {'$ne': True},
+            'claimed_by': None
+        }
+
+    @staticmethod
+    def get_abandon_update(user_id: int) -> tuple:
+        """
+        Build filter and update of 'abandon'
+
+        :param user_id: <int>
+        :return: <tuple>, (MongoDB query, MongoDB update)
+        """
+        return (
+            {'user_id': user_id, 'abandoned': {'$ne': True}},
+            {'$set': {'abandoned': True, 'deadline': datetime.now() + timedelta(hours=3)}}
+        )
 
     def get(self, user_id: int) -> dict:
         """
@@ -277,10 +1447,17 @@ class RunningTestsAnswersStorage(MongoDB):
         :param user_id: <int>, user who passes test
         :return: <dict>
         """
-        right_answers = self._col.find_one({
-            'user_id': user_id,
-        })
-        return right_answers
+        return self._col.find_one(self.get_active_query(user_id))
+
+    def pop(self, user_id: int) -> dict:
+        """
+        Get right answers for running test and current user and delete them,
+        so attempt can not be graded twice
+
+        :param user_id: <int>, user who passes test
+        :return: <dict>
+        """
+        return self._col.find_one_and_delete(self.get_active_query(user_id))
 
     def get_left_time(self, user_id: int):
         """
@@ -289,13 +1466,10 @@ class RunningTestsAnswersStorage(MongoDB):
         :param user_id: <int>, user who passes test
         :return: <dict>
         """
-        right_answers = self._col.find_one({
-            'user_id': user_id,
-        })
+        right_answers = self.get(user_id=user_id)
         if not right_answers:
             return None
-        delta = datetime.now() + timedelta(hours=3) - right_answers['start_date']
-        return right_answers['test_duration'] - delta.total_seconds()
+        return self.get_attempt_left_time(right_answers)
 
     def delete(self, user_id: int) -> None:
         """
@@ -304,8 +1478,52 @@ class RunningTestsAnswersStorage(MongoDB):
         :param user_id: <int>
         :return: None
         """
-        self._col.delete_one({
-            'user_id': user_id,
+        self._col.delete_one(self.get_active_query(user_id))
+
+    def abandon(self, user_id: int) -> None:
+        """
+        Mark all user attempts as abandoned, they will be graded by attempts reaper
+
+        :param user_id: <int>
+        """
+        self._col.update_many(*self.get_abandon_update(user_id))
+
+    def claim_expired(self, limit: int) -> list:
+        """
+        Claim up to 'limit' expired or abandoned attempts for grading.
+        Claimed attempts are not returned by other methods and must be
+        deleted by 'delete_claimed' after grading, attempts claimed more than
+        settings.REAPER_CLAIM_TIMEOUT seconds ago are claimed again
+
+        :param limit: <int>
+        :return: <list: dict>, claimed attempts
+        """
+        now = datetime.now() + timedelta(hours=3)
+        not_claimed = {'$or': [
+            {'claimed_by': None},
+            {'claimed_at': {'$lte': now - timedelta(seconds=settings.REAPER_CLAIM_TIMEOUT)}}
+        ]}
+        expired_ids = [attempt['_id'] for attempt in self._col.find(
+            {'deadline': {'$lte': now}, **not_claimed},
+            projection={'_id': True}
+        ).limit(limit)]
+        if not expired_ids:
+            return []
+        claim_id = ObjectId()
+        self._col.update_many(
+            {'_id': {'$in': expired_ids}, **not_claimed},
+            {'$set': {'claimed_by': claim_id, 'claimed_at': now}}
+        )
+        return list(self._col.find({'claimed_by': claim_id}))
+
+    def delete_claimed(self, attempts: list) -> None:
+        """
+        Delete graded attempts claimed by 'claim_expired'
+
+        :param attempts: <list: dict>
+        """
+        self._col.delete_many({
+            '_id': {'$in': [attempt['_id'] for attempt in attempts]}
         })
 
     def cleanup(self, user_id: int) -> list:
@@ -323,11 +1541,160 @@ class RunningTestsAnswersStorage(MongoDB):
         return docs
 
 
+class QuestionsStatsStorage(MongoDB):
+    """
+    Class for working with questions statistics counters, stored in MongoDB.
+    Counters are incremented on every added student result, document of question
+    with id 'question_id' is
+        {
+            '_id': <str>, question_id,
+            'attempts': <int>, number of results with question,
+            'right_answers_count': <int>,
+            'unanswered_count': <int>,
+            'options': {<option hash>: {'option': <str>, 'count': <int>, number of picks}, ...},
+            'time_buckets': {<str>, bucket start in seconds: <int>, number of results, ...}
+        }
+    """
+
+    @staticmethod
+    def connect(db: pymongo.database.Database):
+        """
+        Establish connection to database collection 'questions_stats'
+
+        :param db: Database - connection to MongoDB database
+        :return: QuestionsStatsStorage object
+        """
+        storage = QuestionsStatsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='questions_stats')
+        return storage
+
+    @staticmethod
+    def get_updates(tests_results: list) -> list:
+        """
+        Get counters updates for students results, updates of one question are merged
+
+        :param tests_results: <list: dict>, see TestsResultsStorage.add_results_to_running_test
+        :return: <list: pymongo.UpdateOne>
+        """
+        updates = {}
+        bucket_size = settings.QUESTIONS_STATS_TIME_BUCKET
+        for test_result in tests_results:
+            time_bucket = 'time_buckets.%d' % (max(test_result.get('time', 0), 0) // bucket_size * bucket_size)
+            for question in test_result.get('questions', []):
+                update = updates.setdefault(question['id'], {'$inc': {}, '$set': {}})
+                counters = update['$inc']
+                selected_answers = question.get('selected_answers') or []
+                for counter, value in [('attempts', 1),
+                                       ('right_answers_count', int(bool(question.get('is_true')))),
+                                       ('unanswered_count', int(not selected_answers)),
+                                       (time_bucket, 1)]:
+                    counters[counter] = counters.get(counter, 0) + value
+                for option in selected_answers:
+                    option_key = 'options.%s' % hashlib.md5(str(option).encode('utf-8')).hexdigest()
+                    counters[option_key + '.count'] = counters.get(option_key + '.count', 0) + 1
+                    update['$set'][option_key + '.option'] = option
+        return [
+            pymongo.UpdateOne({'_id': question_id}, {key: value for key, value in update.items() if value}, upsert=True)
+            for question_id, update in updates.items()
+        ]
+
+    def add_results(self, tests_results: list) -> None:
+        """
+        Increment counters of questions of students results
+
+        :param tests_results: <list: dict>, see TestsResultsStorage.add_results_to_running_test
+        """
+        updates = self.get_updates(tests_results)
+        if updates:
+            self._col.bulk_write(updates, ordered=False)
+
+    def get_many(self, question_ids: list) -> dict:
+        """
+        Get counters of questions
+
+        :param question_ids: <list: str>
+        :return: <dict>, {question_id: <dict>, counters}, questions without results are omitted
+        """
+        return {stats.pop('_id'): stats for stats in self._col.find({'_id': {'$in': list(question_ids)}})}
+
+    def rebuild(self, batch_size: int = 0) -> int:
+        """
+        Recount counters over all students results. Counters are built in
+        temporary collection which replaces 'questions_stats' after that.
+        Results are counted in order of their ids, results added during rebuild
+        have ids greater than counted ones and are replayed to temporary collection
+        until there are no new results, so they are not lost by replacement
+
+        :param batch_size: <int>, number of results counted by one bulk write,
+                           settings.QUESTIONS_INSERT_BATCH_SIZE by default
+        :return: <int>, number of counted results
+        """
+        batch_size = batch_size or settings.QUESTIONS_INSERT_BATCH_SIZE
+        rebuild_col = self._db['questions_stats_rebuild']
+        rebuild_col.drop()
+        results_count = 0
+        is_empty = True
+        watermark = None
+        while True:
+            counted_count, watermark, has_updates = self._count_results(
+                counters_col=rebuild_col,
+                query={'_id': {'$gt': watermark}} if watermark is not None else {},
+                batch_size=batch_size)
+            results_count += counted_count
+            is_empty = is_empty and not has_updates
+            if not counted_count:
+                break
+        if is_empty:
+            self._col.drop()
+        else:
+            rebuild_col.rename(self._col.name, dropTarget=True)
+        return results_count
+
+    def _count_results(self, counters_col: pymongo.collection.Collection, query: dict, batch_size: int) -> tuple:
+        """
+        Increment counters in 'counters_col' for students results matching 'query'
+
+        :param counters_col: MongoDB collection with counters
+        :param query: <dict>, MongoDB query of 'tests_submissions'
+        :param batch_size: <int>, number of results counted by one bulk write
+        :return: <tuple>, (number of counted results, greatest id of counted results
+                 or None if there are no results, <bool>, some counters were incremented)
+        """
+        results_count = 0
+        last_id = query.get('_id', {}).get('$gt')
+        has_updates = False
+        submissions = self._db['tests_submissions'].find(
+            query,
+            projection={'_id': True, 'time': True, 'questions': True},
+            batch_size=batch_size
+        ).sort('_id', pymongo.ASCENDING)
+        while True:
+            batch = list(itertools.islice(submissions, batch_size))
+            if not batch:
+                break
+            results_count += len(batch)
+            last_id = batch[-1]['_id']
+            updates = self.get_updates(batch)
+            if updates:
+                counters_col.bulk_write(updates, ordered=False)
+                has_updates = True
+        return results_count, last_id, has_updates
+
+
 class TestsResultsStorage(MongoDB):
     """
-    Class for working with tests results, stored in MongoDB
+    Class for working with tests results, stored in MongoDB.
+    Collection 'tests_results' stores tests launches with summary counters,
+    students results are stored in 'tests_submissions' collection with
+    'launch_id' field referencing launch
+
+    _submissions_col: MongoDB collection with students results
     """
 
+    _submissions_col: pymongo.collection.Collection
+
     @staticmethod
     def connect(db: pymongo.database.Database):
         """
@@ -342,23 +1709,165 @@ class TestsResultsStorage(MongoDB):
             collection_name='tests_results')
         return storage
 
-    def add_running_test(self, test_id: int, lecturer_id: int, subject_id: int) -> None:
+    def set_collection(self, db: pymongo.database.Database, collection_name: str) -> None:
         """
-        Create object in collection corresponding to running test
+        Connect to collection 'collection_name' and to 'tests_submissions' collection
+
+        :param db: MongoDB Database
+        :param collection_name: name of database collection
+        """
+        super().set_collection(db=db, collection_name=collection_name)
+        self._submissions_col = db['tests_submissions']
+
+    def _get_results(self, launch_ids: list) -> dict:
+        """
+        Get students results of tests launches ordered by date
+
+        :param launch_ids: <list: ObjectId>
+        :return: <dict>, {launch_id: <list>, list of results}
+        """
+        submissions = self._submissions_col.find(
+            {'launch_id': {'$in': launch_ids}},
+            projection={'_id': False}
+        ).sort('date', pymongo.ASCENDING)
+        return self.group_results(launch_ids=launch_ids, submissions=submissions)
+
+    @staticmethod
+    def group_results(launch_ids: list, submissions) -> dict:
+        """
+        Group students results by launches, see '_get_results'
+
+        :param launch_ids: <list: ObjectId>
+        :param submissions: iterable of students results with 'launch_id' field, ordered by date
+        :return: <dict>, {launch_id: <list>, list of results}
+        """
+        results = {launch_id: [] for launch_id in launch_ids}
+        for submission in submissions:
+            results[submission.pop('launch_id')].append(submission)
+        return results
+
+    def _attach_results(self, launches: list) -> list:
+        """
+        Set 'results' field of launches to list of students results
+
+        :param launches: <list: dict>, tests launches
+        :return: <list: dict>, same launches
+        """
+        results = self._get_results([launch['_id'] for launch in launches])
+        for launch in launches:
+            launch['results'] = results[launch['_id']]
+        return launches
+
+    @staticmethod
+    def new_launch(test_id: int, lecturer_id: int, subject_id: int, launch_id: ObjectId = None) -> dict:
+        """
+        Create launch document stored by 'add_running_test'
 
         :param test_id: <int>,
         :param subject_id: <int>,
         :param lecturer_id: <int>, lecturer who ran test
-        :return:
+        :param launch_id: <ObjectId>, id of launch, new id by default
+        :return: <dict>
         """
-        self._col.insert_one({
+        return {
+            '_id': launch_id or ObjectId(),
             'test_id': test_id,
             'subject_id': subject_id,
             'launched_lecturer_id': lecturer_id,
             'is_running': True,
-            'results': [],
+            'results_count': 0,
             'date': datetime.now() + timedelta(hours=3)
-        })
+        }
+
+    @staticmethod
+    def get_running_query(test_id: int, lecturer_id: int = None) -> dict:
+        """
+        Build query selecting running launches of Test(id='test_id'), latest of them
+        is selected by sorting by 'date' descending
+
+        :param test_id: <int> or query operator, e.g. {'$in': <list: int>}
+        :param lecturer_id: <int>, lecturer who ran test, any lecturer by default
+        :return: <dict>, MongoDB query
+        """
+        query = {'test_id': test_id, 'is_running': True}
+        if lecturer_id is not None:
+            query['launched_lecturer_id'] = lecturer_id
+        return query
+
+    @staticmethod
+    def get_results_count_update(date: datetime, count: int = 1) -> dict:
+        """
+        Build update of launch summary counters for 'count' added students results
+
+        :param date: <datetime>, date of latest result
+        :param count: <int>
+        :return: <dict>, MongoDB update
+        """
+        return {'$inc': {'results_count': count}, '$set': {'last_result_date': date}}
+
+    @staticmethod
+    def get_submissions(tests_results: list, launches: dict, date: datetime) -> list:
+        """
+        Bind students results to running launches, see 'add_results_to_running_tests'
+
+        :param tests_results: <list: tuple>, [(test_id, test_result), ...]
+        :param launches: <dict>, {test_id: <ObjectId>, id of running launch}
+        :param date: <datetime>, date of results without 'date'
+        :return: <list: dict>, results of running tests with 'launch_id' field
+        """
+        submissions = []
+        for test_id, test_result in tests_results:
+            if test_id in launches:
+                test_result.setdefault('date', date)
+                submissions.append({**test_result, 'launch_id': launches[test_id]})
+        return submissions
+
+    @classmethod
+    def get_results_counts_updates(cls, submissions: list, date: datetime) -> list:
+        """
+        Get updates of launches summary counters for inserted students results
+
+        :param submissions: <list: dict>, see 'get_submissions'
+        :param date: <datetime>, date of latest result
+        :return: <list: pymongo.UpdateOne>
+        """
+        results_counts = {}
+        for submission in submissions:
+            results_counts[submission['launch_id']] = results_counts.get(submission['launch_id'], 0) + 1
+        return [
+            pymongo.UpdateOne({'_id': launch_id}, cls.get_results_count_update(date=date, count=count))
+            for launch_id, count in results_counts.items()
+        ]
+
+    def add_running_test(self, test_id: int, lecturer_id: int, subject_id: int, launch_id: ObjectId = None):
+        """
+        Create object in collection corresponding to running test
+
+        :param test_id: <int>,
+        :param subject_id: <int>,
+        :param lecturer_id: <int>, lecturer who ran test
+        :param launch_id: <ObjectId>, id of launch, new id by default
+        :return: <ObjectId>, id of launch
+        """
+        return self._col.insert_one(self.new_launch(
+            test_id=test_id,
+            lecturer_id=lecturer_id,
+            subject_id=subject_id,
+            launch_id=launch_id)).inserted_id
+
+    def get_running_launch_id(self, test_id: int):
+        """
+        Get id of latest running launch of Test(id='test_id')
+
+        :param test_id: <int>
+        :return: <ObjectId> or None if test is not running
+        """
+        launch = self._col.find_one(
+            self.get_running_query(test_id=test_id),
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        return launch['_id'] if launch else None
 
     def add_results_to_running_test(self, test_result: dict, test_id: int) -> None:
         """
@@ -371,6 +1880,7 @@ class TestsResultsStorage(MongoDB):
                 'time': <int>, time of passing test,
                 'tasks_num': <int>, number of questions,
                 'right_answers_num': <int>, number of correctly solved questions,
+                <'is_late': True - optional field of answers sent after attempt deadline>
                 'questions': [
                     {
                         'id': <str>, str(ObjectId()),
@@ -384,10 +1894,47 @@ class TestsResultsStorage(MongoDB):
         :return: None
         """
         test_result['date'] = datetime.now() + timedelta(hours=3)
-        self._col.find_one_and_update(
-            {'test_id': test_id, 'is_running': True},
-            {'$push': {'results': test_result}}
+        launch = self._col.find_one_and_update(
+            self.get_running_query(test_id=test_id),
+            self.get_results_count_update(date=test_result['date']),
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
         )
+        if launch:
+            self._submissions_col.insert_one({
+                **test_result,
+                'launch_id': launch['_id']
+            })
+            QuestionsStatsStorage.connect(db=self._db).add_results([test_result])
+
+    def add_results_to_running_tests(self, tests_results: list) -> int:
+        """
+        Add passed tests results to running tests using bulk writes.
+        Results of tests which are not running are skipped
+
+        :param tests_results: <list: tuple>, [(test_id, test_result), ...],
+                              see 'add_results_to_running_test', results without
+                              'date' are dated by current time, results with
+                              '_id' of already added result are skipped
+        :return: <int>, number of added results
+        """
+        running_tests = self._col.find(
+            self.get_running_query(test_id={'$in': list({test_id for test_id, _ in tests_results})}),
+            projection={'test_id': True}
+        ).sort('date', pymongo.ASCENDING)
+        launches = {launch['test_id']: launch['_id'] for launch in running_tests}
+
+        date = datetime.now() + timedelta(hours=3)
+        submissions = self.get_submissions(tests_results=tests_results, launches=launches, date=date)
+        if submissions:
+            try:
+                self._submissions_col.insert_many(submissions, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                submissions = skip_duplicates(submissions, e)
+        if submissions:
+            self._col.bulk_write(self.get_results_counts_updates(submissions=submissions, date=date), ordered=False)
+            QuestionsStatsStorage.connect(db=self._db).add_results(submissions)
+        return len(submissions)
 
     def get_running_test_results(self, test_id: int, lecturer_id: int) -> dict:
         """
@@ -398,9 +1945,10 @@ class TestsResultsStorage(MongoDB):
         :return: <dict>, dict with test results and launching info
         """
         test_results = self._col.find_one(
-            {'test_id': test_id, 'launched_lecturer_id': lecturer_id, 'is_running': True},
+            self.get_running_query(test_id=test_id, lecturer_id=lecturer_id),
+            sort=[('date', pymongo.DESCENDING)]
         )
-        return test_results if test_results else {}
+        return self._attach_results([test_results])[0] if test_results else {}
 
     def get_running_tests_ids(self) -> list:
         """
@@ -408,7 +1956,7 @@ class TestsResultsStorage(MongoDB):
 
         :return: <list: int>
         """
-        running_tests = self._col.find({'is_running': True})
+        running_tests = self._col.find({'is_running': True}, projection={'test_id': True})
         return [test['test_id'] for test in running_tests] if running_tests else []
 
     def get_running_tests(self) -> list:
@@ -418,7 +1966,7 @@ class TestsResultsStorage(MongoDB):
         :return: <list: dict>
         """
         running_tests = self._col.find({'is_running': True})
-        return list(running_tests) if running_tests else []
+        return self._attach_results(list(running_tests)) if running_tests else []
 
     def stop_running_test(self, test_id: int, lecturer_id: int) -> None:
         """
@@ -428,10 +1976,15 @@ class TestsResultsStorage(MongoDB):
         :param lecturer_id: <int>, lecturer who ran test
         :return: None
         """
-        self._col.find_one_and_update(
-            {'test_id': test_id, 'launched_lecturer_id': lecturer_id, 'is_running': True},
-            {'$set': {'is_running': False}}
+        launch = self._col.find_one_and_update(
+            self.get_running_query(test_id=test_id, lecturer_id=lecturer_id),
+            {'$set': {'is_running': False}},
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
         )
+        if launch:
+            TestsSnapshotsStorage.connect(db=self._db).delete(launch_id=launch['_id'])
+            TestsVariantsStorage.connect(db=self._db).delete(launch_id=launch['_id'])
 
     def get_latest_test_results(self, test_id: int, lecturer_id: int) -> list:
         """
@@ -441,14 +1994,13 @@ class TestsResultsStorage(MongoDB):
         :param lecturer_id: <int>, lecturer who ran test
         :return: <list>, list of results
         """
-        test_results = self._col.find({
-            'test_id': test_id,
-            'launched_lecturer_id': lecturer_id
-        })
-        if test_results:
-            test_results = list(test_results)
-            latest_test_results = max(test_results, key=lambda res: res['date'])
-            return latest_test_results['results']
+        latest_test = self._col.find_one(
+            {'test_id': test_id, 'launched_lecturer_id': lecturer_id},
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        if latest_test:
+            return self._get_results([latest_test['_id']])[latest_test['_id']]
         return []
 
     def get_tests_results(self, test_id: int, lecturer_id: int) -> list:
@@ -466,7 +2018,7 @@ class TestsResultsStorage(MongoDB):
         })
         parsed_test_results = []
         if test_results:
-            for result in test_results:
+            for result in self._attach_results(list(test_results)):
                 for student_result in result['results']:
                     student_result['date'] = student_result['date'].strftime("%H:%M:%S  %d.%m.%y")
                 parsed_test_results.append({
@@ -493,16 +2045,7 @@ class TestsResultsStorage(MongoDB):
         except errors.InvalidId:
             test_results = {}
         if test_results:
-            for student_result in test_results['results']:
-                student_result['date'] = student_result['date'].strftime("%H:%M:%S  %d.%m.%y")
-            return {
-                'id': str(test_results['_id']),
-                'results': test_results['results'],
-                'test_id': test_results['test_id'],
-                'subject_id': test_results['subject_id'],
-                'launched_lecturer_id': test_results['launched_lecturer_id'],
-                'date': test_results['date'].strftime("%H:%M:%S  %d-%b-%y")
-            }
+            return self.parse_launch(self._attach_results([test_results])[0])
         return {}
 
     def get_all_tests_results(self) -> list:
@@ -514,7 +2057,7 @@ class TestsResultsStorage(MongoDB):
         test_results = self._col.find({'is_running': False})
         parsed_test_results = []
         if test_results:
-            for result in test_results:
+            for result in self._attach_results(list(test_results)):
                 for student_result in result['results']:
                     student_result['date'] = student_result['date'].strftime("%H:%M:%S  %d.%m.%y")
                 parsed_test_results.append({
@@ -526,3 +2069,250 @@ class TestsResultsStorage(MongoDB):
                     'results': result['results'],
                 })
         return parsed_test_results
+
+    def get_tests_results_page(self, filters: dict, cursor: str = '', page_size: int = 0) -> dict:
+        """
+        Get page of passed tests launches ordered from newest to oldest.
+        Uses keyset pagination by ('date', '_id'), so each page costs the same
+        regardless of its position. Students results are not included, only their count
+
+        :param filters: <dict>, optional filters
+            {
+                'subject_id': <int>,
+                'launched_lecturer_id': <int>,
+                'test_id': <int>,
+                'date_from': <datetime>, inclusive,
+                'date_to': <datetime>, exclusive
+            }
+        :param cursor: <str>, 'next_cursor' of previous page, empty for first page
+        :param page_size: <int>, settings.RESULTS_PAGE_SIZE by default
+        :return: <dict>
+            {
+                'results': [
+                    {
+                        'id': <str>,
+                        'test_id': <int>,
+                        'subject_id': <int>,
+                        'launched_lecturer_id': <int>,
+                        'date': <str>,
+                        'results_count': <int>
+                    },
+                    ...
+                ],
+                'next_cursor': <str>, empty for last page
+            }
+        :raises ValueError: if 'cursor' is invalid
+        """
+        page_size = page_size or settings.RESULTS_PAGE_SIZE
+        launches = list(self._col.find(
+            self.get_page_query(filters=filters, cursor=cursor),
+            projection={'results': False}
+        ).sort([('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]).limit(page_size + 1))
+        return self.parse_page(launches=launches, page_size=page_size)
+
+    @staticmethod
+    def parse_launch(launch: dict) -> dict:
+        """
+        Convert launch with attached students results to API representation
+
+        :param launch: <dict>, tests launch with 'results' field
+        :return: <dict>, see 'get_test_result'
+        """
+        for student_result in launch['results']:
+            student_result['date'] = student_result['date'].strftime("%H:%M:%S  %d.%m.%y")
+        return {
+            'id': str(launch['_id']),
+            'results': launch['results'],
+            'test_id': launch['test_id'],
+            'subject_id': launch['subject_id'],
+            'launched_lecturer_id': launch['launched_lecturer_id'],
+            'date': launch['date'].strftime("%H:%M:%S  %d-%b-%y")
+        }
+
+    @staticmethod
+    def get_page_query(filters: dict, cursor: str = '') -> dict:
+        """
+        Build query selecting passed tests launches after 'cursor' position
+
+        :param filters: <dict>, see 'get_tests_results_page'
+        :param cursor: <str>, 'next_cursor' of previous page, empty for first page
+        :return: <dict>, MongoDB query
+        :raises ValueError: if 'cursor' is invalid
+        """
+        query = {'is_running': False}
+        for field in ['subject_id', 'launched_lecturer_id', 'test_id']:
+            if filters.get(field) is not None:
+                query[field] = filters[field]
+        if filters.get('date_from') or filters.get('date_to'):
+            query['date'] = {}
+            if filters.get('date_from'):
+                query['date']['$gte'] = filters['date_from']
+            if filters.get('date_to'):
+                query['date']['$lt'] = filters['date_to']
+        if cursor:
+            cursor_date, cursor_id = decode_results_cursor(cursor)
+            query = {'$and': [query, {'$or': [
+                {'date': {'$lt': cursor_date}},
+                {'date': cursor_date, '_id': {'$lt': cursor_id}}
+            ]}]}
+        return query
+
+    @staticmethod
+    def parse_page(launches: list, page_size: int) -> dict:
+        """
+        Convert up to 'page_size' + 1 launches to page of passed tests launches
+
+        :param launches: <list: dict>, launches ordered from newest to oldest
+        :param page_size: <int>
+        :return: <dict>, see 'get_tests_results_page'
+        """
+        next_cursor = ''
+        if len(launches) > page_size:
+            launches = launches[:page_size]
+            next_cursor = encode_results_cursor(launches[-1]['date'], launches[-1]['_id'])
+        return {
+            'results': [{
+                'id': str(launch['_id']),
+                'test_id': launch['test_id'],
+                'subject_id': launch['subject_id'],
+                'launched_lecturer_id': launch['launched_lecturer_id'],
+                'date': launch['date'].strftime("%H:%M:%S  %d.%m.%y"),
+                'results_count': launch.get('results_count', 0)
+            } for launch in launches],
+            'next_cursor': next_cursor
+        }
+
+    def get_items_analysis(self, launch_id: str = '', test_id: int = None) -> dict:
+        """
+        Get difficulty statistics of questions over students results of one
+        launch or of all launches of test, computed by single aggregation
+
+        :param launch_id: <str>, launch id
+        :param test_id: <int>, used if 'launch_id' is empty
+        :return: <dict>, empty if launch does not exist
+            {
+                'test_id': <int>,
+                'submissions_count': <int>,
+                'average_time': <float>, average time of passing test in seconds,
+                'average_right_answers_count': <float>,
+                'questions': [
+                    {
+                        'id': <str>, str(ObjectId()),
+                        'answers_count': <int>, number of results with question,
+                        'unanswered_count': <int>,
+                        'right_answers_count': <int>,
+                        'right_answers_share': <float>,
+                        'most_picked_wrong_answer': <str> or None,
+                        'most_picked_wrong_answer_count': <int>
+                    },
+                    ...
+                ], hardest questions first
+            }
+        """
+        if launch_id:
+            try:
+                launch_ids = [ObjectId(launch_id)]
+            except errors.InvalidId:
+                return {}
+            launch = self._col.find_one({'_id': launch_ids[0]}, projection={'test_id': True})
+            if not launch:
+                return {}
+            test_id = launch['test_id']
+        else:
+            launch_ids = [launch['_id'] for launch in self._col.find(
+                {'test_id': test_id},
+                projection={'_id': True}
+            )]
+        questions_stage = [
+            {'$unwind': '$questions'},
+            {'$project': {
+                'id': '$questions.id',
+                'is_true': {'$cond': ['$questions.is_true', 1, 0]},
+                'is_unanswered': {'$cond': [
+                    {'$eq': [{'$size': {'$ifNull': ['$questions.selected_answers', []]}}, 0]}, 1, 0
+                ]},
+                'wrong_answers': {'$setDifference': [
+                    {'$ifNull': ['$questions.selected_answers', []]},
+                    {'$ifNull': ['$questions.right_answers', []]}
+                ]}
+            }}
+        ]
+        report = next(self._submissions_col.aggregate([
+            {'$match': {'launch_id': {'$in': launch_ids}}},
+            {'$facet': {
+                'summary': [
+                    {'$group': {
+                        '_id': None,
+                        'submissions_count': {'$sum': 1},
+                        'average_time': {'$avg': '$time'},
+                        'average_right_answers_count': {'$avg': '$right_answers_count'}
+                    }}
+                ],
+                'questions': questions_stage + [
+                    {'$group': {
+                        '_id': '$id',
+                        'answers_count': {'$sum': 1},
+                        'unanswered_count': {'$sum': '$is_unanswered'},
+                        'right_answers_count': {'$sum': '$is_true'}
+                    }}
+                ],
+                'wrong_answers': questions_stage + [
+                    {'$unwind': '$wrong_answers'},
+                    {'$group': {'_id': {'id': '$id', 'answer': '$wrong_answers'}, 'count': {'$sum': 1}}},
+                    {'$sort': {'count': pymongo.DESCENDING}},
+                    {'$group': {
+                        '_id': '$_id.id',
+                        'answer': {'$first': '$_id.answer'},
+                        'count': {'$first': '$count'}
+                    }}
+                ]
+            }}
+        ]))
+        summary = report['summary'][0] if report['summary'] else {}
+        wrong_answers = {item['_id']: item for item in report['wrong_answers']}
+        questions = [{
+            'id': question['_id'],
+            'answers_count': question['answers_count'],
+            'unanswered_count': question['unanswered_count'],
+            'right_answers_count': question['right_answers_count'],
+            'right_answers_share': question['right_answers_count'] / question['answers_count'],
+            'most_picked_wrong_answer': wrong_answers.get(question['_id'], {}).get('answer'),
+            'most_picked_wrong_answer_count': wrong_answers.get(question['_id'], {}).get('count', 0)
+        } for question in report['questions']]
+        questions.sort(key=lambda question: (question['right_answers_share'], question['id']))
+        return {
+            'test_id': test_id,
+            'submissions_count': summary.get('submissions_count', 0),
+            'average_time': summary.get('average_time') or 0,
+            'average_right_answers_count': summary.get('average_right_answers_count') or 0,
+            'questions': questions
+        }
+
+    def split_embedded_results(self) -> int:
+        """
+        Move students results embedded into 'results' array of launches
+        stored by previous versions to 'tests_submissions' collection.
+        Safe to run repeatedly, already moved results are not duplicated
+
+        :return: <int>, number of moved launches
+        """
+        moved_count = 0
+        for launch in self._col.find({'results': {'$exists': True}}):
+            requests = [
+                pymongo.UpdateOne(
+                    {'launch_id': launch['_id'], 'legacy_index': i},
+                    {'$setOnInsert': {**result, 'launch_id': launch['_id'], 'legacy_index': i}},
+                    upsert=True)
+                for i, result in enumerate(launch['results'])
+            ]
+            if requests:
+                self._submissions_col.bulk_write(requests, ordered=False)
+            self._col.update_one(
+                {'_id': launch['_id']},
+                {
+                    '$unset': {'results': ''},
+                    '$inc': {'results_count': len(launch['results'])}
+                }
+            )
+            moved_count += 1
+        return moved_count
@@ -0,0 +1,694 @@
+# pylint: disable=import-error, too-few-public-methods, invalid-name, relative-beyond-top-level
+"""
+Asyncio twins of MongoDB storages from main.mongo, built on Motor.
+Methods have the same names, arguments and results as methods of
+synchronous storages, but are coroutines, see main.mongo for their documentation.
+Queries, updates and processing of results are built by static methods of
+synchronous storages, twins only run them through Motor
+"""
+import os
+import copy
+import asyncio
+import threading
+from datetime import datetime, timedelta
+import pymongo
+import pymongo.errors
+from asgiref.sync import sync_to_async
+from bson import ObjectId, errors
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from django.conf import settings
+from .mongo import get_conn, skip_duplicates, get_sample_pipeline, sample_cached, questions_cache, \
+    snapshots_cache, QuestionsStorage, TestsSnapshotsStorage, QuestionsStatsStorage, RunningTestsAnswersStorage, \
+    TestsResultsStorage
+
+
+class AsyncConnectionManager:
+    """
+    Process-wide manager of AsyncIOMotorClient objects - one pooled client per
+    (host, port) and event loop. Motor clients are bound to the loop they were
+    created in, clients of closed loops are closed on next client creation
+
+    _pid:     id of process which owns clients
+    _clients: <dict>, {(id(loop), host, port): (loop, AsyncIOMotorClient)}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients = {}
+
+    def get_client(self, host: str, port: int) -> AsyncIOMotorClient:
+        """
+        Get pooled client for 'host', 'port' and running event loop, create it on first call
+
+        :param host: MongoDB host
+        :param port: MongoDB port
+        :return: AsyncIOMotorClient
+        """
+        loop = asyncio.get_event_loop()
+        key = (id(loop), host, port)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._clients = {}
+            entry = self._clients.get(key)
+            if entry is None or entry[0] is not loop:
+                for other_key, (other_loop, other_client) in list(self._clients.items()):
+                    if other_loop.is_closed():
+                        other_client.close()
+                        del self._clients[other_key]
+                client = AsyncIOMotorClient(host, port, io_loop=loop, **settings.MONGO_CLIENT_OPTIONS)
+                entry = self._clients[key] = (loop, client)
+        return entry[1]
+
+    def close(self) -> None:
+        """
+        Close all clients of current process
+        """
+        with self._lock:
+            for _, client in self._clients.values():
+                client.close()
+            self._clients = {}
+
+
+async_connection_manager = AsyncConnectionManager()
+
+
+def get_async_conn(db_name: str = '') -> AsyncIOMotorDatabase:
+    """
+    Get asyncio connection to MongoDB database for running event loop
+
+    :param db_name: MongoDB database name, database of main.mongo.get_conn() by default
+    :return: AsyncIOMotorDatabase
+    """
+    client = async_connection_manager.get_client(
+        host=settings.DATABASES['default']['HOST'],
+        port=settings.DATABASES['default']['PORT'])
+    return client[db_name or get_conn().name]
+
+
+class AsyncMongoDB:
+    """
+    Base class for classes working with MongoDB using Motor
+
+    _db:     Motor database
+    _col:    Motor collection
+    """
+
+    _db: AsyncIOMotorDatabase
+    _col: AsyncIOMotorCollection
+
+    def set_collection(self, db: AsyncIOMotorDatabase, collection_name: str) -> None:
+        """
+        Connect to collection 'collection_name' of database 'db'
+
+        :param db: Motor database
+        :param collection_name: name of database collection
+        """
+        self._db = db
+        self._col = db[collection_name]
+
+
+class AsyncQuestionsStorage(AsyncMongoDB):
+    """
+    Asyncio twin of main.mongo.QuestionsStorage, shares process-wide 'questions_cache' with it
+
+    _versions_col: Motor collection with questions banks versions
+    media_jobs:    <list: str>, ids of jobs removing images of questions deleted by this object
+    """
+
+    _versions_col: AsyncIOMotorCollection
+    media_jobs: list
+
+    @staticmethod
+    def connect(db: AsyncIOMotorDatabase):
+        """
+        Establish connection to database collection 'questions'
+
+        :param db: Motor database
+        :return: AsyncQuestionsStorage object
+        """
+        storage = AsyncQuestionsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='questions')
+        return storage
+
+    def set_collection(self, db: AsyncIOMotorDatabase, collection_name: str) -> None:
+        """
+        See QuestionsStorage.set_collection
+        """
+        super().set_collection(db=db, collection_name=collection_name)
+        self._versions_col = db['questions_versions']
+        self.media_jobs = []
+
+    async def get_version(self, test_id: int) -> int:
+        """
+        See QuestionsStorage.get_version
+        """
+        version = await self._versions_col.find_one({'_id': test_id})
+        return version['version'] if version else 0
+
+    async def _bump_version(self, test_id: int) -> None:
+        """
+        See QuestionsStorage._bump_version
+        """
+        await self._versions_col.update_one(
+            {'_id': test_id},
+            {'$inc': {'version': 1}},
+            upsert=True)
+        questions_cache.invalidate(test_id)
+
+    async def _get_cached_bank(self, test_id: int) -> list:
+        """
+        See QuestionsStorage._get_cached_bank
+        """
+        version = await self.get_version(test_id=test_id)
+        questions = questions_cache.get(test_id=test_id, version=version)
+        if questions is None:
+            questions = await self._col.find({
+                'test_id': test_id
+            }).to_list(length=None)
+            questions_cache.put(test_id=test_id, version=version, questions=questions)
+        return questions
+
+    async def add_one(self, question, test_id: int) -> None:
+        """
+        See QuestionsStorage.add_one
+        """
+        question['test_id'] = test_id
+        await self._col.insert_one(question)
+        await self._bump_version(test_id=test_id)
+
+    async def add_many(self, questions: list, test_id: int, batch_size: int = 0) -> dict:
+        """
+        See QuestionsStorage.add_many
+        """
+        inserted_count = 0
+        write_errors = []
+        for start, batch in QuestionsStorage.get_insert_batches(
+                questions=questions, test_id=test_id, batch_size=batch_size):
+            try:
+                inserted_count += len((await self._col.insert_many(batch, ordered=False)).inserted_ids)
+            except pymongo.errors.BulkWriteError as e:
+                inserted_count += e.details['nInserted']
+                write_errors += QuestionsStorage.get_write_errors(start=start, error=e)
+        if inserted_count:
+            await self._bump_version(test_id=test_id)
+        return {
+            'inserted_count': inserted_count,
+            'errors': write_errors
+        }
+
+    async def get_one(self, test_id: int, question_formulation: str = '', question_id: str = '') -> dict:
+        """
+        See QuestionsStorage.get_one
+        """
+        query = QuestionsStorage.get_question_query(question_formulation=question_formulation, question_id=question_id)
+        questions = questions_cache.get(test_id=test_id, version=await self.get_version(test_id=test_id))
+        if questions is None:
+            return await self._col.find_one({**query, 'test_id': test_id})
+        return QuestionsStorage.find_cached(questions=questions, query=query)
+
+    async def get_many(self, test_id: int) -> list:
+        """
+        See QuestionsStorage.get_many
+        """
+        return copy.deepcopy(await self._get_cached_bank(test_id=test_id))
+
+    async def sample(self, test_id: int, k: int) -> list:
+        """
+        See QuestionsStorage.sample
+        """
+        bank_size = await self._col.count_documents({'test_id': test_id})
+        if bank_size <= settings.QUESTIONS_SAMPLE_THRESHOLD:
+            return sample_cached(await self._get_cached_bank(test_id=test_id), k=k)
+        return await self._col.aggregate(get_sample_pipeline({'test_id': test_id}, k=k)).to_list(length=None)
+
+    async def count_by_tests(self, test_ids: list) -> dict:
+        """
+        See QuestionsStorage.count_by_tests
+        """
+        counts = await self._col.aggregate([
+            {'$match': {'test_id': {'$in': list(test_ids)}}},
+            {'$group': {'_id': '$test_id', 'count': {'$sum': 1}}}
+        ]).to_list(length=None)
+        return {item['_id']: item['count'] for item in counts}
+
+    async def _remove_media(self, test_id: int, questions: list) -> None:
+        """
+        Release images of questions by synchronous QuestionsStorage.remove_media
+        """
+        storage = QuestionsStorage.connect(db=get_conn())
+        await sync_to_async(storage.remove_media)(test_id=test_id, questions=questions)
+        self.media_jobs += storage.media_jobs
+
+    async def delete_by_formulation(self, question_formulation: str, test_id: int) -> None:
+        """
+        See QuestionsStorage.delete_by_formulation
+        """
+        question = await self.get_one(
+            question_formulation=question_formulation,
+            test_id=test_id
+        )
+        await self._remove_media(test_id=test_id, questions=[question])
+        await self._col.delete_one({
+            'test_id': test_id,
+            'formulation': question_formulation
+        })
+        await self._bump_version(test_id=test_id)
+
+    async def delete_by_id(self, question_id: str, test_id: int) -> None:
+        """
+        See QuestionsStorage.delete_by_id
+        """
+        question = await self._col.find_one({
+            '_id': ObjectId(question_id),
+        })
+        await self._remove_media(test_id=test_id, questions=[question])
+        await self._col.delete_one({
+            '_id': ObjectId(question_id)
+        })
+        await self._bump_version(test_id=test_id)
+
+    async def update_formulation(self, question_id: str, formulation: str) -> None:
+        """
+        See QuestionsStorage.update_formulation
+        """
+        question = await self._col.find_one_and_update(
+            {'_id': ObjectId(question_id)},
+            {'$set': {'formulation': formulation}}
+        )
+        if question:
+            await self._bump_version(test_id=question['test_id'])
+
+    async def update(self, question_id: str, formulation: str, options: list) -> None:
+        """
+        See QuestionsStorage.update
+        """
+        question = await self._col.find_one_and_update(
+            {'_id': ObjectId(question_id)},
+            {'$set': {'formulation': formulation, 'options': options}}
+        )
+        if question:
+            await self._bump_version(test_id=question['test_id'])
+
+    async def delete_many(self, test_id: int) -> int:
+        """
+        See QuestionsStorage.delete_many
+        """
+        questions = await self.get_many(test_id=test_id)
+        await self._remove_media(test_id=test_id, questions=questions)
+        deleted_questions_count = (await self._col.delete_many({
+            'test_id': test_id,
+        })).deleted_count
+        await self._bump_version(test_id=test_id)
+        return deleted_questions_count
+
+
+class AsyncTestsSnapshotsStorage(AsyncMongoDB):
+    """
+    Asyncio twin of main.mongo.TestsSnapshotsStorage, shares process-wide 'snapshots_cache' with it
+    """
+
+    @staticmethod
+    def connect(db: AsyncIOMotorDatabase):
+        """
+        Establish connection to database collection 'tests_snapshots'
+
+        :param db: Motor database
+        :return: AsyncTestsSnapshotsStorage object
+        """
+        storage = AsyncTestsSnapshotsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='tests_snapshots')
+        return storage
+
+    async def freeze(self, launch_id: ObjectId, questions: list, answer_keys: list) -> None:
+        """
+        See TestsSnapshotsStorage.freeze
+        """
+        for batch in TestsSnapshotsStorage.get_entries_batches(
+                launch_id=launch_id, questions=questions, answer_keys=answer_keys):
+            await self._col.insert_many(batch)
+
+    async def sample(self, launch_id: ObjectId, k: int) -> list:
+        """
+        See TestsSnapshotsStorage.sample
+        """
+        entries = snapshots_cache.get(test_id=launch_id, version=0)
+        if entries is None:
+            snapshot_size = await self._col.count_documents({'launch_id': launch_id})
+            if snapshot_size > settings.QUESTIONS_SAMPLE_THRESHOLD:
+                return await self._col.aggregate(
+                    get_sample_pipeline({'launch_id': launch_id}, k=k)).to_list(length=None)
+            entries = await self._col.find({'launch_id': launch_id}).to_list(length=None)
+            if entries:
+                snapshots_cache.put(test_id=launch_id, version=0, questions=entries)
+        return sample_cached(entries, k=k)
+
+    async def delete(self, launch_id: ObjectId) -> None:
+        """
+        See TestsSnapshotsStorage.delete
+        """
+        await self._col.delete_many({'launch_id': launch_id})
+        snapshots_cache.invalidate(launch_id)
+
+
+class AsyncTestsVariantsStorage(AsyncMongoDB):
+    """
+    Asyncio twin of main.mongo.TestsVariantsStorage
+    """
+
+    @staticmethod
+    def connect(db: AsyncIOMotorDatabase):
+        """
+        Establish connection to database collection 'tests_variants'
+
+        :param db: Motor database
+        :return: AsyncTestsVariantsStorage object
+        """
+        storage = AsyncTestsVariantsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='tests_variants')
+        return storage
+
+    async def claim(self, launch_id: ObjectId):
+        """
+        See TestsVariantsStorage.claim
+        """
+        return await self._col.find_one_and_delete({'launch_id': launch_id})
+
+    async def delete(self, launch_id: ObjectId) -> None:
+        """
+        See TestsVariantsStorage.delete
+        """
+        await self._col.delete_many({'launch_id': launch_id})
+
+
+class AsyncRunningTestsAnswersStorage(AsyncMongoDB):
+    """
+    Asyncio twin of main.mongo.RunningTestsAnswersStorage
+    """
+
+    @staticmethod
+    def connect(db: AsyncIOMotorDatabase):
+        """
+        Establish connection to database collection 'running_tests_answers'
+
+        :param db: Motor database
+        :return: AsyncRunningTestsAnswersStorage object
+        """
+        storage = AsyncRunningTestsAnswersStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='running_tests_answers')
+        return storage
+
+    async def add(self, right_answers, test_id: str, user_id: str, test_duration: int):
+        """
+        See RunningTestsAnswersStorage.add
+        """
+        return (await self._col.insert_one(RunningTestsAnswersStorage.new_attempt(
+            right_answers=right_answers,
+            test_id=test_id,
+            user_id=user_id,
+            test_duration=test_duration))).inserted_id
+
+    async def start(self, right_answers, test_id: int, user_id: int, test_duration: int):
+        """
+        See RunningTestsAnswersStorage.start
+        """
+        await self.abandon(user_id=user_id)
+        return await self.add(
+            right_answers=right_answers,
+            test_id=test_id,
+            user_id=user_id,
+            test_duration=test_duration)
+
+    async def get(self, user_id: int) -> dict:
+        """
+        See RunningTestsAnswersStorage.get
+        """
+        return await self._col.find_one(RunningTestsAnswersStorage.get_active_query(user_id))
+
+    async def pop(self, user_id: int) -> dict:
+        """
+        See RunningTestsAnswersStorage.pop
+        """
+        return await self._col.find_one_and_delete(RunningTestsAnswersStorage.get_active_query(user_id))
+
+    async def get_left_time(self, user_id: int):
+        """
+        See RunningTestsAnswersStorage.get_left_time
+        """
+        right_answers = await self._col.find_one(
+            RunningTestsAnswersStorage.get_active_query(user_id),
+            projection={'start_date': True, 'test_duration': True})
+        if not right_answers:
+            return None
+        return RunningTestsAnswersStorage.get_attempt_left_time(right_answers)
+
+    async def delete(self, user_id: int) -> None:
+        """
+        See RunningTestsAnswersStorage.delete
+        """
+        await self._col.delete_one(RunningTestsAnswersStorage.get_active_query(user_id))
+
+    async def abandon(self, user_id: int) -> None:
+        """
+        See RunningTestsAnswersStorage.abandon
+        """
+        await self._col.update_many(*RunningTestsAnswersStorage.get_abandon_update(user_id))
+
+    async def cleanup(self, user_id: int) -> list:
+        """
+        See RunningTestsAnswersStorage.cleanup
+        """
+        docs = await self._col.find({
+            'user_id': user_id,
+        }).to_list(length=None)
+        await self._col.delete_many({
+            'user_id': user_id,
+        })
+        return docs
+
+
+class AsyncQuestionsStatsStorage(AsyncMongoDB):
+    """
+    Asyncio twin of main.mongo.QuestionsStatsStorage, counters are rebuilt by synchronous storage only
+    """
+
+    @staticmethod
+    def connect(db: AsyncIOMotorDatabase):
+        """
+        Establish connection to database collection 'questions_stats'
+
+        :param db: Motor database
+        :return: AsyncQuestionsStatsStorage object
+        """
+        storage = AsyncQuestionsStatsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='questions_stats')
+        return storage
+
+    async def add_results(self, tests_results: list) -> None:
+        """
+        See QuestionsStatsStorage.add_results
+        """
+        updates = QuestionsStatsStorage.get_updates(tests_results)
+        if updates:
+            await self._col.bulk_write(updates, ordered=False)
+
+
+class AsyncTestsResultsStorage(AsyncMongoDB):
+    """
+    Asyncio twin of main.mongo.TestsResultsStorage. Full history scans
+    ('get_tests_results', 'get_all_tests_results') and migration of embedded
+    results are served by synchronous storage only
+
+    _submissions_col: Motor collection with students results
+    """
+
+    _submissions_col: AsyncIOMotorCollection
+
+    @staticmethod
+    def connect(db: AsyncIOMotorDatabase):
+        """
+        Establish connection to database collection 'tests_results'
+
+        :param db: Motor database
+        :return: AsyncTestsResultsStorage object
+        """
+        storage = AsyncTestsResultsStorage()
+        storage.set_collection(
+            db=db,
+            collection_name='tests_results')
+        return storage
+
+    def set_collection(self, db: AsyncIOMotorDatabase, collection_name: str) -> None:
+        """
+        See TestsResultsStorage.set_collection
+        """
+        super().set_collection(db=db, collection_name=collection_name)
+        self._submissions_col = db['tests_submissions']
+
+    async def _get_results(self, launch_ids: list) -> dict:
+        """
+        See TestsResultsStorage._get_results
+        """
+        submissions = await self._submissions_col.find(
+            {'launch_id': {'$in': launch_ids}},
+            projection={'_id': False}
+        ).sort('date', pymongo.ASCENDING).to_list(length=None)
+        return TestsResultsStorage.group_results(launch_ids=launch_ids, submissions=submissions)
+
+    async def _attach_results(self, launches: list) -> list:
+        """
+        See TestsResultsStorage._attach_results
+        """
+        results = await self._get_results([launch['_id'] for launch in launches])
+        for launch in launches:
+            launch['results'] = results[launch['_id']]
+        return launches
+
+    async def add_running_test(self, test_id: int, lecturer_id: int, subject_id: int, launch_id: ObjectId = None):
+        """
+        See TestsResultsStorage.add_running_test
+        """
+        return (await self._col.insert_one(TestsResultsStorage.new_launch(
+            test_id=test_id,
+            lecturer_id=lecturer_id,
+            subject_id=subject_id,
+            launch_id=launch_id))).inserted_id
+
+    async def get_running_launch_id(self, test_id: int):
+        """
+        See TestsResultsStorage.get_running_launch_id
+        """
+        launch = await self._col.find_one(
+            TestsResultsStorage.get_running_query(test_id=test_id),
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        return launch['_id'] if launch else None
+
+    async def add_results_to_running_test(self, test_result: dict, test_id: int) -> None:
+        """
+        See TestsResultsStorage.add_results_to_running_test
+        """
+        test_result['date'] = datetime.now() + timedelta(hours=3)
+        launch = await self._col.find_one_and_update(
+            TestsResultsStorage.get_running_query(test_id=test_id),
+            TestsResultsStorage.get_results_count_update(date=test_result['date']),
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        if launch:
+            await self._submissions_col.insert_one({
+                **test_result,
+                'launch_id': launch['_id']
+            })
+            await AsyncQuestionsStatsStorage.connect(db=self._db).add_results([test_result])
+
+    async def add_results_to_running_tests(self, tests_results: list) -> int:
+        """
+        See TestsResultsStorage.add_results_to_running_tests
+        """
+        running_tests = self._col.find(
+            TestsResultsStorage.get_running_query(test_id={'$in': list({test_id for test_id, _ in tests_results})}),
+            projection={'test_id': True}
+        ).sort('date', pymongo.ASCENDING)
+        launches = {launch['test_id']: launch['_id'] async for launch in running_tests}
+
+        date = datetime.now() + timedelta(hours=3)
+        submissions = TestsResultsStorage.get_submissions(tests_results=tests_results, launches=launches, date=date)
+        if submissions:
+            try:
+                await self._submissions_col.insert_many(submissions, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                submissions = skip_duplicates(submissions, e)
+        if submissions:
+            await self._col.bulk_write(
+                TestsResultsStorage.get_results_counts_updates(submissions=submissions, date=date), ordered=False)
+            await AsyncQuestionsStatsStorage.connect(db=self._db).add_results(submissions)
+        return len(submissions)
+
+    async def get_running_test_results(self, test_id: int, lecturer_id: int) -> dict:
+        """
+        See TestsResultsStorage.get_running_test_results
+        """
+        test_results = await self._col.find_one(
+            TestsResultsStorage.get_running_query(test_id=test_id, lecturer_id=lecturer_id),
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        return (await self._attach_results([test_results]))[0] if test_results else {}
+
+    async def get_running_tests_ids(self) -> list:
+        """
+        See TestsResultsStorage.get_running_tests_ids
+        """
+        running_tests = self._col.find({'is_running': True}, projection={'test_id': True})
+        return [test['test_id'] async for test in running_tests]
+
+    async def get_running_tests(self) -> list:
+        """
+        See TestsResultsStorage.get_running_tests
+        """
+        running_tests = await self._col.find({'is_running': True}).to_list(length=None)
+        return await self._attach_results(running_tests)
+
+    async def stop_running_test(self, test_id: int, lecturer_id: int) -> None:
+        """
+        See TestsResultsStorage.stop_running_test
+        """
+        launch = await self._col.find_one_and_update(
+            TestsResultsStorage.get_running_query(test_id=test_id, lecturer_id=lecturer_id),
+            {'$set': {'is_running': False}},
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        if launch:
+            await AsyncTestsSnapshotsStorage.connect(db=self._db).delete(launch_id=launch['_id'])
+            await AsyncTestsVariantsStorage.connect(db=self._db).delete(launch_id=launch['_id'])
+
+    async def get_latest_test_results(self, test_id: int, lecturer_id: int) -> list:
+        """
+        See TestsResultsStorage.get_latest_test_results
+        """
+        latest_test = await self._col.find_one(
+            {'test_id': test_id, 'launched_lecturer_id': lecturer_id},
+            projection={'_id': True},
+            sort=[('date', pymongo.DESCENDING)]
+        )
+        if latest_test:
+            return (await self._get_results([latest_test['_id']]))[latest_test['_id']]
+        return []
+
+    async def get_test_result(self, _id: str) -> dict:
+        """
+        See TestsResultsStorage.get_test_result
+        """
+        try:
+            test_results = await self._col.find_one({
+                '_id': ObjectId(_id)
+            })
+        except errors.InvalidId:
+            test_results = {}
+        if test_results:
+            return TestsResultsStorage.parse_launch((await self._attach_results([test_results]))[0])
+        return {}
+
+    async def get_tests_results_page(self, filters: dict, cursor: str = '', page_size: int = 0) -> dict:
+        """
+        See TestsResultsStorage.get_tests_results_page
+        """
+        page_size = page_size or settings.RESULTS_PAGE_SIZE
+        launches = await self._col.find(
+            TestsResultsStorage.get_page_query(filters=filters, cursor=cursor),
+            projection={'results': False}
+        ).sort([('date', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]).limit(page_size + 1).to_list(length=None)
+        return TestsResultsStorage.parse_page(launches=launches, page_size=page_size)
@@ -0,0 +1,141 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Server-side publisher of running tests updates. Polls 'tests_results' and
+'running_tests_answers' collections and sends channel layer events about
+launched and stopped tests, started attempts and passed tests to websocket
+clients of RunningTestsConsumer, and stop events to timers of attempts of
+stopped tests (see AttemptTimerConsumer). Works with any MongoDB deployment,
+change streams are not required
+"""
+import asyncio
+
+import pymongo.errors
+
+from django.conf import settings
+
+from . import mongo_async
+
+
+GROUP_NAME = 'running_tests'
+ATTEMPTS_GROUP_NAME = 'attempts_%d'
+
+TEST_WAS_LAUNCHED = 'test was launched'
+TEST_WAS_STOPPED = 'test was stopped'
+TEST_WAS_STARTED = 'test was started'
+TEST_WAS_PASSED = 'test was passed'
+
+
+class RunningTestsPublisher:
+    """
+    Polling tailer of running tests state, one per event loop
+
+    _launches: <dict>, {launch_id: results_count} of running tests, None before first poll
+    _attempts: <dict>, {test_id: number of attempts in progress}
+    _tests:    <dict>, {launch_id: test_id} of running tests
+
+    stopped_tests: <set: int>, ids of tests stopped between two latest polls
+    """
+
+    def __init__(self):
+        self._launches = None
+        self._attempts = {}
+        self._tests = {}
+        self.stopped_tests = set()
+
+    @staticmethod
+    def get_actions(previous: tuple, current: tuple) -> list:
+        """
+        Get actions which changed running tests state 'previous' to 'current'
+
+        :param previous: <tuple>, (launches: <dict>, attempts: <dict>), see class attributes
+        :param current: <tuple>, (launches: <dict>, attempts: <dict>)
+        :return: <list: str>, actions in order launched, stopped, started, passed
+        """
+        previous_launches, previous_attempts = previous
+        launches, attempts = current
+        actions = []
+        if launches.keys() - previous_launches.keys():
+            actions.append(TEST_WAS_LAUNCHED)
+        if previous_launches.keys() - launches.keys():
+            actions.append(TEST_WAS_STOPPED)
+        if any(count > previous_attempts.get(test_id, 0) for test_id, count in attempts.items()):
+            actions.append(TEST_WAS_STARTED)
+        if any(count > previous_launches.get(launch_id, 0) for launch_id, count in launches.items()):
+            actions.append(TEST_WAS_PASSED)
+        return actions
+
+    @staticmethod
+    def get_stopped_tests(previous: dict, current: dict) -> set:
+        """
+        Get ids of tests which were running and have no running launches now
+
+        :param previous: <dict>, {launch_id: test_id} of running tests
+        :param current: <dict>, {launch_id: test_id} of running tests
+        :return: <set: int>
+        """
+        return set(previous.values()) - set(current.values())
+
+    async def poll(self, db) -> list:
+        """
+        Read running tests state and get actions since previous poll,
+        tests stopped since previous poll are stored in 'stopped_tests'
+
+        :param db: AsyncIOMotorDatabase
+        :return: <list: str>, actions, empty on first poll
+        """
+        launches = {}
+        tests = {}
+        running_tests = db['tests_results'].find(
+            {'is_running': True},
+            projection={'results_count': True, 'test_id': True})
+        async for launch in running_tests:
+            launches[launch['_id']] = launch.get('results_count', 0)
+            tests[launch['_id']] = launch['test_id']
+        attempts = await db['running_tests_answers'].aggregate([
+            {'$match': {'abandoned': {'$ne': True}, 'claimed_by': None}},
+            {'$group': {'_id': '$test_id', 'count': {'$sum': 1}}}
+        ]).to_list(length=None)
+        attempts = {item['_id']: item['count'] for item in attempts}
+        actions = []
+        if self._launches is not None:
+            actions = self.get_actions((self._launches, self._attempts), (launches, attempts))
+        self.stopped_tests = self.get_stopped_tests(self._tests, tests)
+        self._launches, self._attempts, self._tests = launches, attempts, tests
+        return actions
+
+    async def run(self, channel_layer, interval: float = 0) -> None:
+        """
+        Poll running tests state forever and send actions to websocket clients
+
+        :param channel_layer: channel layer of RunningTestsConsumer
+        :param interval: <float>, settings.RUNNING_TESTS_POLL_INTERVAL by default
+        """
+        while True:
+            try:
+                for action in await self.poll(db=mongo_async.get_async_conn()):
+                    await channel_layer.group_send(GROUP_NAME, {
+                        'type': 'action',
+                        'action': action
+                    })
+                for test_id in self.stopped_tests:
+                    await channel_layer.group_send(ATTEMPTS_GROUP_NAME % test_id, {
+                        'type': 'stop'
+                    })
+            except pymongo.errors.PyMongoError as e:
+                print('%s - ошибка при отслеживании запущенных тестов' % e)
+            await asyncio.sleep(interval or settings.RUNNING_TESTS_POLL_INTERVAL)
+
+
+__publishers: dict = {}
+
+
+def ensure_publisher(channel_layer) -> None:
+    """
+    Start publisher in running event loop if it is not started yet
+
+    :param channel_layer: channel layer of RunningTestsConsumer
+    """
+    loop = asyncio.get_event_loop()
+    task = __publishers.get(id(loop))
+    if task is None or task.done():
+        __publishers[id(loop)] = loop.create_task(RunningTestsPublisher().run(channel_layer))
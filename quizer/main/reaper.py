@@ -0,0 +1,59 @@
+# pylint: disable=import-error, relative-beyond-top-level
+"""
+Grading of expired and abandoned tests attempts
+"""
+import time
+
+import pymongo.errors
+
+from django.contrib.auth.models import User
+from django.conf import settings
+
+from . import mongo
+from . import utils
+
+
+def reap_expired_attempts(batch_size: int = 0) -> int:
+    """
+    Grade one batch of expired and abandoned attempts as passed
+    without answers and add results to running tests
+
+    :param batch_size: <int>, settings.REAPER_BATCH_SIZE by default
+    :return: <int>, number of graded attempts
+    """
+    answers_storage = mongo.RunningTestsAnswersStorage.connect(db=mongo.get_conn())
+    attempts = answers_storage.claim_expired(limit=batch_size or settings.REAPER_BATCH_SIZE)
+    if not attempts:
+        return 0
+    usernames = dict(User.objects.filter(
+        id__in={attempt['user_id'] for attempt in attempts}
+    ).values_list('id', 'username'))
+    tests_results = [(attempt['test_id'], utils.grade_answers(
+        answers={},
+        right_answers=attempt['right_answers'],
+        test_duration=attempt['test_duration'],
+        time_left=0,
+        user_id=attempt['user_id'],
+        username=usernames.get(attempt['user_id'], ''))) for attempt in attempts]
+    results_storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
+    results_storage.add_results_to_running_tests(tests_results=tests_results)
+    answers_storage.delete_claimed(attempts=attempts)
+    return len(attempts)
+
+
+def run_reaper(interval: int = 0, batch_size: int = 0) -> None:
+    """
+    Grade expired attempts forever, sleeping 'interval' seconds when there is nothing to grade
+
+    :param interval: <int>, settings.REAPER_INTERVAL by default
+    :param batch_size: <int>, settings.REAPER_BATCH_SIZE by default
+    """
+    batch_size = batch_size or settings.REAPER_BATCH_SIZE
+    while True:
+        try:
+            graded_count = reap_expired_attempts(batch_size=batch_size)
+        except pymongo.errors.PyMongoError as e:
+            print('%s - ошибка при проверке просроченных попыток прохождения тестов' % e)
+            graded_count = 0
+        if graded_count < batch_size:
+            time.sleep(interval or settings.REAPER_INTERVAL)
@@ -56,11 +56,6 @@ function launchTest(socket, testID, testsUrl, staticPath, launchTestAPIUrl, runT
         if (response.ok) {
             renderInfoModalWindow("Тест запущен", response.message);
             renderAvailableTests(socket, testsUrl, staticPath, launchTestAPIUrl, runTestForLecturerUrl, questionsAPIUrl);
-
-            let launchData = {
-                action: 'test was launched'
-            }
-            socket.send(JSON.stringify(launchData));
         } else {
             renderInfoModalWindow("Ошибка", response.message);
         }
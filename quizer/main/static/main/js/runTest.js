@@ -1,20 +1,64 @@
+function getAttemptTimerWebSocket(socketPath) {
+    let loc = window.location;
+    let wsStart = 'ws://'
+    if (loc.protocol === 'https:') {
+        wsStart = 'wss://';
+    }
+    return new WebSocket(wsStart + loc.host + socketPath);
+}
+
 function runTest(timeLeft, postUrl, token) {
-    if (timeLeft < 0) {
-       document.getElementById("stop-button").click();
-       return;
+    // time left is sent by websocket on postUrl, polling is used if websocket is not available
+    let deadline = Date.now() + timeLeft * 1000;
+    let isPolling = !window.WebSocket;
+    let ticks = 0;
+
+    function stopTest() {
+        document.getElementById("stop-button").click();
+    }
+
+    function setTimeLeft(newTimeLeft) {
+        if (newTimeLeft !== undefined) {
+            deadline = Date.now() + newTimeLeft * 1000;
+        }
+    }
+
+    if (window.WebSocket) {
+        const socket = getAttemptTimerWebSocket(postUrl);
+        socket.onopen = () => {
+            isPolling = false;
+        };
+        socket.onclose = socket.onerror = () => {
+            isPolling = true;
+        };
+        socket.onmessage = (e) => {
+            const data = JSON.parse(e.data);
+            if (data['action'] === 'time left') {
+                setTimeLeft(data['time_left']);
+            } else if (data['action'] === 'stop') {
+                stopTest();
+            }
+        };
     }
-    if (timeLeft % 5 === 0) {
-    	$.post(postUrl, {
-    		csrfmiddlewaretoken: token
-		}).done(function(response) {
-			timeLeft = response['time_left'];
-			if (timeLeft < 0) {
-			   document.getElementById("stop-button").click();
-			}
-		});
+
+    function tick() {
+        const secondsLeft = Math.round((deadline - Date.now()) / 1000);
+        if (secondsLeft < 0) {
+            stopTest();
+            return;
+        }
+        if (isPolling && ticks % 5 === 0) {
+            $.post(postUrl, {
+                csrfmiddlewaretoken: token
+            }).done(function (response) {
+                setTimeLeft(response['time_left']);
+            });
+        }
+        document.getElementById("time").value = secondsLeft;
+        document.getElementById("time-div").innerHTML = `Времени осталось: ${secondsLeft} с`;
+        ticks++;
+        setTimeout(tick, 1000);
     }
-    document.getElementById("time").value = timeLeft;
-    document.getElementById("time-div").innerHTML = `Времени осталось: ${timeLeft} с`;
-    timeLeft--;
-    setTimeout(runTest, 1000, timeLeft, postUrl, token);
+
+    tick();
 }
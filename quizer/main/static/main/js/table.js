@@ -114,6 +114,20 @@ function hideTable(searchInputID, tableID) {
     table.style.display = (table.style.display === "") ? "none" : "";
 }
 
+function getImageUrl(mediaUrl, path, rendition) {
+    // renditions of images from media store are stored next to originals (see main.mongo.MediaStorage)
+    if (!path.startsWith('blobs/')) {
+        return mediaUrl + path;
+    }
+    const directoryEnd = path.lastIndexOf('/') + 1;
+    const name = path.slice(directoryEnd);
+    const extensionStart = name.indexOf('.');
+    if (extensionStart === -1) {
+        return `${mediaUrl}${path}.${rendition}`;
+    }
+    return `${mediaUrl}${path.slice(0, directoryEnd)}${name.slice(0, extensionStart)}.${rendition}${name.slice(extensionStart)}`;
+}
+
 function fillErrorsModal(rowID, testResults, questionsMap, mediaUrl) {
     const resultID = parseInt(rowID.split("_")[1]);
     const questions = testResults.results[resultID]['questions'];
@@ -145,7 +159,11 @@ function fillErrorsModal(rowID, testResults, questionsMap, mediaUrl) {
                 imgOption.setAttribute('alt', 'Server pribolel');
                 imgOption.setAttribute('height', '341');
                 imgOption.setAttribute('style', "width: auto;");
-                imgOption.setAttribute('src', mediaUrl + option.option);
+                imgOption.setAttribute('src', getImageUrl(mediaUrl, option.option, 'thumbnail'));
+                imgOption.onerror = function () {
+                    imgOption.onerror = null;
+                    imgOption.setAttribute('src', mediaUrl + option.option);
+                };
                 optionLi.appendChild(imgOption);
             }
             if (option.is_true) {
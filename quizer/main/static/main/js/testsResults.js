@@ -18,7 +18,7 @@ function getTrElement(counter, result, testsResultUrl) {
     dateTd.innerHTML = result.date;
 
     const studentsCountTd = document.createElement('td');
-    studentsCountTd.innerHTML = result.results.length;
+    studentsCountTd.innerHTML = result.results_count;
 
     const refTd = document.createElement('td');
     const ref = document.createElement('a');
@@ -41,69 +41,66 @@ function main(resultsUrl, testsUrl, testsResultUrl) {
     const subjectSelect = document.getElementById("subject");
     const lecturerSelect = document.getElementById("lecturer");
     const testSelect = document.getElementById("test");
+    const moreButton = document.getElementById("more");
 
-    let results = [];
     let tests = [];
     let counter = 1;
+    let nextCursor = '';
 
-    $.get(resultsUrl)
-        .done(function(response) {
-            results = response['results'];
-            $.get(testsUrl)
-                .done(function(response) {
-                    tests = response['tests'];
-                    for (const test of tests) {
-                        if (test.subject.id == subjectSelect.options[subjectSelect.selectedIndex].value) {
-                            testSelect.appendChild(getTestOption(test));
-                        }
-                    }
-                    for (const result of results) {
-                        if (result.subject_id == subjectSelect.options[subjectSelect.selectedIndex].value) {
-                            if (result.launched_lecturer_id == lecturerSelect.options[lecturerSelect.selectedIndex].value) {
-                                if (result.test_id == testSelect.options[testSelect.selectedIndex].value) {
-                                    tableBody.appendChild(getTrElement(counter, result, testsResultUrl));
-                                    counter += 1;
-                                }
-                            }
-                        }
-                    }
-                });
-        });
+    function loadResults() {
+        if (testSelect.selectedIndex === -1) {
+            moreButton.hidden = true;
+            return;
+        }
+        const params = {
+            subject_id: subjectSelect.options[subjectSelect.selectedIndex].value,
+            lecturer_id: lecturerSelect.options[lecturerSelect.selectedIndex].value,
+            test_id: testSelect.options[testSelect.selectedIndex].value
+        };
+        if (nextCursor) {
+            params.cursor = nextCursor;
+        }
+        $.get(resultsUrl, params)
+            .done(function(response) {
+                for (const result of response['results']) {
+                    tableBody.appendChild(getTrElement(counter, result, testsResultUrl));
+                    counter += 1;
+                }
+                nextCursor = response['next_cursor'];
+                moreButton.hidden = !nextCursor;
+            });
+    }
 
-    subjectSelect.onkeyup = subjectSelect.onchange = () =>  {
+    function reloadResults() {
         tableBody.innerHTML = '';
-        testSelect.innerHTML = '';
         counter = 1;
+        nextCursor = '';
+        loadResults();
+    }
+
+    function fillTestSelect() {
+        testSelect.innerHTML = '';
         for (const test of tests) {
             if (test.subject.id == subjectSelect.options[subjectSelect.selectedIndex].value) {
                 testSelect.appendChild(getTestOption(test));
             }
         }
-        for (const result of results) {
-            if (result.subject_id == subjectSelect.options[subjectSelect.selectedIndex].value) {
-                if (result.launched_lecturer_id == lecturerSelect.options[lecturerSelect.selectedIndex].value) {
-                    if (result.test_id == testSelect.options[testSelect.selectedIndex].value) {
-                        tableBody.appendChild(getTrElement(counter, result, testsResultUrl));
-                        counter += 1;
-                    }
-                }
-            }
-        }
+    }
+
+    $.get(testsUrl)
+        .done(function(response) {
+            tests = response['tests'];
+            fillTestSelect();
+            reloadResults();
+        });
+
+    subjectSelect.onkeyup = subjectSelect.onchange = () =>  {
+        fillTestSelect();
+        reloadResults();
     };
 
     lecturerSelect.onkeyup = lecturerSelect.onchange
-        = testSelect.onkeyup = testSelect.onchange = () =>  {
-        tableBody.innerHTML = '';
-        counter = 1;
-        for (const result of results) {
-            if (result.subject_id == subjectSelect.options[subjectSelect.selectedIndex].value) {
-                if (result.launched_lecturer_id == lecturerSelect.options[lecturerSelect.selectedIndex].value) {
-                    if (result.test_id == testSelect.options[testSelect.selectedIndex].value) {
-                        tableBody.appendChild(getTrElement(counter, result, testsResultUrl));
-                        counter += 1;
-                    }
-                }
-            }
-        }
-    };
+        = testSelect.onkeyup = testSelect.onchange = reloadResults;
+
+    moreButton.onclick = loadResults;
 }
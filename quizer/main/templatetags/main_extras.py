@@ -3,6 +3,8 @@
 from django import template
 from django.conf import settings
 
+from main.media import get_image_url
+
 register = template.Library()
 
 
@@ -21,6 +23,12 @@ def media_url():
     return settings.MEDIA_URL
 
 
+@register.simple_tag
+def image_url(path, rendition='display'):
+    """Return source of question image rendition, original if rendition does not exist"""
+    return get_image_url(path, rendition)
+
+
 @register.simple_tag
 def static_url():
     """Return static path"""
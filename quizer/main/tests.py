@@ -2,14 +2,38 @@
 """
 Main app tests, covered views.py, models.py and mongo.py
 """
+import io
 import os
-from unittest import mock, skip
-from django.test import TestCase, Client
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
+from unittest import mock, skip, skipIf
+import jwt
+from asgiref.sync import async_to_sync
+from bson import ObjectId
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory
 from django.urls import reverse
 from django.contrib.auth.models import User, Group
 from django.conf import settings
+from .consumers import AttemptTimerConsumer
 from .models import Subject, Test, QuestionType
+from . import auth
+from . import decorators
+from . import media
 from . import mongo
+from . import mongo_async
+from . import reaper
+from . import jobs
+from . import journal
+from . import publisher
+from . import utils
 
 QUESTIONS_FILE_DATA = """Как создать вопрос?
 + добавив верные ответы
@@ -124,6 +148,18 @@ class MainTest(TestCase):
             test_id=self.test.id
         )
 
+    def clear_results(self) -> None:
+        """
+        Stop launch of test and remove launches, attempts and results left in MongoDB,
+        collections not managed by Django are not cleared between tests
+        """
+        self.tests_results_storage.stop_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        db = mongo.get_conn()
+        for collection_name in ['tests_results', 'tests_submissions', 'running_tests_answers', 'questions_stats']:
+            db[collection_name].delete_many({})
+
 
 class QuestionsStorageTest(MainTest):
     """
@@ -159,6 +195,72 @@ class QuestionsStorageTest(MainTest):
         updated_questions = self.questions_storage.get_many(test_id=self.test.id)
         self.assertEqual(updated_questions, questions + [question])
 
+    def test_sampling_questions(self) -> None:
+        """
+        Test for 'sample' QuestionsStorage method, in-process and MongoDB '$sample' paths
+        """
+        questions_ids = {q['_id'] for q in self.questions_storage.get_many(test_id=self.test.id)}
+        for threshold in [len(questions_ids), 0]:
+            with self.settings(QUESTIONS_SAMPLE_THRESHOLD=threshold):
+                sample = self.questions_storage.sample(test_id=self.test.id, k=1)
+                self.assertEqual(len(sample), 1)
+                self.assertIn(sample[0]['_id'], questions_ids)
+                sample = self.questions_storage.sample(test_id=self.test.id, k=len(questions_ids))
+                self.assertEqual({q['_id'] for q in sample}, questions_ids)
+
+    def test_adding_many_questions(self) -> None:
+        """
+        Test for 'add_many' QuestionsStorage method, including per-question errors
+        """
+        questions = self.questions_storage.get_many(test_id=self.test.id)
+        new_questions = [{
+            'formulation': 'Loaded question %d' % i,
+            'tasks_num': 1,
+            'multiselect': False,
+            'type': QuestionType.REGULAR,
+            'options': [{'option': 'True option', 'is_true': True}]
+        } for i in range(5)]
+        new_questions[3]['_id'] = questions[0]['_id']
+
+        result = self.questions_storage.add_many(
+            questions=new_questions,
+            test_id=self.test.id,
+            batch_size=2)
+        self.assertEqual(result['inserted_count'], 4)
+        self.assertEqual([error['index'] for error in result['errors']], [3])
+        self.assertEqual(len(self.questions_storage.get_many(test_id=self.test.id)), len(questions) + 4)
+
+    def test_questions_cache(self) -> None:
+        """
+        Test that cached questions bank is returned as copy
+        and is invalidated by QuestionsStorage modifications
+        """
+        questions = self.questions_storage.get_many(test_id=self.test.id)
+        questions[0]['options'].reverse()
+        self.assertNotEqual(self.questions_storage.get_many(test_id=self.test.id), questions)
+
+        question_id = str(questions[0]['_id'])
+        self.questions_storage.update_formulation(
+            question_id=question_id,
+            formulation='Updated formulation')
+        question = self.questions_storage.get_one(
+            question_id=question_id,
+            test_id=self.test.id)
+        self.assertEqual(question['formulation'], 'Updated formulation')
+
+        self.questions_storage.delete_by_id(
+            question_id=question_id,
+            test_id=self.test.id)
+        self.assertEqual(len(self.questions_storage.get_many(test_id=self.test.id)), len(questions) - 1)
+
+    def test_counting_questions(self) -> None:
+        """
+        Test for 'count_by_tests' QuestionsStorage method
+        """
+        questions = self.questions_storage.get_many(test_id=self.test.id)
+        counts = self.questions_storage.count_by_tests(test_ids=[self.test.id, -1])
+        self.assertEqual(counts, {self.test.id: len(questions)})
+
     def test_deleting_questions(self) -> None:
         """
         Test for 'delete_by_formulation' and 'get_many' QuestionsStorage methods
@@ -185,6 +287,968 @@ class QuestionsStorageTest(MainTest):
         self.assertEqual(0, len(updated_questions))
 
 
+class MediaStorageTest(MainTest):
+    """
+    Tests for content-addressed store of questions images
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        mongo.get_conn()['jobs'].delete_many({})
+
+    def test_deduplicating_images(self) -> None:
+        """
+        Test that identical images are stored once and deleted with the last reference
+        """
+        media_storage = mongo.MediaStorage.connect(db=mongo.get_conn())
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            path = media_storage.save(content=b'image', extension='PNG')
+            self.assertEqual(media_storage.save(content=b'image', extension='png'), path)
+            self.assertNotEqual(media_storage.save(content=b'other image', extension='png'), path)
+            self.assertTrue(path.endswith('.png'))
+            self.assertEqual(media_storage.get_refs(path), 2)
+
+            media_storage.release([path])
+            self.assertTrue(os.path.exists(os.path.join(media_root, path)))
+            question = {
+                '_id': 'question_id',
+                'type': QuestionType.WITH_IMAGES,
+                'options': [{'option': path, 'is_true': True}]
+            }
+            job_id = self.questions_storage.remove_media(test_id=self.test.id, questions=[question])
+            self.assertEqual(self.questions_storage.media_jobs, [job_id])
+            self.assertEqual(media_storage.get_refs(path), 0)
+            self.assertTrue(os.path.exists(os.path.join(media_root, path)))
+
+            self.assertEqual(jobs.run_pending(), 1)
+            self.assertFalse(os.path.exists(os.path.join(media_root, path)))
+            job = mongo.JobsStorage.connect(db=mongo.get_conn()).get(job_id=job_id)
+            self.assertEqual(job['status'], mongo.JOB_DONE)
+
+    @skipIf(media.Image is None, 'Pillow is not installed')
+    def test_renditions(self) -> None:
+        """
+        Test that renditions are size-capped, cached and deleted with original image
+        """
+        content = io.BytesIO()
+        media.Image.new('RGB', (2000, 1000)).save(content, format='PNG')
+        media_storage = mongo.MediaStorage.connect(db=mongo.get_conn())
+        with tempfile.TemporaryDirectory() as media_root, self.settings(
+                MEDIA_ROOT=media_root, MEDIA_RENDITIONS={'display': 1000, 'thumbnail': 4000}):
+            path = media_storage.save(content=content.getvalue(), extension='png')
+            media.render_all([path])
+            display_path = mongo.MediaStorage.get_rendition_path(path, 'display')
+            with media.Image.open(os.path.join(media_root, display_path)) as image:
+                self.assertEqual(image.size, (1000, 500))
+            thumbnail_path = mongo.MediaStorage.get_rendition_path(path, 'thumbnail')
+            self.assertTrue(os.path.samefile(os.path.join(media_root, thumbnail_path), os.path.join(media_root, path)))
+            self.assertEqual(media.get_image_url(path, 'display'), settings.MEDIA_URL + display_path)
+            self.assertEqual(media.get_image_url('1/image.png', 'display'), settings.MEDIA_URL + '1/image.png')
+
+            media_storage.collect(media_storage.release([path]))
+            self.assertFalse(os.path.exists(os.path.join(media_root, display_path)))
+            self.assertEqual(media.get_image_url(path, 'display'), settings.MEDIA_URL + path)
+
+
+class JobsTest(MainTest):
+    """
+    Tests for background jobs queue
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        mongo.get_conn()['jobs'].delete_many({})
+
+    def test_retrying_failed_job(self) -> None:
+        """
+        Test that failed job is retried with delay and marked as failed when attempts are exhausted
+        """
+        storage = mongo.JobsStorage.connect(db=mongo.get_conn())
+        with self.settings(JOBS_MAX_ATTEMPTS=2, JOBS_RETRY_DELAY=0), \
+                mock.patch.dict(jobs.HANDLERS, {'broken': mock.Mock(side_effect=OSError('disk is slow'))}):
+            job_id = storage.add(kind='broken', payload={})
+            self.assertEqual(jobs.run_pending(), 2)
+        job = storage.get(job_id=job_id)
+        self.assertEqual(job['status'], mongo.JOB_FAILED)
+        self.assertEqual(job['attempts'], 2)
+        self.assertEqual(job['error'], 'OSError: disk is slow')
+        self.assertIsNone(storage.get(job_id='not an id'))
+
+    def test_job_status(self) -> None:
+        """
+        Test job status API
+        """
+        job_id = mongo.JobsStorage.connect(db=mongo.get_conn()).add(kind=mongo.JOB_REMOVE_MEDIA, payload={
+            'blobs': [],
+            'directories': []
+        })
+        client = Client()
+        client.login(
+            username=self.lecturer.username,
+            password=''
+        )
+        response = client.get(reverse('api:get_job', kwargs={'job_id': job_id}))
+        self.assertEqual(response.json()['status'], mongo.JOB_QUEUED)
+        jobs.run_pending()
+        response = client.get(reverse('api:get_job', kwargs={'job_id': job_id}))
+        self.assertEqual(response.json()['status'], mongo.JOB_DONE)
+
+
+class ConnectionManagerTest(MainTest):
+    """
+    Tests for ConnectionManager which keeps one pooled MongoClient per process
+    """
+
+    def test_client_reused(self) -> None:
+        """
+        Test that 'set_conn' reuses process-wide client instead of reconnecting
+        """
+        client = mongo.get_conn().client
+        mongo.set_conn(
+            host=settings.DATABASES['default']['HOST'],
+            port=settings.DATABASES['default']['PORT'],
+            db_name=settings.DATABASES['default']['TEST']['NAME'])
+        self.assertIs(mongo.get_conn().client, client)
+
+    def test_pool_stats(self) -> None:
+        """
+        Test for 'get_pool_stats' function
+        """
+        address = '%s:%s' % (settings.DATABASES['default']['HOST'], settings.DATABASES['default']['PORT'])
+        stats = mongo.get_pool_stats()
+        self.assertIn(address, stats)
+        self.assertIn('connections_in_use', stats[address])
+
+
+class IndexesTest(MainTest):
+    """
+    Tests for declared indexes registry
+    """
+
+    def test_ensure_indexes(self) -> None:
+        """
+        Test that after 'ensure_indexes' every query shape is served by index
+        and that repeated call is idempotent
+        """
+        db = mongo.get_conn()
+        mongo.ensure_indexes(db)
+        mongo.ensure_indexes(db)
+        self.assertEqual(mongo.get_unindexed_query_shapes(db), {})
+
+        db['questions'].drop_index('test_id_formulation')
+        self.addCleanup(mongo.ensure_indexes, db)
+        self.assertIn('questions', mongo.get_unindexed_query_shapes(db))
+
+
+class TestsSubmissionsTest(MainTest):
+    """
+    Tests for storing students results in 'tests_submissions' collection
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+
+    def tearDown(self) -> None:
+        self.clear_results()
+        super().tearDown()
+
+    def get_result(self) -> dict:
+        """
+        Get testing result of 'student'
+        """
+        return {
+            'user_id': self.student.id,
+            'username': self.student.username,
+            'time': 10,
+            'tasks_num': 2,
+            'right_answers_count': 1,
+            'questions': []
+        }
+
+    def test_adding_results(self) -> None:
+        """
+        Test that results are stored outside of launch document and
+        are returned by TestsResultsStorage methods in the same shape
+        """
+        for _ in range(2):
+            self.tests_results_storage.add_results_to_running_test(
+                test_result=self.get_result(),
+                test_id=self.test.id)
+        test_results = self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(len(test_results['results']), 2)
+        self.assertEqual(test_results['results_count'], 2)
+        self.assertEqual(test_results['results'][0]['username'], self.student.username)
+        self.assertNotIn('launch_id', test_results['results'][0])
+
+        launch = mongo.get_conn()['tests_results'].find_one({'_id': test_results['_id']})
+        self.assertNotIn('results', launch)
+
+        self.tests_results_storage.stop_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        latest_test_results = self.tests_results_storage.get_latest_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(len(latest_test_results), 2)
+
+    def test_getting_latest_results(self) -> None:
+        """
+        Test that 'get_latest_test_results' returns results of the most recent launch
+        """
+        self.tests_results_storage.add_results_to_running_test(
+            test_result=self.get_result(),
+            test_id=self.test.id)
+        self.tests_results_storage.stop_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        mongo.get_conn()['tests_results'].update_many(
+            {'test_id': self.test.id},
+            {'$set': {'date': datetime.now() - timedelta(minutes=1)}})
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        latest_test_results = self.tests_results_storage.get_latest_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(latest_test_results, [])
+
+    def test_results_pages(self) -> None:
+        """
+        Test for 'get_tests_results_page' TestsResultsStorage method and results API pagination
+        """
+        for _ in range(3):
+            self.tests_results_storage.stop_running_test(
+                test_id=self.test.id,
+                lecturer_id=self.lecturer.id)
+            self.tests_results_storage.add_running_test(
+                test_id=self.test.id,
+                lecturer_id=self.lecturer.id,
+                subject_id=self.subject.id)
+        filters = {'test_id': self.test.id, 'launched_lecturer_id': self.lecturer.id}
+        launches_count = mongo.get_conn()['tests_results'].count_documents({**filters, 'is_running': False})
+
+        ids = []
+        cursor = ''
+        while True:
+            page = self.tests_results_storage.get_tests_results_page(
+                filters=filters,
+                cursor=cursor,
+                page_size=2)
+            ids += [result['id'] for result in page['results']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(len(ids), launches_count)
+        self.assertEqual(len(set(ids)), launches_count)
+        with self.assertRaises(ValueError):
+            self.tests_results_storage.get_tests_results_page(filters=filters, cursor='invalid')
+
+        client = Client()
+        client.login(
+            username=self.lecturer.username,
+            password=''
+        )
+        response = client.get(reverse('api:get_tests_results', args=['all']), {
+            'test_id': self.test.id,
+            'page_size': 1
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertTrue(response.json()['next_cursor'])
+
+    def test_items_analysis(self) -> None:
+        """
+        Test questions difficulty statistics over results of launch
+        """
+        for selected_answers in [['Right'], ['Wrong'], ['Wrong'], ['Other wrong']]:
+            result = self.get_result()
+            result['questions'] = [{
+                'id': 'question_id',
+                'selected_answers': selected_answers,
+                'right_answers': ['Right'],
+                'is_true': selected_answers == ['Right']
+            }]
+            self.tests_results_storage.add_results_to_running_test(
+                test_result=result,
+                test_id=self.test.id)
+        launch_id = str(self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)['_id'])
+        analysis = self.tests_results_storage.get_items_analysis(launch_id=launch_id)
+        self.assertEqual(analysis['submissions_count'], 4)
+        self.assertEqual(analysis['average_time'], 10)
+        self.assertEqual(analysis['questions'], [{
+            'id': 'question_id',
+            'answers_count': 4,
+            'unanswered_count': 0,
+            'right_answers_count': 1,
+            'right_answers_share': 0.25,
+            'most_picked_wrong_answer': 'Wrong',
+            'most_picked_wrong_answer_count': 2
+        }])
+        self.assertEqual(
+            self.tests_results_storage.get_items_analysis(test_id=self.test.id)['questions'],
+            analysis['questions'])
+        self.assertEqual(self.tests_results_storage.get_items_analysis(launch_id='invalid'), {})
+
+        client = Client()
+        client.login(
+            username=self.lecturer.username,
+            password=''
+        )
+        response = client.get(reverse('api:get_items_analysis'), {'launch_id': launch_id})
+        self.assertEqual(response.json()['submissions_count'], 4)
+        response = client.get(reverse('api:get_items_analysis'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('error', response.json())
+
+    def test_questions_stats(self) -> None:
+        """
+        Test that questions statistics counters are incremented on adding
+        results and are the same after rebuilding them from results
+        """
+        stats_storage = mongo.QuestionsStatsStorage.connect(db=mongo.get_conn())
+        question_id = str(ObjectId())
+        for selected_answers, time in [(['Right'], 10), (['Wrong.'], 40), ([], 45)]:
+            result = self.get_result()
+            result['time'] = time
+            result['questions'] = [{
+                'id': question_id,
+                'selected_answers': selected_answers,
+                'right_answers': ['Right'],
+                'is_true': selected_answers == ['Right']
+            }]
+            self.tests_results_storage.add_results_to_running_test(
+                test_result=result,
+                test_id=self.test.id)
+        stats = stats_storage.get_many(question_ids=[question_id])[question_id]
+        self.assertEqual(stats['attempts'], 3)
+        self.assertEqual(stats['right_answers_count'], 1)
+        self.assertEqual(stats['unanswered_count'], 1)
+        self.assertEqual(sorted(option['option'] for option in stats['options'].values()), ['Right', 'Wrong.'])
+        self.assertEqual(stats['time_buckets'], {'0': 1, '30': 2})
+
+        self.assertEqual(stats_storage.rebuild(), mongo.get_conn()['tests_submissions'].count_documents({}))
+        self.assertEqual(stats_storage.get_many(question_ids=[question_id])[question_id], stats)
+
+    def test_rebuilding_questions_stats_with_new_results(self) -> None:
+        """
+        Test that results added while questions statistics are rebuilt are not lost
+        """
+        stats_storage = mongo.QuestionsStatsStorage.connect(db=mongo.get_conn())
+        question_id = str(ObjectId())
+
+        def add_result():
+            result = self.get_result()
+            result['questions'] = [{
+                'id': question_id,
+                'selected_answers': ['Right'],
+                'right_answers': ['Right'],
+                'is_true': True
+            }]
+            self.tests_results_storage.add_results_to_running_test(
+                test_result=result,
+                test_id=self.test.id)
+
+        add_result()
+        get_updates = mongo.QuestionsStatsStorage.get_updates
+        added = []
+
+        def get_updates_adding_result(tests_results):
+            if not added:  # result is added after rebuild started counting
+                added.append(True)
+                add_result()
+            return get_updates(tests_results)
+
+        with mock.patch.object(mongo.QuestionsStatsStorage, 'get_updates', side_effect=get_updates_adding_result):
+            self.assertEqual(stats_storage.rebuild(), mongo.get_conn()['tests_submissions'].count_documents({}))
+        self.assertEqual(stats_storage.get_many(question_ids=[question_id])[question_id]['attempts'], 2)
+
+    def test_splitting_embedded_results(self) -> None:
+        """
+        Test for 'split_embedded_results' TestsResultsStorage method
+        """
+        launch_id = mongo.get_conn()['tests_results'].insert_one({
+            'test_id': self.test.id,
+            'subject_id': self.subject.id,
+            'launched_lecturer_id': self.lecturer.id,
+            'is_running': False,
+            'results': [{**self.get_result(), 'date': datetime.now()}],
+            'date': datetime.now()
+        }).inserted_id
+        self.tests_results_storage.split_embedded_results()
+        self.tests_results_storage.split_embedded_results()
+        test_result = self.tests_results_storage.get_test_result(_id=str(launch_id))
+        self.assertEqual(len(test_result['results']), 1)
+
+
+class TestsSnapshotsTest(MainTest):
+    """
+    Tests for snapshots of questions banks frozen on tests launches
+    """
+
+    def test_frozen_snapshot(self) -> None:
+        """
+        Test that students of launched test get questions from snapshot
+        not affected by bank edits, and snapshot is deleted when test is stopped
+        """
+        questions = self.questions_storage.get_many(test_id=self.test.id)
+        client = Client()
+        client.login(
+            username=self.lecturer.username,
+            password=''
+        )
+        with self.settings(TEST_VARIANTS_POOL_SIZE=0, JOBS_WORKERS=0):
+            response = client.get(reverse('api:launch_test', args=[self.test.id]))
+        self.assertTrue(response.json()['ok'])
+        launch_id = self.tests_results_storage.get_running_launch_id(test_id=self.test.id)
+        self.assertIsNotNone(launch_id)
+        self.questions_storage.delete_many(test_id=self.test.id)
+
+        client.logout()
+        client.login(
+            username=self.student.username,
+            password=''
+        )
+        response = client.post(reverse('main:student_run_test'), {
+            'test_id': self.test.id
+        })
+        self.assertEqual(response.status_code, 200)
+        right_answers = self.running_tests_answers_storage.get(user_id=self.student.id)['right_answers']
+        self.assertEqual(
+            sorted((answer['id'], len(answer['right_answers'])) for answer in right_answers.values()),
+            sorted((str(question['_id']), len(utils.get_answer_key(question))) for question in questions))
+
+        snapshots_storage = mongo.TestsSnapshotsStorage.connect(db=mongo.get_conn())
+        self.tests_results_storage.stop_running_test(test_id=self.test.id, lecturer_id=self.lecturer.id)
+        self.assertEqual(snapshots_storage.sample(launch_id=launch_id, k=self.test.tasks_num), [])
+
+    def test_variants_pool(self) -> None:
+        """
+        Test that students of launched test get pregenerated variants while pool is not empty
+        """
+        mongo.get_conn()['jobs'].delete_many({})
+        variants_col = mongo.get_conn()['tests_variants']
+        client = Client()
+        client.login(
+            username=self.lecturer.username,
+            password=''
+        )
+        with self.settings(TEST_VARIANTS_POOL_SIZE=3, TEST_VARIANTS_BATCH_SIZE=2, JOBS_WORKERS=0):
+            client.get(reverse('api:launch_test', args=[self.test.id]))
+        launch_id = self.tests_results_storage.get_running_launch_id(test_id=self.test.id)
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(variants_col.count_documents({'launch_id': launch_id}), 3)
+
+        client.logout()
+        client.login(
+            username=self.student.username,
+            password=''
+        )
+        response = client.post(reverse('main:student_run_test'), {
+            'test_id': self.test.id
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.student.username)
+        self.assertNotContains(response, utils.VARIANT_CSRF_TOKEN)
+        self.assertNotContains(response, utils.VARIANT_USERNAME)
+        self.assertEqual(variants_col.count_documents({'launch_id': launch_id}), 2)
+        right_answers = self.running_tests_answers_storage.get(user_id=self.student.id)['right_answers']
+        self.assertEqual(len(right_answers), self.test.tasks_num)
+
+        self.tests_results_storage.stop_running_test(test_id=self.test.id, lecturer_id=self.lecturer.id)
+        self.assertEqual(variants_col.count_documents({'launch_id': launch_id}), 0)
+
+    def test_making_variant(self) -> None:
+        """
+        Test that variant is made from live questions bank and is not made of too few questions
+        """
+        questions = self.questions_storage.get_many(test_id=self.test.id)
+        self.assertIsNone(utils.make_variant(test=self.test, test_questions=questions[:1]))
+        self.assertIsNone(utils.make_variant(test=self.test, snapshot=[]))
+        variant = utils.make_variant(test=self.test, snapshot=[], test_questions=questions)
+        self.assertEqual(
+            sorted(answer_key['id'] for answer_key in variant['right_answers'].values()),
+            sorted(str(question['_id']) for question in questions))
+        self.assertIn(utils.VARIANT_CSRF_TOKEN, variant['page'])
+
+
+class AttemptsReaperTest(MainTest):
+    """
+    Tests for grading expired and abandoned attempts by attempts reaper
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        self.right_answers = {
+            '1': {
+                'right_answers': [{'option': 'True option', 'is_true': True}],
+                'id': 'question_id'
+            }
+        }
+
+    def tearDown(self) -> None:
+        self.clear_results()
+        super().tearDown()
+
+    def get_results_count(self) -> int:
+        """
+        Get number of results of running test
+        """
+        return len(self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)['results'])
+
+    def test_reaping_expired_attempt(self) -> None:
+        """
+        Test that attempt is graded by reaper only after its deadline
+        """
+        self.running_tests_answers_storage.cleanup(user_id=self.student.id)
+        self.running_tests_answers_storage.add(
+            right_answers=self.right_answers,
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+        results_count = self.get_results_count()
+        self.assertEqual(reaper.reap_expired_attempts(), 0)
+
+        with self.settings(ATTEMPT_GRACE_SECONDS=-self.test.duration - 1):
+            self.running_tests_answers_storage.add(
+                right_answers=self.right_answers,
+                test_id=self.test.id,
+                user_id=self.student.id,
+                test_duration=self.test.duration)
+        self.assertEqual(reaper.reap_expired_attempts(), 1)
+        self.assertEqual(self.get_results_count(), results_count + 1)
+        self.assertIsNotNone(self.running_tests_answers_storage.get(user_id=self.student.id))
+
+    def test_reaping_abandoned_attempt(self) -> None:
+        """
+        Test that attempt abandoned by starting new one is graded by reaper
+        """
+        self.running_tests_answers_storage.cleanup(user_id=self.student.id)
+        self.running_tests_answers_storage.add(
+            right_answers=self.right_answers,
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+        results_count = self.get_results_count()
+        self.running_tests_answers_storage.abandon(user_id=self.student.id)
+        self.assertIsNone(self.running_tests_answers_storage.get(user_id=self.student.id))
+
+        self.assertEqual(reaper.reap_expired_attempts(), 1)
+        test_results = self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(len(test_results['results']), results_count + 1)
+        self.assertEqual(test_results['results'][-1]['username'], self.student.username)
+        self.assertEqual(test_results['results'][-1]['right_answers_count'], 0)
+
+
+class AttemptTokenTest(MainTest):
+    """
+    Tests for signed tokens of attempts
+    """
+
+    def test_attempt_token(self) -> None:
+        """
+        Test that time left is read from token and tampered or foreign token is rejected
+        """
+        response = utils.set_attempt_token(
+            response=HttpResponse(),
+            attempt_id=ObjectId(),
+            user_id=self.student.id,
+            test_id=self.test.id,
+            test_duration=self.test.duration)
+        cookies = {utils.ATTEMPT_TOKEN_COOKIE: response.cookies[utils.ATTEMPT_TOKEN_COOKIE].value}
+        token = utils.get_attempt_token(cookies=cookies, user_id=self.student.id)
+        self.assertEqual(token['test_id'], self.test.id)
+        self.assertAlmostEqual(utils.get_token_left_time(token), self.test.duration, delta=5)
+        self.assertFalse(utils.is_token_expired(token))
+
+        self.assertIsNone(utils.get_attempt_token(cookies=cookies, user_id=self.lecturer.id))
+        self.assertIsNone(utils.get_attempt_token(cookies={}, user_id=self.student.id))
+        cookies[utils.ATTEMPT_TOKEN_COOKIE] = cookies[utils.ATTEMPT_TOKEN_COOKIE][:-1] + 'x'
+        self.assertIsNone(utils.get_attempt_token(cookies=cookies, user_id=self.student.id))
+
+        with self.settings(ATTEMPT_GRACE_SECONDS=-self.test.duration - 1):
+            self.assertTrue(utils.is_token_expired(token))
+
+    def test_time_left_without_database(self) -> None:
+        """
+        Test that time left of attempt with token is returned without reading attempts
+        """
+        self.running_tests_answers_storage.cleanup(user_id=self.student.id)
+        attempt_id = self.running_tests_answers_storage.add(
+            right_answers={},
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+        response = utils.set_attempt_token(
+            response=HttpResponse(),
+            attempt_id=attempt_id,
+            user_id=self.student.id,
+            test_id=self.test.id,
+            test_duration=self.test.duration)
+        client = Client()
+        client.login(
+            username=self.student.username,
+            password=''
+        )
+        client.cookies[utils.ATTEMPT_TOKEN_COOKIE] = response.cookies[utils.ATTEMPT_TOKEN_COOKIE].value
+        with mock.patch.object(mongo.RunningTestsAnswersStorage, 'get_left_time') as get_left_time:
+            response = client.post(reverse('main:get_left_time'))
+        get_left_time.assert_not_called()
+        self.assertAlmostEqual(response.json()['time_left'], self.test.duration, delta=5)
+
+    def test_late_submission(self) -> None:
+        """
+        Test that answers sent after attempt deadline are graded and marked as late
+        """
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        test_questions = self.questions_storage.get_many(test_id=self.test.id)
+        right_answers = utils.get_right_answers(test_questions)
+        attempt_id = self.running_tests_answers_storage.start(
+            right_answers=right_answers,
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+        late = timedelta(seconds=self.test.duration + settings.ATTEMPT_GRACE_SECONDS + 10)
+        attempt = mongo.get_conn()['running_tests_answers'].find_one({'_id': attempt_id})
+        mongo.get_conn()['running_tests_answers'].update_one({'_id': attempt_id}, {'$set': {
+            'start_date': attempt['start_date'] - late,
+            'deadline': attempt['deadline'] - late
+        }})
+        response = utils.set_attempt_token(
+            response=HttpResponse(),
+            attempt_id=attempt_id,
+            user_id=self.student.id,
+            test_id=self.test.id,
+            test_duration=-late.seconds)
+        client = Client()
+        client.login(
+            username=self.student.username,
+            password=''
+        )
+        client.cookies[utils.ATTEMPT_TOKEN_COOKIE] = response.cookies[utils.ATTEMPT_TOKEN_COOKIE].value
+        answers = {}
+        for question_num, answer_key in right_answers.items():
+            if answer_key['is_sequence'] or len(answer_key['right_options']) == 1:
+                answers[question_num] = answer_key['right_options']
+            else:
+                for option in answer_key['right_options']:
+                    answers[f'{question_num}_{option}'] = 'on'
+        response = client.post(reverse('main:test_result'), {
+            'test-passed': '',
+            'time': self.test.duration // 2,
+            **answers
+        })
+        self.assertContains(response, 'Время истекло')
+        self.assertIsNone(self.running_tests_answers_storage.get(user_id=self.student.id))
+        result = self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)['results'][-1]
+        self.assertTrue(result['is_late'])
+        self.assertEqual(result['time'], self.test.duration)
+        self.assertEqual(result['right_answers_count'], self.test.tasks_num)
+
+        response = client.post(reverse('main:test_result'), {'test-passed': ''})
+        self.assertContains(response, 'Ответы не приняты')
+
+    def tearDown(self) -> None:
+        self.clear_results()
+        super().tearDown()
+
+
+class GradingTest(MainTest):
+    """
+    Tests for grading answers with compiled answer keys
+    """
+
+    def test_grade_answers(self) -> None:
+        """
+        Test that selected options are compared as sets, and in order for sequences
+        """
+        test_questions = [{
+            '_id': ObjectId(),
+            'type': QuestionType.REGULAR,
+            'options': [
+                {'option': 'A', 'is_true': True},
+                {'option': 'B', 'is_true': False},
+                {'option': 'C', 'is_true': True}
+            ]
+        }, {
+            '_id': ObjectId(),
+            'type': QuestionType.SEQUENCE,
+            'options': [
+                {'option': 'Second', 'is_true': True, 'num': '2'},
+                {'option': 'First', 'is_true': True, 'num': '1'}
+            ]
+        }]
+        right_answers = utils.get_right_answers(test_questions)
+        self.assertEqual(right_answers['2']['right_options'], ['First', 'Second'])
+
+        request = RequestFactory().post('/', {'time': '10', '1_C': 'on', '1_A': 'on', '2': ['First', 'Second']})
+        request.user = self.student
+        result = utils.get_test_result(request=request, right_answers=right_answers, test_duration=60)
+        self.assertEqual(result['time'], 50)
+        self.assertEqual(result['right_answers_count'], 2)
+        self.assertEqual(result['questions'][0]['selected_answers'], ['C', 'A'])
+
+        result = utils.grade_answers(
+            answers={'1': ['A', 'B', 'C'], '2': ['Second', 'First']},
+            right_answers=right_answers,
+            test_duration=60,
+            time_left=0,
+            user_id=self.student.id,
+            username=self.student.username)
+        self.assertEqual(result['right_answers_count'], 0)
+        self.assertEqual([question['is_true'] for question in result['questions']], [False, False])
+
+        for answer_key in right_answers.values():  # attempt started before answer keys were compiled
+            del answer_key['right_options'], answer_key['is_sequence']
+        result = utils.grade_answers(
+            answers={'1': ['A', 'C']},
+            right_answers=right_answers,
+            test_duration=60,
+            time_left=0,
+            user_id=self.student.id,
+            username=self.student.username)
+        self.assertTrue(result['questions'][0]['is_true'])
+        self.assertNotIn('is_true', result['questions'][1])
+
+
+class SubmissionsJournalTest(MainTest):
+    """
+    Tests for write-behind journal of students results
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        self.journal_dir = tempfile.TemporaryDirectory()
+        self.journal = journal.SubmissionsJournal(os.path.join(self.journal_dir.name, 'submissions.journal'))
+
+    def tearDown(self) -> None:
+        self.journal_dir.cleanup()
+        self.clear_results()
+        super().tearDown()
+
+    def get_results(self) -> list:
+        """
+        Get results of running test
+        """
+        return self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)['results']
+
+    def test_flushing_in_submission_order(self) -> None:
+        """
+        Test that journaled results are added to running test only after flush and in submission order
+        """
+        for username in ['first', 'second', 'third']:
+            self.journal.append(test_id=self.test.id, test_result={'username': username})
+        self.assertEqual(len(self.get_results()), 0)
+        self.assertEqual(self.journal.flush(batch_size=2), 3)
+        self.assertEqual([result['username'] for result in self.get_results()], ['first', 'second', 'third'])
+        self.assertEqual(self.journal.flush(), 0)
+
+    def test_replaying_journal(self) -> None:
+        """
+        Test that journal replayed from the beginning after crash does not duplicate results
+        """
+        self.journal.append(test_id=self.test.id, test_result={'username': 'first'})
+        self.journal.append(test_id=self.test.id, test_result={'username': 'second'})
+        with mock.patch.object(journal.SubmissionsJournal, '_write_offset'), \
+                mock.patch.object(journal.SubmissionsJournal, '_truncate_if_flushed'):
+            self.journal.flush()
+        self.assertEqual(self.journal.flush(), 2)
+        self.assertEqual(len(self.get_results()), 2)
+        launch = self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(mongo.get_conn()['tests_results'].find_one({'_id': launch['_id']})['results_count'], 2)
+
+    def test_skipping_corrupted_line(self) -> None:
+        """
+        Test that line merged with interrupted append is moved aside and following lines are flushed
+        """
+        self.journal.append(test_id=self.test.id, test_result={'username': 'first'})
+        with open(self.journal._path, 'ab') as f:  # pylint: disable=protected-access
+            f.write(b'{"test_id": 1, "res')
+        self.journal.append(test_id=self.test.id, test_result={'username': 'second'})
+        self.assertEqual(self.journal.flush(), 1)
+        self.assertEqual([result['username'] for result in self.get_results()], ['first'])
+        self.journal.append(test_id=self.test.id, test_result={'username': 'third'})
+        self.assertEqual(self.journal.flush(), 1)
+        self.assertEqual([result['username'] for result in self.get_results()], ['first', 'third'])
+        with open(self.journal._path + '.rejected', 'rb') as f:  # pylint: disable=protected-access
+            self.assertTrue(f.read().startswith(b'{"test_id": 1, "res'))
+
+
+class AsyncStoragesTest(MainTest):
+    """
+    Tests for asyncio storages from main.mongo_async
+    """
+
+    def test_async_questions_storage(self) -> None:
+        """
+        Test that async storage shares questions bank and its versions with sync storage
+        """
+        storage = mongo_async.AsyncQuestionsStorage.connect(db=mongo_async.get_async_conn())
+        questions = async_to_sync(storage.sample)(test_id=self.test.id, k=self.test.tasks_num)
+        self.assertEqual(len(questions), self.test.tasks_num)
+        self.assertEqual(
+            async_to_sync(storage.get_version)(test_id=self.test.id),
+            self.questions_storage.get_version(test_id=self.test.id))
+
+    def test_async_attempt_and_submission(self) -> None:
+        """
+        Test starting attempt, getting left time and submitting result using async storages
+        """
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        answers_storage = mongo_async.AsyncRunningTestsAnswersStorage.connect(db=mongo_async.get_async_conn())
+        async_to_sync(answers_storage.abandon)(user_id=self.student.id)
+        async_to_sync(answers_storage.add)(
+            right_answers={},
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+        time_left = async_to_sync(answers_storage.get_left_time)(user_id=self.student.id)
+        self.assertTrue(0 < time_left <= self.test.duration)
+        self.assertIsNotNone(async_to_sync(answers_storage.pop)(user_id=self.student.id))
+        self.assertIsNone(async_to_sync(answers_storage.get_left_time)(user_id=self.student.id))
+
+        results_storage = mongo_async.AsyncTestsResultsStorage.connect(db=mongo_async.get_async_conn())
+        async_to_sync(results_storage.add_results_to_running_test)(
+            test_result={'user_id': self.student.id, 'username': self.student.username},
+            test_id=self.test.id)
+        test_results = self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(test_results['results'][-1]['username'], self.student.username)
+
+    def test_async_results_batch(self) -> None:
+        """
+        Test that async storage adds results batch with launch counters and questions statistics
+        """
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        question_id = str(ObjectId())
+        test_result = {
+            '_id': ObjectId(),
+            'user_id': self.student.id,
+            'username': self.student.username,
+            'time': 10,
+            'questions': [{'id': question_id, 'selected_answers': ['1'], 'is_true': True}]
+        }
+        results_storage = mongo_async.AsyncTestsResultsStorage.connect(db=mongo_async.get_async_conn())
+        tests_results = [(self.test.id, test_result), (self.test.id + 1, dict(test_result, _id=ObjectId()))]
+        self.assertEqual(async_to_sync(results_storage.add_results_to_running_tests)(tests_results=tests_results), 1)
+        self.assertEqual(async_to_sync(results_storage.add_results_to_running_tests)(tests_results=tests_results), 0)
+        launch = self.tests_results_storage.get_running_test_results(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(launch['results_count'], 1)
+        stats = mongo.QuestionsStatsStorage.connect(db=mongo.get_conn()).get_many([question_id])
+        self.assertEqual(stats[question_id]['attempts'], 1)
+        self.assertEqual(stats[question_id]['right_answers_count'], 1)
+
+    def tearDown(self) -> None:
+        self.clear_results()
+        super().tearDown()
+
+
+class RunningTestsPublisherTest(MainTest):
+    """
+    Tests for polling publisher of running tests updates
+    """
+
+    def test_publishing_actions(self) -> None:
+        """
+        Test that launches, attempts, submissions and stops are found by polling
+        """
+        running_tests_publisher = publisher.RunningTestsPublisher()
+        poll = async_to_sync(running_tests_publisher.poll)
+        self.running_tests_answers_storage.cleanup(user_id=self.student.id)
+        self.assertEqual(poll(db=mongo_async.get_async_conn()), [])
+
+        self.tests_results_storage.add_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id,
+            subject_id=self.subject.id)
+        self.assertEqual(poll(db=mongo_async.get_async_conn()), [publisher.TEST_WAS_LAUNCHED])
+
+        self.running_tests_answers_storage.add(
+            right_answers={},
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+        self.assertEqual(poll(db=mongo_async.get_async_conn()), [publisher.TEST_WAS_STARTED])
+
+        self.running_tests_answers_storage.pop(user_id=self.student.id)
+        self.tests_results_storage.add_results_to_running_test(
+            test_result={'user_id': self.student.id, 'username': self.student.username},
+            test_id=self.test.id)
+        self.assertEqual(poll(db=mongo_async.get_async_conn()), [publisher.TEST_WAS_PASSED])
+        self.assertEqual(poll(db=mongo_async.get_async_conn()), [])
+
+        self.assertEqual(running_tests_publisher.stopped_tests, set())
+
+        self.tests_results_storage.stop_running_test(
+            test_id=self.test.id,
+            lecturer_id=self.lecturer.id)
+        self.assertEqual(poll(db=mongo_async.get_async_conn()), [publisher.TEST_WAS_STOPPED])
+        self.assertEqual(running_tests_publisher.stopped_tests, {self.test.id})
+
+    def test_attempt_timer(self) -> None:
+        """
+        Test that attempt timer sends time left on connect and stop on test stop
+        """
+        self.running_tests_answers_storage.cleanup(user_id=self.student.id)
+        self.running_tests_answers_storage.add(
+            right_answers={},
+            test_id=self.test.id,
+            user_id=self.student.id,
+            test_duration=self.test.duration)
+
+        async def run_timer():
+            communicator = WebsocketCommunicator(AttemptTimerConsumer.as_asgi(), '/get_left_time/')
+            communicator.scope['user'] = self.student
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['action'], 'time left')
+            self.assertAlmostEqual(message['time_left'], self.test.duration, delta=5)
+            await get_channel_layer().group_send(publisher.ATTEMPTS_GROUP_NAME % self.test.id, {'type': 'stop'})
+            self.assertEqual(await communicator.receive_json_from(), {'action': 'stop'})
+            await communicator.disconnect()
+
+        async_to_sync(run_timer)()
+
+
 class AuthorizationTest(MainTest):
     """
     Tests for authorization system in the application
@@ -255,6 +1319,101 @@ class AuthorizationTest(MainTest):
         self.assertContains(response, 'Incorrect group.')
 
 
+class PublicKeysHandler(BaseHTTPRequestHandler):
+    """
+    Stub of authorization service public keys endpoint
+    """
+
+    keys: dict = {}
+    requests_count: int = 0
+
+    def do_GET(self) -> None:
+        PublicKeysHandler.requests_count += 1
+        key = self.keys.get(self.path.rsplit('/', 1)[-1])
+        self.send_response(200 if key else 404)
+        self.end_headers()
+        if key:
+            self.wfile.write(key)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class AuthKeysCacheTest(MainTest):
+    """
+    Tests for cached verification of users JWT with stub authorization service
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        cls.private_key = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+        cls.public_key = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    def setUp(self) -> None:
+        super().setUp()
+        PublicKeysHandler.keys = {'key1': self.public_key, 'key2': self.public_key}
+        PublicKeysHandler.requests_count = 0
+        self.server = HTTPServer(('127.0.0.1', 0), PublicKeysHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.auth_url = 'http://127.0.0.1:%d/auth/public_key/' % self.server.server_address[1]
+        auth.keys_cache.clear()
+        auth.tokens_cache.clear()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def get_token(self, key_id: str, username: str) -> str:
+        """
+        Get token signed by authorization service
+        """
+        return jwt.encode(
+            {'username': username, 'group': 'student'},
+            self.private_key,
+            algorithm='RS256',
+            headers={'kid': key_id}).decode()
+
+    def test_public_keys_cache(self) -> None:
+        """
+        Test that public key is requested once per key id and unknown key ids are cached
+        """
+        with self.settings(AUTH_URL=self.auth_url):
+            self.assertEqual(auth.decode(self.get_token('key1', 'student1'))['username'], 'student1')
+            self.assertEqual(auth.decode(self.get_token('key1', 'student2'))['username'], 'student2')
+            self.assertEqual(PublicKeysHandler.requests_count, 1)
+
+            self.assertEqual(auth.decode(self.get_token('key2', 'student1'))['username'], 'student1')
+            self.assertEqual(PublicKeysHandler.requests_count, 2)
+
+            for _ in range(2):
+                with self.assertRaises(jwt.exceptions.InvalidKeyError):
+                    auth.decode(self.get_token('key3', 'student1'))
+            self.assertEqual(PublicKeysHandler.requests_count, 3)
+
+    def test_verified_tokens_cache(self) -> None:
+        """
+        Test that signature of token is verified once and tampered token is rejected
+        """
+        token = self.get_token('key1', 'student1')
+        with self.settings(AUTH_URL=self.auth_url), mock.patch.object(jwt, 'decode', wraps=jwt.decode) as decode:
+            self.assertEqual(auth.decode(token)['username'], 'student1')
+            self.assertEqual(auth.decode(token)['username'], 'student1')
+            self.assertEqual(decode.call_count, 1)
+
+            payload, signature = token.rsplit('.', 1)
+            signature = signature[:10] + ('A' if signature[10] != 'A' else 'B') + signature[11:]
+            with self.assertRaises(jwt.InvalidTokenError):
+                auth.decode('%s.%s' % (payload, signature))
+
+
 class AccessRightsTest(MainTest):
     """
     Testing access rights of various user groups
@@ -277,6 +1436,29 @@ class AccessRightsTest(MainTest):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Слушатель')
 
+    def test_roles_cache(self) -> None:
+        """
+        Test that groups of user are cached in session and reread when they are changed
+        """
+        client = Client()
+        client.login(
+            username=self.student.username,
+            password=''
+        )
+        client.get(reverse('main:available_tests'))
+        self.assertEqual(client.session[decorators.ROLES_SESSION_KEY]['roles'], ['student'])
+        response = client.get(reverse('main:tests'))
+        self.assertEqual(response.status_code, 302)
+
+        self.student.groups.add(1)
+        response = client.get(reverse('main:tests'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(client.session[decorators.ROLES_SESSION_KEY]['roles']), {'student', 'lecturer'})
+
+        self.student.groups.remove(1)
+        response = client.get(reverse('main:tests'))
+        self.assertEqual(response.status_code, 302)
+
 
 '''
 class TestAddingTest(MainTest):
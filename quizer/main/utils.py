@@ -2,19 +2,24 @@
 """
 Some utils for views
 """
+import copy
 import json
+import random
+from datetime import datetime, timedelta
 
-import jwt
-import requests
 from bson import ObjectId
 
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-from django.http import HttpRequest
+from django.core import signing
+from django.http import HttpRequest, HttpResponse
 from django.conf import settings
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.html import escape
 
+from . import auth
 from .models import Test, Subject, QuestionType
-from .mongo import get_conn, QuestionsStorage
+from .media import render_all
+from .mongo import get_conn, QuestionsStorage, MediaStorage
 
 
 class InvalidFileFormatError(Exception):
@@ -77,15 +82,13 @@ class SubjectParser:
 
 def get_auth_data(request: HttpRequest) -> tuple:
     """
-    Get user's username and group using 'user_jqt' cookies
+    Get user's username and group using 'user_jqt' cookies, see main.auth
 
     :param request: <HttpRequest>
     :return: tuple(username: str, group: str)
     """
     user_jwt = request.COOKIES.get('user_jwt', '')
-    key_id = jwt.get_unverified_header(user_jwt).get('kid')
-    public_key = requests.get(settings.AUTH_URL + key_id).text
-    decoded_jwt = jwt.decode(user_jwt, public_key, algorithms='RS256')
+    decoded_jwt = auth.decode(user_jwt)
     username = decoded_jwt.get('username', '')
     group = decoded_jwt.get('group', '')
     return username, group
@@ -125,13 +128,16 @@ def get_question_from_request(request: HttpRequest, test: Test) -> dict:
             raise InvalidFileFormatError('empty options are not allowed')
     else:
         options = []
-        for i, file_name in enumerate(request.FILES):
-            path = f'{test.subject.name}/{test.name}/{question["_id"]}/{i}.{file_name.split(".")[-1]}'
-            default_storage.save(path, ContentFile(request.FILES[file_name].read()))
+        media_storage = MediaStorage.connect(db=get_conn())
+        for file_name in request.FILES:
+            path = media_storage.save(
+                content=request.FILES[file_name].read(),
+                extension=file_name.split('.')[-1] if '.' in file_name else '')
             options.append({
                 'option': path,
                 'is_true': request.POST[file_name] == 'true'
             })
+        render_all([option['option'] for option in options])
         question['options'] = options
     return question
 
@@ -216,62 +222,371 @@ def get_questions_list(request: HttpRequest) -> list:
     return parse_questions(content)
 
 
-def get_test_result(request: HttpRequest, right_answers: dict, test_duration: int) -> dict:
+def get_answer_key(question: dict) -> list:
+    """
+    Get right options of question, options of sequence are sorted in right order
+
+    :param question: <dict>
+    :return: <list: dict>, options
+    """
+    if question['type'] == QuestionType.SEQUENCE or question['type'] == QuestionType.SEQUENCE_WITH_IMAGES:
+        right_options = copy.deepcopy(question['options'])
+        right_options.sort(key=lambda option: int(option['num']))
+        return right_options
+    return [option for option in question['options'] if option['is_true']]
+
+
+def get_right_answers(test_questions: list, answer_keys: list = None) -> dict:
+    """
+    Get right answers for questions of running test
+
+    :param test_questions: <list> of questions with shuffled options
+    :param answer_keys: <list>, precomputed 'get_answer_key' of every question, see mongo.TestsSnapshotsStorage
+    :return: <dict>, {question_num: {
+        'right_answers': <list: dict>,
+        'id': str(ObjectId()),
+        'right_options': <list: str>, compiled answer key compared with selected options by 'grade_answers',
+        'is_sequence': <bool>, True if order of selected options matters
+    }}
+    """
+    if answer_keys is None:
+        answer_keys = [get_answer_key(question) for question in test_questions]
+    return {
+        str(i + 1): {
+            'right_answers': answer_key,
+            'id': str(question['_id']),
+            'right_options': [option['option'] for option in answer_key],
+            'is_sequence': question['type'] in (QuestionType.SEQUENCE, QuestionType.SEQUENCE_WITH_IMAGES)
+        } for i, (question, answer_key) in enumerate(zip(test_questions, answer_keys))
+    }
+
+
+def get_run_test_context(test: Test, test_questions: list, right_answers: dict) -> dict:
+    """
+    Get context of running test page, questions are split to groups of 25
+
+    :param test: <Test>
+    :param test_questions: <list> of questions
+    :param right_answers: <dict>, see 'get_right_answers'
+    :return: <dict>
+    """
+    if len(test_questions) < 25:
+        group_size = len(test_questions)
+    else:
+        group_size = 25
+    questions_list = list(zip(*[iter(test_questions)] * group_size))
+    questions_list += [test_questions[len(questions_list) * group_size:]]
+    questions_list = [(questions_group, len(questions_group) * i) for i, questions_group in enumerate(questions_list)]
+    return {
+        'title': 'Тест',
+        'questions': test_questions,
+        'questions_list': questions_list,
+        'test_duration': test.duration,
+        'test_name': test.name,
+        'right_answers': right_answers,
+    }
+
+
+# Placeholders of user-specific parts of pregenerated variants pages
+VARIANT_CSRF_TOKEN = 'quizer-variant-csrf-token-3f9b1c'
+VARIANT_USERNAME = 'quizer-variant-username-3f9b1c'
+
+
+def render_variant_page(test: Test, test_questions: list, right_answers: dict) -> str:
+    """
+    Render running test page of pregenerated variant (see mongo.TestsVariantsStorage),
+    CSRF token and username are rendered as placeholders filled by 'get_variant_response'
+
+    :param test: <Test>
+    :param test_questions: <list> of questions with shuffled options
+    :param right_answers: <dict>, see 'get_right_answers'
+    :return: <str>, HTML
+    """
+    context = get_run_test_context(test=test, test_questions=test_questions, right_answers=right_answers)
+    context['csrf_token'] = VARIANT_CSRF_TOKEN
+    context['user'] = {'username': VARIANT_USERNAME}
+    return render_to_string('main/student/runTest.html', context)
+
+
+def get_variant_response(request: HttpRequest, page: str) -> HttpResponse:
+    """
+    Get response with pregenerated variant page for user of 'request'
+
+    :param request: <HttpRequest>
+    :param page: <str>, page rendered by 'render_variant_page'
+    :return: <HttpResponse>
+    """
+    page = page.replace(VARIANT_CSRF_TOKEN, get_token(request))
+    return HttpResponse(page.replace(VARIANT_USERNAME, escape(request.user.username)))
+
+
+def make_variant(test: Test, snapshot: list = None, test_questions: list = None):
+    """
+    Make variant of running test from sampled questions: shuffle their options,
+    compile answer keys and render page. Questions of launch snapshot are used if
+    there are any, otherwise questions sampled from live questions bank
+
+    :param test: <Test>
+    :param snapshot: <list: dict>, entries sampled by mongo.TestsSnapshotsStorage.sample
+    :param test_questions: <list> of questions sampled by mongo.QuestionsStorage.sample
+    :return: <dict>, {'right_answers': <dict>, 'page': <str>}, None if there are not enough questions
+    """
+    answer_keys = None
+    if snapshot:
+        test_questions = [entry['question'] for entry in snapshot]
+        answer_keys = [entry['answer_key'] for entry in snapshot]
+    test_questions = test_questions or []
+    if len(test_questions) < test.tasks_num:
+        return None
+    for question in test_questions:
+        random.shuffle(question['options'], random.random)
+    right_answers = get_right_answers(test_questions, answer_keys)
+    return {
+        'right_answers': right_answers,
+        'page': render_variant_page(test=test, test_questions=test_questions, right_answers=right_answers)
+    }
+
+
+ATTEMPT_TOKEN_COOKIE = 'attempt'
+ATTEMPT_TOKEN_SALT = 'main.utils.attempt_token'
+
+
+def set_attempt_token(response: HttpResponse, attempt_id: ObjectId, user_id: int,
+                      test_id: int, test_duration: int) -> HttpResponse:
+    """
+    Issue signed token of started attempt in cookie of 'response'. Token holds
+    deadline of attempt, so its time left is checked without reading MongoDB
+
+    :param response: <HttpResponse>, page of running test
+    :param attempt_id: <ObjectId>, id returned by mongo.RunningTestsAnswersStorage.add
+    :param user_id: <int>, user who passes test
+    :param test_id: <int>
+    :param test_duration: <int>, test duration in seconds
+    :return: <HttpResponse>, same response
+    """
+    token = signing.dumps({
+        'attempt_id': str(attempt_id),
+        'user_id': user_id,
+        'test_id': test_id,
+        'deadline': datetime.now().timestamp() + test_duration
+    }, salt=ATTEMPT_TOKEN_SALT)
+    response.set_cookie(
+        ATTEMPT_TOKEN_COOKIE, token,
+        max_age=test_duration + settings.ATTEMPT_GRACE_SECONDS,
+        httponly=True,
+        samesite='Lax')
+    return response
+
+
+def get_attempt_response(request: HttpRequest, test: Test, variant: dict, attempt_id: ObjectId) -> HttpResponse:
+    """
+    Get running test page of started attempt with its token
+
+    :param request: <HttpRequest>
+    :param test: <Test>
+    :param variant: <dict>, see 'make_variant'
+    :param attempt_id: <ObjectId>, id returned by mongo.RunningTestsAnswersStorage.start
+    :return: <HttpResponse>
+    """
+    return set_attempt_token(
+        response=get_variant_response(request=request, page=variant['page']),
+        attempt_id=attempt_id,
+        user_id=request.user.id,
+        test_id=test.id,
+        test_duration=test.duration)
+
+
+def get_attempt_token(cookies: dict, user_id: int):
+    """
+    Get attempt token issued by 'set_attempt_token'
+
+    :param cookies: <dict>, request cookies
+    :param user_id: <int>, current user
+    :return: <dict> or None if there is no valid token of 'user_id'
+    """
+    try:
+        token = signing.loads(cookies.get(ATTEMPT_TOKEN_COOKIE, ''), salt=ATTEMPT_TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    return token if token.get('user_id') == user_id else None
+
+
+def get_token_left_time(token: dict) -> float:
+    """
+    Get left time of attempt
+
+    :param token: <dict>, see 'get_attempt_token'
+    :return: <float>, seconds, negative if test duration is over
+    """
+    return token['deadline'] - datetime.now().timestamp()
+
+
+def is_token_expired(token: dict) -> bool:
+    """
+    Check that attempt is over with grace period, so it is graded by attempts reaper (see main.reaper)
+
+    :param token: <dict>, see 'get_attempt_token'
+    :return: <bool>
+    """
+    return get_token_left_time(token) < -settings.ATTEMPT_GRACE_SECONDS
+
+
+def get_expired_attempt_context() -> dict:
+    """
+    Get context of results page of attempt finished after test duration and grace period
+
+    :return: <dict>
+    """
+    return {
+        'title': 'Результаты тестирования',
+        'message_title': 'Время истекло',
+        'message': 'Ответы не приняты, так как время прохождения теста истекло'
+    }
+
+
+def is_submission_expired(request: HttpRequest) -> bool:
+    """
+    Check that answers of 'request' are sent after test duration and grace period
+
+    :param request: <HttpRequest>
+    :return: <bool>
+    """
+    token = get_attempt_token(cookies=request.COOKIES, user_id=request.user.id)
+    return token is not None and is_token_expired(token)
+
+
+def grade_submission(request: HttpRequest, attempt: dict) -> tuple:
+    """
+    Grade answers of passed test sent by student
+
+    :param request: <HttpRequest>, POST request of results page
+    :param attempt: <dict>, attempt popped by mongo.RunningTestsAnswersStorage.pop, None if
+                    there is no attempt. Answers sent after attempt deadline are still graded,
+                    but result is marked as late and time of passing is capped by test duration
+    :return: <tuple>, (result to add to running test or None, context of results page
+             or None if user must be redirected to available tests page)
+    """
+    if attempt is None:
+        if is_submission_expired(request):  # attempt was graded by attempts reaper
+            return None, get_expired_attempt_context()
+        return None, None
+    is_late = datetime.now() + timedelta(hours=3) > attempt['deadline']
+    result = get_test_result(
+        request=request,
+        right_answers=attempt['right_answers'],
+        test_duration=attempt['test_duration'],
+        is_late=is_late)
+    message = 'Число правильных ответов: %d/%d' % (result['right_answers_count'], result['tasks_num'])
+    if is_late:
+        return result, {
+            'title': 'Результаты тестирования',
+            'message_title': 'Время истекло',
+            'message': 'Ответы отправлены после окончания времени прохождения теста. ' + message
+        }
+    return result, {
+        'title': 'Результаты тестирования',
+        'message_title': 'Результат',
+        'message': message
+    }
+
+
+def get_test_result(request: HttpRequest, right_answers: dict, test_duration: int, is_late: bool = False) -> dict:
     """
     Get testing result from HttpRequest object
 
     :param request: <HttpRequest>
     :param right_answers: dict with right_answers
     :param test_duration: <int>< duration of passed test
+    :param is_late: <bool>, answers are sent after attempt deadline, result is marked
+                    with 'is_late' field and time of passing is test duration
     :return: dict with testing result
     """
-    response = dict(request.POST)
-    response.pop('csrfmiddlewaretoken')
-    time = response.get('time', ['0'])[0]
-
     answers = {}
-    for key in response:
-        """
-            'key' for multiselect: {question_num}_{selected_option}: ['on']
-            'key' for single: {question_num}: ['{selected_option}']
-        """
-        buf = key.split('_')
-        if len(buf) == 1:
-            if len(response[key]) > 1:
-                answers[buf[0]] = response[key]
-            else:
-                answers[buf[0]] = [response[key][0]]
-        else:
-            option = '_'.join(buf[1:])
-            if buf[0] in answers:
-                answers[buf[0]].append(option)
-            else:
-                answers[buf[0]] = [option]
-
+    for key, values in request.POST.lists():
+        # 'key' for multiselect: {question_num}_{selected_option}: ['on']
+        # 'key' for single and sequence: {question_num}: <list: selected_option>
+        question_num, separator, option = key.partition('_')
+        if question_num in right_answers:
+            answers.setdefault(question_num, []).extend([option] if separator else values)
+
+    result = grade_answers(
+        answers=answers,
+        right_answers=right_answers,
+        test_duration=test_duration,
+        time_left=0 if is_late else int(request.POST.get('time', '0')),
+        user_id=request.user.id,
+        username=request.user.username)
+    if is_late:
+        result['is_late'] = True
+    return result
+
+
+def grade_answers(answers: dict, right_answers: dict, test_duration: int,
+                  time_left: int, user_id: int, username: str) -> dict:
+    """
+    Get testing result for selected answers. Selected options of sequences are compared
+    in order, options of other questions are compared as sets
+
+    :param answers: <dict>, {question_num: <list: str>, selected options}
+    :param right_answers: dict with right_answers, see 'get_right_answers'
+    :param test_duration: <int>, duration of passed test
+    :param time_left: <int>, time left when test was finished
+    :param user_id: <int>, user who passed test
+    :param username: <str>
+    :return: dict with testing result
+    """
     right_answers_count = 0
     questions = []
-    for question_num in right_answers:
-        questions.append({
-            'id': right_answers[question_num]['id'],
-            'selected_answers': answers[question_num] if question_num in answers else [],
-            'right_answers': [item['option'] for item in right_answers[question_num]['right_answers']]
-        })
-        if question_num in answers:
-            if [item['option'] for item in right_answers[question_num]['right_answers']] == answers[question_num]:
-                right_answers_count += 1
-                questions[-1]['is_true'] = True
-            else:
-                questions[-1]['is_true'] = False
+    for question_num, answer_key in right_answers.items():
+        right_options = answer_key.get('right_options')
+        if right_options is None:  # attempt was started before answer keys were compiled
+            right_options = [item['option'] for item in answer_key['right_answers']]
+        selected = answers.get(question_num)
+        question = {
+            'id': answer_key['id'],
+            'selected_answers': selected or [],
+            'right_answers': right_options
+        }
+        questions.append(question)
+        if selected is None:
+            continue
+        question['is_true'] = selected == right_options or (
+            not answer_key.get('is_sequence', True)
+            and len(selected) == len(right_options)
+            and set(selected) == set(right_options))
+        right_answers_count += question['is_true']
     return {
-        'user_id': request.user.id,
-        'username': request.user.username,
-        'time': test_duration - int(time),
+        'user_id': user_id,
+        'username': username,
+        'time': test_duration - time_left,
         'tasks_num': len(right_answers),
         'right_answers_count': right_answers_count,
         'questions': questions
     }
 
 
+def get_results_filters(query_params) -> dict:
+    """
+    Parse tests results filters from request query parameters
+
+    :param query_params: <QueryDict>, may contain 'subject_id', 'lecturer_id', 'test_id',
+                         'date_from' and 'date_to' in format 'YYYY-MM-DD'
+    :return: <dict>, filters for mongo.TestsResultsStorage.get_tests_results_page
+    :raises ValueError: if some of parameters are invalid
+    """
+    filters = {}
+    for param, field in [('subject_id', 'subject_id'),
+                         ('lecturer_id', 'launched_lecturer_id'),
+                         ('test_id', 'test_id')]:
+        if query_params.get(param):
+            filters[field] = int(query_params[param])
+    if query_params.get('date_from'):
+        filters['date_from'] = datetime.strptime(query_params['date_from'], '%Y-%m-%d')
+    if query_params.get('date_to'):
+        filters['date_to'] = datetime.strptime(query_params['date_to'], '%Y-%m-%d') + timedelta(days=1)
+    return filters
+
+
 def parse_questions_file(file_name: str) -> list:
     """
     Parse file with questions to questions list
@@ -315,9 +630,10 @@ def add_subject_with_tests(request: HttpRequest) -> str:
         tests_count += 1
         try:
             questions_list = parse_questions(test_data.read().decode('utf-8'))
-            for question in questions_list:
-                storage.add_one(question=question, test_id=test.id)
-            questions_count += len(questions_list)
+            result = storage.add_many(questions=questions_list, test_id=test.id)
+            for error in result['errors']:
+                print('%s - ошибка при добавлении вопроса %d к тесту %s' % (error['message'], error['index'], test_name))
+            questions_count += result['inserted_count']
         except UnicodeDecodeError as e:
             print('%s - ошибка при обработке файла с вопросами к тесту %s' % (e, test_name))
         except InvalidFileFormatError as e:
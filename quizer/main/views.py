@@ -1,23 +1,24 @@
 # pylint: disable=import-error, line-too-long, relative-beyond-top-level
 """Quizer backend"""
 import random
-import copy
 from datetime import datetime, timedelta
 
-from jwt import DecodeError
+from jwt.exceptions import PyJWTError
 
 from django.contrib.auth.models import User
 from django.contrib.auth import login, logout
 from django.shortcuts import render, redirect, reverse
 from django.utils.decorators import method_decorator
 from django.http import JsonResponse, HttpResponse
-from django.conf import settings
 from django.views import View
+from django.views.static import serve
+from django.conf import settings
 
 from . import mongo
 from . import utils
-from .decorators import unauthenticated_user, allowed_users, post_method
-from .models import Test, Subject, QuestionType
+from . import journal
+from .decorators import unauthenticated_user, allowed_users, post_method, get_user_roles
+from .models import Test, Subject
 from .forms import SubjectForm, TestForm
 
 
@@ -37,7 +38,7 @@ def login_page(request):
     logout(request)
     try:
         username, group = utils.get_auth_data(request)
-    except DecodeError:
+    except PyJWTError:
         return HttpResponse("JWT decode error: chet polomalos'")
     group2id = {
         'dev': 1,
@@ -63,10 +64,6 @@ def login_page(request):
     if not user.groups.filter(name=id2group[group2id[group]]):
         return HttpResponse("User with username '%s' already exist." % user.username)
     login(request, user)
-    mongo.set_conn(
-        host=settings.DATABASES['default']['HOST'],
-        port=settings.DATABASES['default']['PORT'],
-        db_name=settings.DATABASES['default']['NAME'])
     return redirect(reverse('main:available_tests'))
 
 
@@ -80,49 +77,29 @@ def lecturer_run_test(request, test_id):
         return redirect(reverse('main:available_tests'))
 
     storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
-    test_questions = storage.get_many(test_id=test.id)
+    test_questions = storage.sample(test_id=test.id, k=test.tasks_num)
     if len(test_questions) < test.tasks_num:
         return redirect(reverse('main:available_tests'))
 
-    test_questions = random.sample(test_questions, k=test.tasks_num)
     for question in test_questions:
         random.shuffle(question['options'])
 
-    right_answers = {}
-    for i, question in enumerate(test_questions):
-        if question['type'] == QuestionType.SEQUENCE or question['type'] == QuestionType.SEQUENCE_WITH_IMAGES:
-            right_options = copy.deepcopy(question['options'])
-            right_options.sort(key=lambda option: int(option['num']))
-        else:
-            right_options = [option for option in question['options'] if option['is_true']]
-        right_answers[str(i + 1)] = {
-            'right_answers': right_options,
-            'id': str(question['_id'])
-        }
+    right_answers = utils.get_right_answers(test_questions)
     storage = mongo.RunningTestsAnswersStorage.connect(db=mongo.get_conn())
     storage.cleanup(user_id=request.user.id)
-    storage.add(
+    attempt_id = storage.add(
         right_answers=right_answers,
         test_id=test.id,
         user_id=request.user.id,
         test_duration=test.duration)
 
-    if len(test_questions) < 25:
-        group_size = len(test_questions)
-    else:
-        group_size = 25
-    questions_list = list(zip(*[iter(test_questions)] * group_size))
-    questions_list += [test_questions[len(questions_list) * group_size:]]
-    questions_list = [(questions_group, len(questions_group) * i) for i, questions_group in enumerate(questions_list)]
-    context = {
-        'title': 'Тест',
-        'questions': test_questions,
-        'questions_list': questions_list,
-        'test_duration': test.duration,
-        'test_name': test.name,
-        'right_answers': right_answers,
-    }
-    return render(request, 'main/lecturer/runTest.html', context)
+    context = utils.get_run_test_context(test=test, test_questions=test_questions, right_answers=right_answers)
+    return utils.set_attempt_token(
+        response=render(request, 'main/lecturer/runTest.html', context),
+        attempt_id=attempt_id,
+        user_id=request.user.id,
+        test_id=test.id,
+        test_duration=test.duration)
 
 
 class AvailableTestsView(View):
@@ -140,7 +117,7 @@ class AvailableTestsView(View):
         For lecturer - displays list of tests that can be run
         For student - displays list of running tests
         """
-        if request.user.groups.filter(name='lecturer'):
+        if 'lecturer' in get_user_roles(request):
             return self.lecturer_available_tests(request)
         return self.student_available_tests(request)
 
@@ -172,20 +149,17 @@ class AvailableTestsView(View):
     def lecturer_passed_test_result(self, request):
         """Test results"""
         storage = mongo.RunningTestsAnswersStorage.connect(db=mongo.get_conn())
-        passed_test_answers = storage.get(user_id=request.user.id)
-
+        passed_test_answers = storage.pop(user_id=request.user.id)
         test_id = passed_test_answers['test_id']
-        storage.delete(user_id=request.user.id)
 
         result = utils.get_test_result(
             request=request,
             right_answers=passed_test_answers['right_answers'],
             test_duration=passed_test_answers['test_duration'])
 
-        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
-        storage.add_results_to_running_test(
-            test_result=result,
-            test_id=test_id)
+        journal.submit_result(
+            test_id=test_id,
+            test_result=result)
 
         self.context = {
             'title': 'Доступные тесты',
@@ -262,28 +236,17 @@ class PassedTestView(View):
     def get_passed_test_results(self, request):
         """Test results"""
         storage = mongo.RunningTestsAnswersStorage.connect(db=mongo.get_conn())
-        passed_test_answers = storage.get(user_id=request.user.id)
-        if not passed_test_answers:
+        attempt = storage.pop(user_id=request.user.id)
+        result, self.context = utils.grade_submission(request=request, attempt=attempt)
+        if result is not None:
+            journal.submit_result(
+                test_id=attempt['test_id'],
+                test_result=result)
+        if self.context is None:
             return redirect(reverse('main:available_tests'))
-        test_id = passed_test_answers['test_id']
-        storage.delete(user_id=request.user.id)
-
-        result = utils.get_test_result(
-            request=request,
-            right_answers=passed_test_answers['right_answers'],
-            test_duration=passed_test_answers['test_duration'])
-
-        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
-        storage.add_results_to_running_test(
-            test_result=result,
-            test_id=test_id)
-
-        self.context = {
-            'title': 'Результаты тестирования',
-            'message_title': 'Результат',
-            'message': 'Число правильных ответов: %d/%d' % (result['right_answers_count'], result['tasks_num'])
-        }
-        return render(request, self.template, self.context)
+        response = render(request, self.template, self.context)
+        response.delete_cookie(utils.ATTEMPT_TOKEN_COOKIE)
+        return response
 
 
 @unauthenticated_user
@@ -302,6 +265,7 @@ def get_running_tests(request):
 def stop_running_test(request):
     """Displays page with results of passing stopped test"""
     test = Test.objects.get(id=int(request.POST['test_id']))
+    journal.flush_submissions()
     storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
     test_results = storage.get_running_test_results(
         test_id=test.id,
@@ -359,65 +323,44 @@ def show_test_results(request, test_results_id):
 @allowed_users(allowed_roles=['student'])
 def student_run_test(request):
     test = Test.objects.get(id=int(request.POST['test_id']))
-    storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
-    test_questions = storage.get_many(test_id=test.id)
-    test_questions = random.sample(test_questions, k=test.tasks_num)
-
-    for question in test_questions:
-        random.shuffle(question['options'], random.random)
+    storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
+    launch_id = storage.get_running_launch_id(test_id=test.id)
+    storage = mongo.TestsVariantsStorage.connect(db=mongo.get_conn())
+    variant = storage.claim(launch_id=launch_id) if launch_id else None
+    if variant is None:  # pool of variants is empty
+        storage = mongo.TestsSnapshotsStorage.connect(db=mongo.get_conn())
+        snapshot = storage.sample(launch_id=launch_id, k=test.tasks_num) if launch_id else []
+        storage = mongo.QuestionsStorage.connect(db=mongo.get_conn())
+        test_questions = storage.sample(test_id=test.id, k=test.tasks_num) if not snapshot else []
+        variant = utils.make_variant(test=test, snapshot=snapshot, test_questions=test_questions)
+        if variant is None:
+            return redirect(reverse('main:available_tests'))
 
-    right_answers = {}
-    for i, question in enumerate(test_questions):
-        if question['type'] == QuestionType.SEQUENCE or question['type'] == QuestionType.SEQUENCE_WITH_IMAGES:
-            right_options = copy.deepcopy(question['options'])
-            right_options.sort(key=lambda option: int(option['num']))
-        else:
-            right_options = [option for option in question['options'] if option['is_true']]
-        right_answers[str(i + 1)] = {
-            'right_answers': right_options,
-            'id': str(question['_id'])
-        }
     storage = mongo.RunningTestsAnswersStorage.connect(db=mongo.get_conn())
-    docs = storage.cleanup(user_id=request.user.id)
-    storage.add(
-        right_answers=right_answers,
+    attempt_id = storage.start(
+        right_answers=variant['right_answers'],
         test_id=test.id,
         user_id=request.user.id,
         test_duration=test.duration)
-    for test_answers in docs:
-        result = utils.get_test_result(
-            request=request,
-            right_answers=test_answers['right_answers'],
-            test_duration=test_answers['test_duration'])
-        storage = mongo.TestsResultsStorage.connect(db=mongo.get_conn())
-        storage.add_results_to_running_test(
-            test_result=result,
-            test_id=test.id)
-
-    if len(test_questions) < 25:
-        group_size = len(test_questions)
-    else:
-        group_size = 25
-    questions_list = list(zip(*[iter(test_questions)] * group_size))
-    questions_list += [test_questions[len(questions_list) * group_size:]]
-    questions_list = [(questions_group, len(questions_group) * i) for i, questions_group in enumerate(questions_list)]
-
-    context = {
-        'title': 'Тест',
-        'questions': test_questions,
-        'questions_list': questions_list,
-        'test_duration': test.duration,
-        'test_name': test.name,
-        'right_answers': right_answers,
-    }
-    return render(request, 'main/student/runTest.html', context)
+    return utils.get_attempt_response(request=request, test=test, variant=variant, attempt_id=attempt_id)
 
 
 def get_left_time(request):
     """Return time that left for passing test"""
     if request.user.is_authenticated or request.method != 'POST':
+        token = utils.get_attempt_token(cookies=request.COOKIES, user_id=request.user.id)
+        if token is not None:
+            return JsonResponse({'time_left': utils.get_token_left_time(token)})
+        # attempt was started before tokens were issued
         storage = mongo.RunningTestsAnswersStorage.connect(db=mongo.get_conn())
         time_left = storage.get_left_time(user_id=request.user.id)
         if time_left is not None:
             return JsonResponse({'time_left': time_left})
     return JsonResponse({})
+
+
+def get_media_blob(request, path):
+    """Serve image from media store, its content never changes, so it is cached forever"""
+    response = serve(request, f'{mongo.MEDIA_BLOBS_DIR}/{path}', document_root=settings.MEDIA_ROOT)
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
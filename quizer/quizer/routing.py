@@ -1,16 +1,27 @@
 from django.conf.urls import url
+from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
 
-from main.consumers import RunningTestsConsumer
+from main.consumers import RunningTestsConsumer, AttemptTimerConsumer, LeftTimeConsumer, StudentRunTestConsumer, \
+    PassedTestConsumer
 
 application = ProtocolTypeRouter({
+    'http': URLRouter(
+        [
+            url(r'^get_left_time/$', AuthMiddlewareStack(LeftTimeConsumer.as_asgi())),
+            url(r'^test/$', AuthMiddlewareStack(StudentRunTestConsumer.as_asgi())),
+            url(r'^test_result/$', AuthMiddlewareStack(PassedTestConsumer.as_asgi())),
+            url(r'', get_asgi_application()),
+        ]
+    ),
     'websocket': AllowedHostsOriginValidator(
         AuthMiddlewareStack(
             URLRouter(
                 [
                     url(r'^available_tests/$', RunningTestsConsumer.as_asgi()),
+                    url(r'^get_left_time/$', AttemptTimerConsumer.as_asgi()),
                 ]
             )
         )
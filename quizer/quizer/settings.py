@@ -109,6 +109,82 @@ DATABASES = {
     }
 }
 
+# Options of pooled MongoClient shared by all requests of worker process (see main.mongo.ConnectionManager)
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': 100,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    'waitQueueTimeoutMS': 5000,
+    'connectTimeoutMS': 5000,
+    'serverSelectionTimeoutMS': 5000,
+    'socketTimeoutMS': 30000,
+    'connect': False,
+}
+
+# Question banks up to this size are sampled in-process, bigger ones - using MongoDB '$sample'
+QUESTIONS_SAMPLE_THRESHOLD = 200
+
+# Limits of in-process LRU cache of question banks (see main.mongo.QuestionsCache)
+QUESTIONS_CACHE_MAX_TESTS = 64
+QUESTIONS_CACHE_MAX_QUESTIONS = 20000
+
+# Number of questions inserted by one request on questions files loading
+QUESTIONS_INSERT_BATCH_SIZE = 500
+
+# Default and max number of tests launches on one page of results API
+RESULTS_PAGE_SIZE = 20
+RESULTS_MAX_PAGE_SIZE = 100
+
+# Width in seconds of passing time histogram buckets of questions statistics (see main.mongo.QuestionsStatsStorage)
+QUESTIONS_STATS_TIME_BUCKET = 30
+
+# Tests attempts expiry (see main.reaper): attempt is graded by reaper after test duration
+# and grace period, documents are removed by TTL index if reaper did not grade them
+ATTEMPT_GRACE_SECONDS = 60
+ATTEMPT_TTL_SECONDS = 86400
+REAPER_BATCH_SIZE = 100
+REAPER_INTERVAL = 30
+REAPER_CLAIM_TIMEOUT = 300
+
+# Write-behind journal of students results (see main.journal), flushed to MongoDB
+# by 'flush_submissions' command, results are written directly if path is empty.
+# Journal must be on persistent storage, not flushed results are lost with it
+SUBMISSIONS_JOURNAL_PATH = os.environ.get('SUBMISSIONS_JOURNAL_PATH', '')
+SUBMISSIONS_FLUSH_BATCH_SIZE = 500
+SUBMISSIONS_FLUSH_INTERVAL = 1
+
+# Interval in seconds between polls of running tests state by websockets publisher (see main.publisher)
+RUNNING_TESTS_POLL_INTERVAL = 1
+
+# Interval in seconds between time left messages of websocket attempts timer (see main.consumers.AttemptTimerConsumer)
+TEST_TIMER_SYNC_INTERVAL = 60
+
+# Max width and height in pixels of questions images renditions (see main.media),
+# renditions are created on upload by pool of workers, originals are kept
+MEDIA_RENDITIONS = {
+    'display': 1024,
+    'thumbnail': 400,
+}
+MEDIA_RENDITION_WORKERS = 4
+MEDIA_RENDITION_QUALITY = 85
+
+# In-process background jobs workers (see main.jobs), failed jobs are retried with
+# exponential backoff, finished jobs are kept for status requests for JOBS_TTL_SECONDS
+JOBS_WORKERS = 1
+JOBS_POLL_INTERVAL = 10
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 10
+JOBS_CLAIM_TIMEOUT = 300
+JOBS_TTL_SECONDS = 86400
+
+# Number of variants of launched test pregenerated in background jobs (see main.mongo.TestsVariantsStorage),
+# variants are generated by jobs of up to TEST_VARIANTS_BATCH_SIZE variants, pool is not used if size is 0
+TEST_VARIANTS_POOL_SIZE = 40
+TEST_VARIANTS_BATCH_SIZE = 10
+
+# Groups of user are cached in session for this number of seconds or until they are changed (see main.decorators)
+ROLES_CACHE_TTL = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -157,6 +233,16 @@ MEDIA_URL = '/media/'
 
 AUTH_URL = 'http://sms.gitwork.ru/auth/public_key/'
 
+# Public keys of authorization service are cached for AUTH_KEYS_TTL seconds and refreshed in background
+# AUTH_KEYS_REFRESH_AHEAD seconds before expiry, unknown key ids are cached for AUTH_MISSING_KEY_TTL seconds,
+# claims of up to AUTH_TOKENS_CACHE_SIZE verified tokens are cached until tokens expire (see main.auth)
+AUTH_TIMEOUT = 5
+AUTH_HTTP_POOL_SIZE = 10
+AUTH_KEYS_TTL = 3600
+AUTH_KEYS_REFRESH_AHEAD = 300
+AUTH_MISSING_KEY_TTL = 60
+AUTH_TOKENS_CACHE_SIZE = 10000
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
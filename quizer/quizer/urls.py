@@ -1,10 +1,13 @@
 from django.conf import settings
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf.urls.static import static
 
+from main import mongo, views
+
 urlpatterns = [
     path('', include('main.urls')),
-    path('api/', include('api.urls'))
+    path('api/', include('api.urls')),
+    re_path(r'^%s%s/(?P<path>.+)$' % (settings.MEDIA_URL.lstrip('/'), mongo.MEDIA_BLOBS_DIR), views.get_media_blob),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
 if settings.DEBUG: